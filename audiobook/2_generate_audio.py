@@ -5,7 +5,7 @@ import logging
 import time
 from pathlib import Path
 from tqdm import tqdm
-from chatterbox.tts_turbo import ChatterboxTurboTTS
+from tts_service import get_tts
 
 # Force float32 globally to avoid CPU dtype mismatch (float != double)
 torch.set_default_dtype(torch.float32)
@@ -25,8 +25,22 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def generate_audiobook(device="cpu"):
-    """Generate the complete audiobook from preprocessed chapters with multi-voice support."""
+def generate_audiobook(device="cpu", batch_size=1, workers=1, splice=False, quality="final", precision="fp32",
+                       backend=None, pipeline=False, profile=False, qa=True):
+    """Generate the complete audiobook from preprocessed chapters with multi-voice support.
+    
+    quality="draft" renders fast proof-listening audio into output/draft/, where
+    Stage 3 never picks it up for mastering. precision="bf16"/"int8" opts into
+    reduced-precision T3 inference (see tts_model.apply_precision); backend="onnx"
+    runs S3Gen through ONNX Runtime (see onnx_backend). pipeline=True overlaps T3
+    token generation with vocoding (see tts_synth.iter_pipelined). profile=True
+    times every synthesis stage per chapter (see tts_profiler; not in pool mode).
+    qa=False skips the per-segment QA scan and retakes (see segment_qa).
+    splice=True needs the in-process model, so it cannot be combined with workers > 1.
+    """
+    if splice and workers > 1:
+        raise ValueError("--splice re-renders in-process and cannot be used with --workers; run it without --workers")
+    
     logger.info("🎙️  Initializing Multi-Voice Chatterbox-Turbo TTS...")
     
     # Check for GPU
@@ -36,16 +50,22 @@ def generate_audiobook(device="cpu"):
         logger.warning("⚠️  CUDA not available, falling back to CPU")
         device = "cpu"
     
+    # Multi-process pool: each worker loads its own model on its own slice of cores
+    pool = None
+    if workers > 1 and device == "cpu":
+        from tts_pool import TTSWorkerPool
+        logger.info(f"🧵 Starting TTS pool with {workers} worker processes...")
+        pool = TTSWorkerPool(workers, device=device, quality=quality, precision=precision,
+                             backend=backend, pipeline=pipeline, qa=qa).start()
+        if profile:
+            logger.warning("⚠️  --profile times in-process synthesis only; ignored with --workers")
+    
     # Load model
     try:
-        model = ChatterboxTurboTTS.from_pretrained(device=device)
-        # Deep cast internal modules to float32 if on CPU
-        if device == "cpu":
-            for attr in ['t3', 've', 's3gen', 'vocoder']:
-                if hasattr(model, attr):
-                    getattr(model, attr).to(torch.float32)
+        # Without a pool, use the TTS service if it is running, else load the model here
+        model = None if pool else get_tts(device, precision=precision, backend=backend)
         
-        logger.info(f"✅ TTS Model loaded on {device}")
+        logger.info(f"✅ TTS Model loaded on {getattr(model, 'device', device)}")
     except Exception as e:
         logger.error(f"❌ Failed to load TTS model: {e}")
         return
@@ -112,9 +132,13 @@ def generate_audiobook(device="cpu"):
         logger.error(f"❌ Error reading manifest: {e}")
         return
     
-    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    output_dir = OUTPUT_DIR / "draft" if quality == "draft" else OUTPUT_DIR
+    output_dir.mkdir(parents=True, exist_ok=True)
+    if quality == "draft":
+        logger.info(f"📝 Draft quality: proof-listening audio goes to {output_dir}")
     
     from tts_helpers import generate_long_audio
+    from narration_script import compile_chapter
     
     while True:
         # Refresh manifest
@@ -127,34 +151,83 @@ def generate_audiobook(device="cpu"):
         total_chapters = len(chapters)
         any_new = False
         completed_in_run = 0
+        pool_jobs = []
         
         for chapter in chapters:
-            output_path = OUTPUT_DIR / f"{chapter['index']:02d}_{chapter['name']}.wav"
+            output_path = output_dir / f"{chapter['index']:02d}_{chapter['name']}.wav"
             prepped_file = Path(chapter['file'])
             
-            if output_path.exists() and output_path.stat().st_size > 1000:
-                continue
-                
             if not prepped_file.exists() or prepped_file.stat().st_size < 10:
                 continue
             
+            # Re-render when the narration text changed after the WAV was made;
+            # unchanged segments come straight from the segment cache.
+            if (output_path.exists() and output_path.stat().st_size > 1000
+                    and output_path.stat().st_mtime >= prepped_file.stat().st_mtime):
+                continue
+            
             logger.info(f"\n📚 Narrating: {chapter['name']}")
             try:
                 with open(prepped_file, 'r') as f:
                     text = f.read()
                 
+                # Parse once into the chapter's narration script; every step below reads it
+                script = compile_chapter(
+                    prepped_file, text,
+                    voice_map=active_voice_map,
+                    default_voice=default_voice
+                )
+                
+                # Edited chapter with a segment map: re-render only the changed paragraphs
+                if splice and model and output_path.exists():
+                    from splice_chapter import splice_chapter
+                    try:
+                        splice_chapter(
+                            text, model, output_path,
+                            voice_map=active_voice_map,
+                            default_voice=default_voice,
+                            quality=quality,
+                            script=script,
+                            qa=qa
+                        )
+                        any_new = True
+                        completed_in_run += 1
+                        continue
+                    except ValueError as e:
+                        logger.warning(f"⚠️  {e}")
+                
+                if pool:
+                    pool_jobs.append((output_path.stem, text, output_path, script))
+                    continue
+                
                 generate_long_audio(
                     text, model, output_path,
                     voice_map=active_voice_map,
-                    default_voice=default_voice
+                    default_voice=default_voice,
+                    batch_size=batch_size,
+                    quality=quality,
+                    script=script,
+                    pipeline=pipeline,
+                    profile=profile,
+                    qa=qa
                 )
                 any_new = True
                 completed_in_run += 1
             except Exception as e:
                 logger.error(f"❌ Error generating {chapter['name']}: {e}")
         
+        # Pool mode: all pending chapters share one segment queue, so workers steal across chapters
+        if pool_jobs:
+            done = pool.render_chapters(
+                pool_jobs,
+                voice_map=active_voice_map,
+                default_voice=default_voice
+            )
+            any_new = True
+            completed_in_run += len(done)
+        
         # Check progress
-        current_wavs = list(OUTPUT_DIR.glob("*.wav"))
+        current_wavs = list(output_dir.glob("*.wav"))
         completed_count = len([w for w in current_wavs if w.stat().st_size > 1000])
         
         # Continue waiting for more chapters
@@ -167,6 +240,29 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate audiobook from preprocessed chapters")
     parser.add_argument("--device", default="cpu", choices=["cuda", "cpu"], 
                        help="Device to use for TTS generation")
+    parser.add_argument("--batch-size", type=int, default=1,
+                       help="Same-voice lines synthesized per batched decode (1 = line by line)")
+    parser.add_argument("--workers", type=int, default=1,
+                       help="TTS worker processes, each pinned to its own slice of CPU cores")
+    parser.add_argument("--splice", action="store_true",
+                       help="Splice edited paragraphs into existing chapter WAVs instead of re-rendering them")
+    parser.add_argument("--quality", default="final", choices=["final", "draft"],
+                       help="draft = fast, rough proof-listening audio in output/draft/ (never mastered)")
+    parser.add_argument("--precision", default="fp32", choices=["fp32", "bf16", "int8"],
+                       help="T3 inference precision: bf16 autocast (CPUs with bf16 support) or int8 dynamic quantization")
+    parser.add_argument("--backend", default=None, choices=["torch", "onnx"],
+                       help="S3Gen backend: eager PyTorch or ONNX Runtime (default: $TTS_BACKEND or torch)")
+    parser.add_argument("--pipeline", action="store_true",
+                       help="Generate the next line's speech tokens while the current line is vocoded (two threads)")
+    parser.add_argument("--profile", action="store_true",
+                       help="Per-stage timing table and Chrome trace per chapter in output/profiles/")
+    parser.add_argument("--no-qa", action="store_true",
+                       help="Skip the per-segment QA scan that re-synthesizes silent, clipped or looping segments")
     args = parser.parse_args()
+    if args.splice and args.workers > 1:
+        parser.error("--splice re-renders in-process and cannot be used with --workers; run it without --workers")
     
-    generate_audiobook(device=args.device)
+    generate_audiobook(device=args.device, batch_size=args.batch_size, workers=args.workers, splice=args.splice,
+                       quality=args.quality, precision=args.precision,
+                       backend=args.backend, pipeline=args.pipeline, profile=args.profile,
+                       qa=not args.no_qa)
@@ -1,18 +1,25 @@
 import json
-import torchaudio as ta
-import torch
-import subprocess
+import struct
+import numpy as np
 from pathlib import Path
 from tqdm import tqdm
+from audio_meta import audio_info, audio_quality
+from mastering import master_chapters
+from resampling import DELIVERY_SAMPLE_RATE, resample_blocks, resample_chapters
+from wav_io import StreamingWavWriter, iter_wav_blocks, read_wav_info
 
 # Paths
 AUDIOBOOK_DIR = Path(__file__).parent
 OUTPUT_DIR = AUDIOBOOK_DIR / "output"
 # Final filenames aligned to Gelezinio Vilko Saga, Book I: Vilko Tremtis
-FINAL_UNMASTERED = OUTPUT_DIR / "GelezinioVilkoSaga_Book1_Unmastered.wav"
 FINAL_MASTERED = AUDIOBOOK_DIR / "GelezinioVilkoSaga_Book1_Complete.wav"
 TIMESTAMPS_FILE = OUTPUT_DIR / "timestamps.txt"
+# Exact chapter spans (frames) for the distribution export
+CHAPTERS_FILE = OUTPUT_DIR / "chapters.json"
 BACKGROUND_MUSIC = AUDIOBOOK_DIR / "background.mp3" # User can place a "background.mp3" here
+CHAPTER_GAP_SECONDS = 3.0
+# Frames per block: peak memory is a few blocks, whatever the book length
+BLOCK_FRAMES = 1 << 16
 
 def format_timestamp(seconds):
     """Format seconds into HH:MM:SS or MM:SS."""
@@ -23,8 +30,107 @@ def format_timestamp(seconds):
         return f"{h:02d}:{m:02d}:{s:02d}"
     return f"{m:02d}:{s:02d}"
 
-def concatenate_audiobook():
-    """Concatenate chapters, generate timestamps, and apply mastering."""
+def book_chapter_files():
+    """Chapter WAVs in book order (00_intro, 01..., 99_outro), without drafts or finished books."""
+    wav_files = sorted(OUTPUT_DIR.glob("*.wav"))
+    return [
+        f for f in wav_files
+        if f.name.endswith('.wav')
+        and not f.name.startswith('ShadowOfExtremism')
+        and not f.name.startswith('GelezinioVilkoSaga')
+        and audio_quality(f) != 'draft'
+    ]
+
+def chapter_info(path):
+    """Sample rate, channels and frame count from the WAV header (no decoding)."""
+    try:
+        info = read_wav_info(path)
+        info['memmap'] = True
+    except (ValueError, struct.error):
+        info = dict(audio_info(path, use_sidecar=False), memmap=False)
+    return info
+
+def iter_chapter_blocks(path, info):
+    """Yield float32 (frames, channels) blocks: memory-mapped for plain PCM/float WAVs, else via torchaudio."""
+    if info['memmap']:
+        try:
+            yield from iter_wav_blocks(path, BLOCK_FRAMES, info)
+            return
+        except ValueError:
+            # Sample format the WAV reader can't stream (e.g. 8-bit or A-law)
+            pass
+    import torchaudio as ta
+    for start in range(0, info['frames'], BLOCK_FRAMES):
+        block, _ = ta.load(str(path), frame_offset=start, num_frames=BLOCK_FRAMES)
+        yield block.numpy().T
+
+def delivered_path(path):
+    """Path of a joined chapter file as recorded in chapters.json (relative to the audiobook directory)."""
+    path = Path(path).resolve()
+    try:
+        return str(path.relative_to(AUDIOBOOK_DIR.resolve()))
+    except ValueError:
+        return str(path)
+
+def match_channels(block, channels):
+    """Down-mix or duplicate a (frames, channels) block to `channels` channels."""
+    if block.shape[1] == channels:
+        return block
+    mono = block.mean(axis=1, keepdims=True)
+    return np.repeat(mono, channels, axis=1)
+
+def join_chapters(wav_files, output_path, titles, sample_rate=None, sample_format='int16'):
+    """Stream chapters block by block into one WAV with CHAPTER_GAP_SECONDS between them.
+    
+    The first readable chapter fixes the channel count, and the sample rate
+    unless one is given; chapters at other rates are resampled in the stream. Returns
+    (chapters, sample rate, frames); each chapter is {'title', 'file', 'path', 'marker',
+    'start', 'end'} in frames, where the marker is the start of the gap before it
+    and `path` is the file that was joined.
+    """
+    # Header-only pass
+    infos = {}
+    for wav_file in wav_files:
+        try:
+            infos[wav_file] = chapter_info(wav_file)
+        except Exception as e:
+            print(f"❌ Error reading {wav_file.name}: {e}")
+    if not infos:
+        return [], 0, 0
+    first = next(iter(infos.values()))
+    sample_rate, channels = sample_rate or first['sample_rate'], first['channels']
+    
+    chapters = []
+    with StreamingWavWriter(output_path, sample_rate, channels, sample_format=sample_format) as writer:
+        for wav_file, info in tqdm(infos.items(), desc="Processing chapters"):
+            # Silence between chapters (the timestamp marks the start of the gap)
+            start_frames = writer.frames
+            if writer.frames:
+                writer.write_silence(CHAPTER_GAP_SECONDS)
+            audio_start = writer.frames
+            try:
+                blocks = iter_chapter_blocks(wav_file, info)
+                if info['sample_rate'] != sample_rate:
+                    blocks = resample_blocks(blocks, info['sample_rate'], sample_rate)
+                for block in blocks:
+                    writer.write(match_channels(block, channels).T)
+            except Exception as e:
+                print(f"❌ Error loading {wav_file.name}: {e}")
+                # Keep the book consistent: drop what was written of this chapter
+                writer.truncate(start_frames)
+                continue
+            
+            chapters.append({'title': titles[wav_file], 'file': wav_file.name, 'path': delivered_path(wav_file),
+                             'marker': start_frames, 'start': audio_start, 'end': writer.frames})
+    return chapters, sample_rate, writer.frames
+
+def concatenate_audiobook(sample_rate=DELIVERY_SAMPLE_RATE, sample_format='int16'):
+    """Concatenate chapters, generate timestamps, and apply mastering.
+    
+    Args:
+        sample_rate: Book sample rate; chapters are resampled to it once, in parallel
+        sample_format: 'int16' or 'int24' for the book WAV
+    """
     print("🎧 Stage 3: Concatenating and Mastering Audiobook...")
     
     # Load manifest to get proper titles
@@ -35,15 +141,7 @@ def concatenate_audiobook():
             manifest = json.load(f)
             chapter_titles = {f"{c['index']:02d}_{c['name']}.wav": c['name'].replace('-', ' ').title() for c in manifest}
     
-    # Find all chapter WAV files
-    wav_files = sorted(OUTPUT_DIR.glob("*.wav"))
-    # Filter out intro/outro and ensure they are sorted correctly (00_intro, 01..., 99_outro)
-    wav_files = [
-        f for f in wav_files
-        if f.name.endswith('.wav')
-        and not f.name.startswith('ShadowOfExtremism')
-        and not f.name.startswith('GelezinioVilkoSaga')
-    ]
+    wav_files = book_chapter_files()
     
     if not wav_files:
         print("❌ No chapter files found!")
@@ -51,93 +149,46 @@ def concatenate_audiobook():
     
     print(f"\n📚 Found {len(wav_files)} chapters to merge")
     
-    all_audio = []
-    sample_rate = None
-    timestamps = []
-    current_time = 0.0
+    # Per-chapter mastering: measured once per chapter content, applied in parallel
+    print("\n🔊 Mastering chapters (per-chapter loudness, EBU R128 targets)...")
+    mastered = master_chapters(wav_files)
     
-    for wav_file in tqdm(wav_files, desc="Processing chapters"):
-        try:
-            waveform, sr = ta.load(str(wav_file))
-            
-            # Map filename to human readable title
-            title = chapter_titles.get(wav_file.name, wav_file.stem.replace('_', ' ').title())
-            if "Intro" in title: title = "Introduction"
-            if "Outro" in title: title = "Conclusion"
-            
-            # Record timestamp
-            timestamps.append(f"{format_timestamp(current_time)} {title}")
-            
-            # Update cumulative time
-            duration = waveform.shape[1] / sr
-            current_time += duration
-            
-            # Verify sample rate consistency
-            if sample_rate is None:
-                sample_rate = sr
-            elif sr != sample_rate:
-                resampler = ta.transforms.Resample(sr, sample_rate)
-                waveform = resampler(waveform)
-            
-            # Add silence between chapters (e.g., 3 seconds)
-            silence_seconds = 3.0
-            silence_frames = int(sample_rate * silence_seconds)
-            silence_tensor = torch.zeros((waveform.shape[0], silence_frames), dtype=waveform.dtype)
-            
-            # Append silence to previous chapter if this is not the first one
-            if all_audio: 
-                all_audio.append(silence_tensor)
-                current_time += silence_seconds
-
-            all_audio.append(waveform)
-            
-        except Exception as e:
-            print(f"❌ Error loading {wav_file.name}: {e}")
+    # Delivery rate: each chapter resampled once (streaming, one process per chapter)
+    print(f"\n🎚️  Resampling chapters to {sample_rate} Hz...")
+    delivered = resample_chapters(list(mastered.values()), sample_rate)
+    
+    # Simple streaming join of the mastered chapters
+    print("\n🔗 Joining segments...")
+    titles = {}
+    for wav_file in wav_files:
+        # Map filename to human readable title
+        title = chapter_titles.get(wav_file.name, wav_file.stem.replace('_', ' ').title())
+        if "Intro" in title: title = "Introduction"
+        if "Outro" in title: title = "Conclusion"
+        titles[delivered[mastered[wav_file]]] = title
+    chapters, sample_rate, frames = join_chapters(list(titles), FINAL_MASTERED, titles, sample_rate, sample_format)
     
-    if not all_audio:
+    if not chapters:
         print("❌ No audio could be loaded!")
         return
+    current_time = frames / sample_rate
 
-    # 1. Save Timestamps
+    # Save Timestamps
+    timestamps = [f"{format_timestamp(c['marker'] / sample_rate)} {c['title']}" for c in chapters]
     with open(TIMESTAMPS_FILE, 'w') as f:
         f.write("\n".join(timestamps))
     print(f"📍 Timestamps generated: {TIMESTAMPS_FILE.name}")
-
-    # 2. Concatenate
-    print("\n🔗 Joining segments...")
-    final_audio = torch.cat(all_audio, dim=1)
-    ta.save(str(FINAL_UNMASTERED), final_audio, sample_rate)
-    
-    # 3. Mastering with FFmpeg (Normalizing + Optional Ambiance)
-    print("\n🔊 Starting Professional Mastering Phase...")
-    
-    # Build FFmpeg command
-    # Filter complex: 
-    # 3. Mastering with FFmpeg (Normalizing ONLY)
-    print("\n🔊 Starting Professional Mastering Phase...")
-    
-    loudnorm_filter = "loudnorm=I=-14:TP=-1.5:LRA=11"
-    
-    print("ℹ️  Normalizing narration to EBU R128 standard.")
-    cmd = [
-        "ffmpeg", "-y",
-        "-i", str(FINAL_UNMASTERED),
-        "-af", loudnorm_filter,
-        "-c:a", "pcm_s16le",
-        str(FINAL_MASTERED)
-    ]
-    
-    try:
-        subprocess.run(cmd, check=True, capture_output=True)
-        print("✅ Mastering complete! (EBU R128 Normalized)")
-    except subprocess.CalledProcessError as e:
-        print(f"❌ Mastering failed: {e.stderr.decode()}", flush=True)
-        # Fallback: copy unmastered
-        import shutil
-        shutil.copy(FINAL_UNMASTERED, FINAL_MASTERED)
+    with open(CHAPTERS_FILE, 'w') as f:
+        json.dump({'audio': FINAL_MASTERED.name, 'sample_rate': sample_rate, 'frames': frames,
+                   'chapters': chapters}, f, indent=2)
     
     print(f"\n✨ FINAL OUTPUT: {FINAL_MASTERED}", flush=True)
     print(f"📊 Duration: {format_timestamp(current_time)}", flush=True)
 
 if __name__ == "__main__":
-    concatenate_audiobook()
+    import argparse
+    parser = argparse.ArgumentParser(description="Stage 3: master, resample and join the chapters")
+    parser.add_argument("--sample-rate", type=int, default=DELIVERY_SAMPLE_RATE)
+    parser.add_argument("--format", default="int16", choices=["int16", "int24"])
+    args = parser.parse_args()
+    concatenate_audiobook(args.sample_rate, args.format)
@@ -99,7 +99,13 @@ def generate_video(audio_path, image_path, output_path, add_captions=False):
         return False
 
 def generate_captions(audio_path, output_srt):
-    """Generate SRT captions from audio using faster-whisper (Turbo)."""
+    """Generate SRT captions, from the chapter's narration script when available, else with faster-whisper (Turbo)."""
+    # Chapters rendered from a compiled script know exactly what was said and when
+    from narration_script import captions_from_script
+    if captions_from_script(Path(audio_path), output_srt):
+        print(f"✅ Captions written from narration script: {output_srt}")
+        return True
+    
     print("\n📝 Generating captions with faster-whisper (Turbo)...")
     
     try:
@@ -2,18 +2,68 @@
 """
 Technical Validation Stage for Audiobook
 Checks finalized audio against professional standards (ACX/Audible).
+
+Levels come from one native streaming pass per file (audio_analysis.py),
+cached by content hash; chapters are analysed in parallel.
 """
 
-import subprocess
-import json
-import re
+import sys
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).parent))
+
+from audio_analysis import analyze_file, analyze_files
+
 AUDIOBOOK_DIR = Path(__file__).parent
-FINAL_MASTER = AUDIOBOOK_DIR / "Miserable_Audiobook_Complete.wav"
+FINAL_MASTER = AUDIOBOOK_DIR / "GelezinioVilkoSaga_Book1_Complete.wav"
+OUTPUT_DIR = AUDIOBOOK_DIR / "output"
+MASTERED_DIR = OUTPUT_DIR / "mastered"
+RESAMPLED_DIR = OUTPUT_DIR / "resampled"
+# Stage 3's record of the chapters it joined
+CHAPTERS_FILE = OUTPUT_DIR / "chapters.json"
+
+# ACX limits
+PEAK_MAX_DB = -3.0
+RMS_RANGE_DB = (-23.0, -18.0)
+NOISE_FLOOR_MAX_DB = -60.0
+
+
+def acx_checks(analysis):
+    """ACX pass/fail checks for one analysis: list of {'check', 'value', 'status', 'standard', 'pass'}."""
+    results = []
+
+    def add(check, value, passed, standard, failure="❌ FAIL"):
+        results.append({"check": check, "value": value, "standard": standard, "pass": passed,
+                        "status": "✅ PASS" if passed else failure})
+
+    # Sample Rate Check (Prefer 44.1kHz or 48kHz)
+    sr = analysis['sample_rate']
+    add("Sample Rate", f"{sr} Hz", sr >= 44100, ">= 44100 Hz", "⚠️ WARNING")
+    add("Channels", "Mono" if analysis['channels'] == 1 else "Stereo", True, "Consistent")
+
+    # ACX standard: Peak <= -3.0 dB (measured as true peak, which catches inter-sample overs)
+    peak = analysis['true_peak_db']
+    add("Peak Level", f"{peak:.1f} dBTP", peak <= PEAK_MAX_DB, f"<= {PEAK_MAX_DB} dB")
+
+    # ACX standard: -23 dB to -18 dB RMS
+    rms = analysis['rms_db']
+    low, high = RMS_RANGE_DB
+    add("RMS Loudness", f"{rms:.1f} dB", low - 0.5 <= rms <= high + 0.5, f"{low:.0f}dB to {high:.0f}dB")
+
+    # ACX standard: noise floor (room tone in the pauses) <= -60 dB
+    noise = analysis['noise_floor_db']
+    if noise is None:
+        add("Noise Floor", "no pauses", False, f"<= {NOISE_FLOOR_MAX_DB:.0f} dB", "⚠️ WARNING")
+    else:
+        add("Noise Floor", f"{noise:.1f} dB", noise <= NOISE_FLOOR_MAX_DB, f"<= {NOISE_FLOOR_MAX_DB:.0f} dB")
+
+    add("Clipping", f"{analysis['clip_events']} events", analysis['clip_events'] == 0, "None")
+    return results
 
-def validate_audio(file_path):
-    """Perform technical validation on an audio file."""
+
+def validate_audio(file_path, chapters=None):
+    """Perform technical validation on an audio file (and, optionally, its chapter files)."""
+    file_path = Path(file_path)
     if not file_path.exists():
         print(f"❌ File not found: {file_path}")
         return False
@@ -21,92 +71,36 @@ def validate_audio(file_path):
     print(f"\n🧪 Validating: {file_path.name}")
     print("-" * 40)
 
-    results = []
-    all_pass = True
-
-    # 1. Check Format (Sample Rate, Channels)
-    probe_cmd = [
-        "ffprobe", "-v", "quiet", "-print_format", "json",
-        "-show_streams", "-show_format", str(file_path)
-    ]
     try:
-        probe_res = subprocess.run(probe_cmd, capture_output=True, text=True, check=True)
-        data = json.loads(probe_res.stdout)
-        stream = data['streams'][0]
-        
-        # Sample Rate Check (Prefer 44.1kHz or 48kHz)
-        sr = int(stream['sample_rate'])
-        sr_pass = sr >= 44100
-        results.append({
-            "check": "Sample Rate",
-            "value": f"{sr} Hz",
-            "status": "✅ PASS" if sr_pass else "⚠️ WARNING",
-            "standard": ">= 44100 Hz"
-        })
-        if not sr_pass: all_pass = False
-
-        # Channels (Mono vs Stereo)
-        channels = stream['channels']
-        results.append({
-            "check": "Channels",
-            "value": "Mono" if channels == 1 else "Stereo",
-            "status": "✅ PASS",
-            "standard": "Consistent"
-        })
-
+        analysis = analyze_file(file_path)
     except Exception as e:
-        print(f"❌ Probe failed: {e}")
+        print(f"❌ Analysis failed: {e}")
         return False
 
-    # 2. Check Levels (RMS and Peak)
-    # Using ffmpeg's volumedetect filter
-    vol_cmd = [
-        "ffmpeg", "-i", str(file_path),
-        "-af", "volumedetect",
-        "-f", "null", "/dev/null"
-    ]
-    try:
-        vol_res = subprocess.run(vol_cmd, capture_output=True, text=True, check=True)
-        vol_output = vol_res.stderr
-
-        # Extract Max Volume (Peak)
-        max_vol_match = re.search(r"max_volume: ([\-\d\.]+) dB", vol_output)
-        max_vol = float(max_vol_match.group(1)) if max_vol_match else 0.0
-        
-        # ACX standard: Peak <= -3.0 dB
-        peak_pass = max_vol <= -3.0
-        results.append({
-            "check": "Peak Level",
-            "value": f"{max_vol} dB",
-            "status": "✅ PASS" if peak_pass else "❌ FAIL",
-            "standard": "<= -3.0 dB"
-        })
-        if not peak_pass: all_pass = False
-
-        # Extract Mean Volume (RMS)
-        mean_vol_match = re.search(r"mean_volume: ([\-\d\.]+) dB", vol_output)
-        mean_vol = float(mean_vol_match.group(1)) if mean_vol_match else 0.0
-        
-        # ACX standard: -23 dB to -18 dB RMS
-        # Note: ffmpeg's mean_volume is close to RMS but not identical; it's a good proxy.
-        rms_pass = -23.5 <= mean_vol <= -17.5
-        results.append({
-            "check": "RMS Loudness",
-            "value": f"{mean_vol} dB",
-            "status": "✅ PASS" if rms_pass else "❌ FAIL",
-            "standard": "-23dB to -18dB"
-        })
-        if not rms_pass: all_pass = False
-
-    except Exception as e:
-        print(f"❌ Level check failed: {e}")
-        return False
+    results = acx_checks(analysis)
+    all_pass = all(r['pass'] for r in results)
 
     # Print Results Table
     print(f"{'CHECK':<15} | {'VALUE':<12} | {'STANDARD':<15} | {'STATUS'}")
     print("-" * 60)
     for r in results:
         print(f"{r['check']:<15} | {r['value']:<12} | {r['standard']:<15} | {r['status']}")
+    integrated = analysis['integrated_lufs']
+    print(f"\n📊 Integrated loudness: {integrated:.1f} LUFS, LRA {analysis['lra']:.1f} LU" if integrated is not None
+          else "\n📊 Integrated loudness: silent")
+
+    # ACX checks every uploaded file, so chapters must pass on their own too
+    if chapters:
+        print(f"\n📚 Chapters ({len(chapters)}):")
+        for chapter, chapter_analysis in analyze_files(chapters).items():
+            if chapter_analysis is None:
+                all_pass = False
+                continue
+            failed = [r['check'] for r in acx_checks(chapter_analysis) if not r['pass']]
+            all_pass = all_pass and not failed
+            print(f"   {'✅' if not failed else '❌'} {chapter.name:<40} "
+                  f"RMS {chapter_analysis['rms_db']:6.1f} dB | peak {chapter_analysis['true_peak_db']:5.1f} dBTP"
+                  + (f" | {', '.join(failed)}" if failed else ""))
 
     if all_pass:
         print("\n🏆 TECHNICAL VALIDATION PASSED!")
@@ -118,5 +112,31 @@ def validate_audio(file_path):
 
     return all_pass
 
+
+def delivered_chapters(chapters_file=CHAPTERS_FILE):
+    """The chapter files Stage 3 joined, in book order, as listed in its chapters.json."""
+    import json
+
+    try:
+        with open(chapters_file, 'r') as f:
+            chapters = json.load(f)['chapters']
+    except (OSError, ValueError, KeyError):
+        print(f"⚠️ No {chapters_file.name}; run Stage 3 to validate individual chapters")
+        return []
+    files = []
+    for chapter in chapters:
+        if 'path' in chapter:
+            path = AUDIOBOOK_DIR / chapter['path']
+        else:
+            # Written before Stage 3 recorded paths: the delivered copy, newest stage first
+            path = next((d / chapter['file'] for d in (RESAMPLED_DIR, MASTERED_DIR, OUTPUT_DIR)
+                         if (d / chapter['file']).exists()), None)
+        if path is None or not path.exists():
+            print(f"⚠️ {chapter['file']} is listed in {chapters_file.name} but missing")
+            continue
+        files.append(path)
+    return files
+
+
 if __name__ == "__main__":
-    validate_audio(FINAL_MASTER)
+    validate_audio(FINAL_MASTER, delivered_chapters())
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Distribution Export Stage for Audiobook
+Builds every deliverable from one read of the mastered book WAV:
+
+- M4B (AAC) with chapter atoms, for audiobook players
+- one MP3 per chapter in ACX format (192 kbps CBR, 44.1 kHz, room tone at head and tail)
+- Opus for the web, with the same chapter marks
+
+The master is memory-mapped and read once, block by block (and resampled to
+the delivery rate in the same stream if Stage 3 left it at another rate). Each
+block's raw PCM is fanned out to one ffmpeg encoder process per deliverable, so every
+encoder runs on its own core and nothing is decoded twice. Chapter spans come
+from Stage 3's chapters.json (exact frames), or from timestamps.txt when that
+is missing or stale.
+
+Usage:
+    python 6_export_distribution.py
+    python 6_export_distribution.py --formats m4b opus
+"""
+
+import argparse
+import json
+import queue
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from resampling import DELIVERY_SAMPLE_RATE, resample_blocks
+from wav_io import iter_wav_blocks, memmap_wav_frames, read_wav_info
+
+AUDIOBOOK_DIR = Path(__file__).parent
+OUTPUT_DIR = AUDIOBOOK_DIR / "output"
+FINAL_MASTER = AUDIOBOOK_DIR / "GelezinioVilkoSaga_Book1_Complete.wav"
+CHAPTERS_FILE = OUTPUT_DIR / "chapters.json"
+TIMESTAMPS_FILE = OUTPUT_DIR / "timestamps.txt"
+EXPORT_DIR = OUTPUT_DIR / "distribution"
+BOOK_STEM = "GelezinioVilkoSaga_Book1"
+
+BOOK_TITLE = "Wolf Saga. Book One: Exile of the Wolf"
+AUTHOR = "Algimantas Krasauskas"
+
+FORMATS = ("m4b", "mp3", "opus")
+M4B_BITRATE = "64k"
+OPUS_BITRATE = "32k"
+# ACX: constant bit rate MP3 at 192 kbps, 44.1 kHz
+MP3_BITRATE = "192k"
+MP3_SAMPLE_RATE = 44100
+# ACX room tone: 0.5-1 s at the head of every chapter file, 1-5 s at the tail
+HEAD_SECONDS = 0.75
+TAIL_SECONDS = 2.25
+# Stage 3's gap between chapters (used when only timestamps.txt is available)
+CHAPTER_GAP_SECONDS = 3.0
+
+BLOCK_FRAMES = 1 << 16
+# Blocks buffered per encoder, so a slow encoder doesn't stall the others at once
+QUEUE_BLOCKS = 32
+# (WAV format tag, bits) -> ffmpeg raw PCM input format
+PCM_FORMATS = {(1, 16): 's16le', (1, 24): 's24le', (1, 32): 's32le', (3, 32): 'f32le', (3, 64): 'f64le'}
+
+
+def _parse_clock(text):
+    seconds = 0
+    for part in text.split(':'):
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+
+def load_chapters(sample_rate, frames, chapters_file=CHAPTERS_FILE, timestamps_file=TIMESTAMPS_FILE):
+    """Chapter spans [{'title', 'start', 'end'}] in frames of the master.
+
+    Stage 3's chapters.json is used when it describes this master (same frame
+    count). Otherwise chapters are rebuilt from timestamps.txt, whose times
+    mark the gap before each chapter and are rounded to whole seconds.
+    """
+    try:
+        with open(chapters_file, 'r') as f:
+            data = json.load(f)
+        if data['sample_rate'] == sample_rate and data['frames'] == frames:
+            return [{'title': c['title'], 'start': c['start'], 'end': c['end']} for c in data['chapters']]
+        print(f"⚠️ {chapters_file.name} does not match the master; using {timestamps_file.name}")
+    except (OSError, ValueError, KeyError):
+        pass
+
+    if not timestamps_file.exists():
+        return [{'title': BOOK_TITLE, 'start': 0, 'end': frames}]
+    markers = []
+    for line in timestamps_file.read_text().splitlines():
+        match = re.match(r'^(\d+(?::\d+){1,2}) (.*)$', line.strip())
+        if match:
+            markers.append((_parse_clock(match.group(1)) * sample_rate, match.group(2)))
+    chapters = []
+    for k, (marker, title) in enumerate(markers):
+        start = marker + int(CHAPTER_GAP_SECONDS * sample_rate) if k else 0
+        end = markers[k + 1][0] if k + 1 < len(markers) else frames
+        chapters.append({'title': title, 'start': min(start, frames), 'end': min(max(start, end), frames)})
+    return chapters
+
+
+def chapter_spans(chapters, frames, sample_rate):
+    """Per-chapter file spans with ACX room tone: (start, end, head pad, tail pad) in frames.
+
+    Head and tail come from the silence between chapters where there is enough
+    of it; the rest is padded with digital silence.
+    """
+    head, tail = int(HEAD_SECONDS * sample_rate), int(TAIL_SECONDS * sample_rate)
+    spans = []
+    for k, chapter in enumerate(chapters):
+        previous_end = chapters[k - 1]['end'] if k else 0
+        next_start = chapters[k + 1]['start'] if k + 1 < len(chapters) else frames
+        head_available = min(head, chapter['start'] - previous_end)
+        tail_available = min(tail, next_start - chapter['end'])
+        spans.append((chapter['start'] - head_available, chapter['end'] + tail_available,
+                      head - head_available, tail - tail_available))
+    return spans
+
+
+def write_ffmetadata(path, chapters, spans, sample_rate, frames):
+    """ffmpeg metadata file with book tags and one [CHAPTER] per chapter (ms timebase)."""
+    def escape(value):
+        return re.sub(r'([=;#\\\n])', r'\\\1', value)
+
+    lines = [";FFMETADATA1", f"title={escape(BOOK_TITLE)}", f"album={escape(BOOK_TITLE)}",
+             f"artist={escape(AUTHOR)}", "genre=Audiobook"]
+    # Chapter marks tile the book: each starts where its file span starts
+    starts = [0] + [span[0] for span in spans[1:]]
+    ends = starts[1:] + [frames]
+    for chapter, start, end in zip(chapters, starts, ends):
+        lines += ["", "[CHAPTER]", "TIMEBASE=1/1000",
+                  f"START={start * 1000 // sample_rate}", f"END={end * 1000 // sample_rate}",
+                  f"title={escape(chapter['title'])}"]
+    Path(path).write_text("\n".join(lines) + "\n", encoding='utf-8')
+
+
+def chapter_filename(index, title):
+    slug = re.sub(r'[^\w]+', '_', title).strip('_') or "Chapter"
+    return f"{index:02d}_{slug}.mp3"
+
+
+class _Encoder:
+    """One ffmpeg encoder process, fed raw PCM from a bounded queue by its own thread."""
+
+    def __init__(self, name, cmd, output_path):
+        self.name = name
+        self.output_path = Path(output_path)
+        self._stderr = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                        stderr=self._stderr)
+        self._queue = queue.Queue(maxsize=QUEUE_BLOCKS)
+        self._thread = threading.Thread(target=self._feed, daemon=True)
+        self._thread.start()
+
+    def _feed(self):
+        try:
+            while True:
+                data = self._queue.get()
+                if data is None:
+                    break
+                self.process.stdin.write(data)
+        except (BrokenPipeError, OSError):
+            # Encoder died: keep draining so the reader never blocks on this queue
+            while self._queue.get() is not None:
+                pass
+        finally:
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+
+    def write(self, data):
+        self._queue.put(data)
+
+    def close(self):
+        self._queue.put(None)
+
+    def wait(self):
+        """Wait for the encoder; returns True on success (prints ffmpeg's errors otherwise)."""
+        self._thread.join()
+        ok = self.process.wait() == 0
+        if not ok:
+            self._stderr.seek(0)
+            stderr = self._stderr.read().decode(errors='replace').strip()
+            print(f"❌ {self.name} encoder failed: {stderr[-300:]}", flush=True)
+            self.output_path.unlink(missing_ok=True)
+        self._stderr.close()
+        return ok
+
+
+def _ffmpeg(pcm_format, sample_rate, channels, *args):
+    return ["ffmpeg", "-y", "-hide_banner", "-nostats", "-loglevel", "error",
+            "-f", pcm_format, "-ar", str(sample_rate), "-ac", str(channels), "-i", "pipe:0", *args]
+
+
+def export_distribution(master_path=FINAL_MASTER, export_dir=EXPORT_DIR, formats=FORMATS):
+    """Encode the selected deliverables from one read of the master; returns the written paths."""
+    master_path, export_dir = Path(master_path), Path(export_dir)
+    if not shutil.which("ffmpeg"):
+        print("❌ ffmpeg not found; nothing exported")
+        return []
+    if not master_path.exists():
+        print(f"❌ Master not found: {master_path}")
+        print("   Run Stage 3 (3_concatenate_audio.py) first!")
+        return []
+
+    info = read_wav_info(master_path)
+    source_rate, channels = info['sample_rate'], info['channels']
+    chapters = load_chapters(source_rate, info['frames'])
+    if source_rate == DELIVERY_SAMPLE_RATE:
+        # Raw sample bytes straight from the file: no decoding at all
+        pcm_format = PCM_FORMATS.get((info['format_tag'], info['bits']))
+        if pcm_format is None:
+            print(f"❌ Unsupported master sample format ({info['bits']}-bit, tag {info['format_tag']})")
+            return []
+        data = memmap_wav_frames(master_path, info)
+        sample_rate, frames = source_rate, info['frames']
+        frame_shape, frame_dtype = (info['block_align'],), np.uint8
+        blocks = (data[start:start + BLOCK_FRAMES] for start in range(0, frames, BLOCK_FRAMES))
+    else:
+        # Upsample once here, for every deliverable
+        print(f"🎚️  Resampling {source_rate} Hz -> {DELIVERY_SAMPLE_RATE} Hz in the export stream")
+        pcm_format, sample_rate = 'f32le', DELIVERY_SAMPLE_RATE
+        frame_shape, frame_dtype = (channels,), np.float32
+        frames = -(-info['frames'] * sample_rate // source_rate)
+        for chapter in chapters:
+            chapter['start'] = chapter['start'] * sample_rate // source_rate
+            chapter['end'] = chapter['end'] * sample_rate // source_rate
+        blocks = resample_blocks(iter_wav_blocks(master_path, BLOCK_FRAMES, info), source_rate, sample_rate)
+    spans = chapter_spans(chapters, frames, sample_rate)
+    export_dir.mkdir(parents=True, exist_ok=True)
+
+    print(f"📦 Exporting {master_path.name} ({frames / sample_rate / 3600:.2f} h, {len(chapters)} chapters)")
+    print(f"   Formats: {', '.join(formats)}")
+
+    metadata_file = export_dir / "chapters.ffmeta"
+    write_ffmetadata(metadata_file, chapters, spans, sample_rate, frames)
+    book_args = ["-i", str(metadata_file), "-map", "0:a", "-map_metadata", "1", "-map_chapters", "1"]
+
+    # Whole-book encoders
+    book_encoders = []
+    if "m4b" in formats:
+        m4b_path = export_dir / f"{BOOK_STEM}.m4b"
+        book_encoders.append(_Encoder("M4B", _ffmpeg(
+            pcm_format, sample_rate, channels, *book_args,
+            "-c:a", "aac", "-b:a", M4B_BITRATE, "-movflags", "+faststart", "-f", "ipod", str(m4b_path)), m4b_path))
+    if "opus" in formats:
+        opus_path = export_dir / f"{BOOK_STEM}.opus"
+        book_encoders.append(_Encoder("Opus", _ffmpeg(
+            pcm_format, sample_rate, channels, *book_args,
+            "-c:a", "libopus", "-b:a", OPUS_BITRATE, str(opus_path)), opus_path))
+
+    def chapter_encoder(k):
+        path = export_dir / chapter_filename(k, chapters[k]['title'])
+        return _Encoder(f"MP3 {path.name}", _ffmpeg(
+            pcm_format, sample_rate, channels,
+            "-c:a", "libmp3lame", "-b:a", MP3_BITRATE, "-ar", str(MP3_SAMPLE_RATE),
+            "-id3v2_version", "3", "-metadata", f"title={chapters[k]['title']}",
+            "-metadata", f"album={BOOK_TITLE}", "-metadata", f"artist={AUTHOR}",
+            "-metadata", f"track={k + 1}/{len(chapters)}", "-metadata", "genre=Audiobook", str(path)), path)
+
+    def silence(count):
+        return np.zeros((count, *frame_shape), dtype=frame_dtype).tobytes()
+
+    # One pass over the master: every block goes to the book encoders and to the
+    # chapter encoders whose span it overlaps (started and closed as the read moves on)
+    finished = list(book_encoders)
+    active = {}
+    next_chapter = 0 if "mp3" in formats else len(spans)
+    start = 0
+    for block in blocks:
+        end = start + len(block)
+        raw = block.tobytes()
+        for encoder in book_encoders:
+            encoder.write(raw)
+
+        while next_chapter < len(spans) and spans[next_chapter][0] < end:
+            encoder = chapter_encoder(next_chapter)
+            encoder.write(silence(spans[next_chapter][2]))
+            active[next_chapter] = encoder
+            next_chapter += 1
+        for k in list(active):
+            span_start, span_end, _, tail_pad = spans[k]
+            lo, hi = max(span_start, start), min(span_end, end)
+            if hi > lo:
+                active[k].write(block[lo - start:hi - start].tobytes())
+            if span_end <= end:
+                active[k].write(silence(tail_pad))
+                active[k].close()
+                finished.append(active.pop(k))
+        start = end
+
+    for encoder in book_encoders:
+        encoder.close()
+    # Empty spans at the very end (nothing left to read)
+    while next_chapter < len(spans):
+        encoder = chapter_encoder(next_chapter)
+        encoder.write(silence(spans[next_chapter][2] + spans[next_chapter][3]))
+        encoder.close()
+        finished.append(encoder)
+        next_chapter += 1
+    for encoder in active.values():
+        encoder.close()
+        finished.append(encoder)
+
+    written = [encoder.output_path for encoder in finished if encoder.wait()]
+    metadata_file.unlink(missing_ok=True)
+
+    print(f"\n✅ Exported {len(written)} file(s) to {export_dir}")
+    for path in written:
+        if path.suffix != ".mp3":
+            print(f"   {path.name}: {path.stat().st_size / (1024 * 1024):.1f} MB")
+    mp3s = [p for p in written if p.suffix == ".mp3"]
+    if mp3s:
+        print(f"   {len(mp3s)} chapter MP3s: {sum(p.stat().st_size for p in mp3s) / (1024 * 1024):.1f} MB")
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export M4B, per-chapter MP3 and Opus from the mastered book")
+    parser.add_argument("--master", type=str, default=str(FINAL_MASTER), help="Mastered book WAV")
+    parser.add_argument("--output-dir", type=str, default=str(EXPORT_DIR))
+    parser.add_argument("--formats", nargs="+", default=list(FORMATS), choices=FORMATS)
+    args = parser.parse_args()
+
+    export_distribution(Path(args.master), Path(args.output_dir), tuple(args.formats))
+
+
+if __name__ == "__main__":
+    main()
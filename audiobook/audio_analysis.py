@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+"""
+Native single-pass audio analysis.
+
+Every number Stage 5 needs comes out of one streaming read of the file, in
+BLOCK_FRAMES blocks, vectorized in NumPy:
+
+- sample peak, and true peak from a polyphase oversampler (BS.1770 annex 2)
+- RMS
+- ITU-R BS.1770 integrated loudness (gated) and EBU Tech 3342 loudness range.
+  The K-weighting filter is applied as a truncated FIR by FFT overlap-save.
+- noise floor: RMS of the pauses (runs of quiet 100 ms frames)
+- clipped samples and clipping events
+
+Results are cached in cache/analysis/ by content hash, and a list of files is
+analysed in a process pool (one process per chapter).
+
+Usage:
+    python audio_analysis.py output/mastered/*.wav
+"""
+
+import json
+import math
+import os
+import struct
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from wav_io import iter_wav_blocks, read_wav_info
+
+AUDIOBOOK_DIR = Path(__file__).parent
+ANALYSIS_CACHE_DIR = AUDIOBOOK_DIR / "cache" / "analysis"
+# Bump when the analysis changes, so cached results are recomputed
+ANALYSIS_VERSION = 1
+
+BLOCK_FRAMES = 1 << 16
+# Loudness is accumulated in 100 ms sub-blocks; gating blocks are sums of these
+SUBBLOCK_SECONDS = 0.1
+MOMENTARY_SUBBLOCKS = 4     # 400 ms blocks, 75% overlap (integrated loudness)
+SHORT_TERM_SUBBLOCKS = 30   # 3 s windows, 100 ms hop (loudness range)
+ABSOLUTE_GATE_LUFS = -70.0
+RELATIVE_GATE_LU = -10.0
+LRA_RELATIVE_GATE_LU = -20.0
+LRA_PERCENTILES = (10, 95)
+# Length of the truncated K-weighting impulse response (its tail is below -150 dB by then)
+K_WEIGHT_SECONDS = 0.1
+# True peak: oversample to at least this rate, with this many taps per polyphase branch
+TRUE_PEAK_RATE = 192000
+TRUE_PEAK_TAPS = 12
+# Noise floor: 100 ms frames below PAUSE_DB, in runs of at least PAUSE_MIN_SECONDS
+PAUSE_DB = -45.0
+PAUSE_MIN_SECONDS = 0.3
+CLIP_LEVEL = 0.999
+DB_FLOOR = -120.0
+
+
+def _db(power):
+    """Power (mean square) -> dB, floored at DB_FLOOR."""
+    return 10 * np.log10(np.maximum(power, 10 ** (DB_FLOOR / 10)))
+
+
+def _lufs(power):
+    return -0.691 + _db(power)
+
+
+@lru_cache(maxsize=None)
+def k_weighting_response(sample_rate):
+    """Impulse response of the BS.1770 K-weighting filter (shelf + high-pass) at any sample rate."""
+    # Pre-filter (high shelf)
+    f0, gain_db, q = 1681.974450955533, 3.999843853973347, 0.7071752369554196
+    k = math.tan(math.pi * f0 / sample_rate)
+    vh = 10 ** (gain_db / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf = ([(vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0],
+             [2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0])
+    # RLB weighting (high-pass)
+    f0, q = 38.13547087602444, 0.5003270373238773
+    k = math.tan(math.pi * f0 / sample_rate)
+    a0 = 1 + k / q + k * k
+    highpass = ([1.0, -2.0, 1.0], [2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0])
+
+    taps = int(K_WEIGHT_SECONDS * sample_rate)
+    x = np.zeros(taps)
+    x[0] = 1.0
+    for (b0, b1, b2), (a1, a2) in (shelf, highpass):
+        y = np.empty(taps)
+        x1 = x2 = y1 = y2 = 0.0
+        for n in range(taps):
+            y[n] = b0 * x[n] + b1 * x1 + b2 * x2 - a1 * y1 - a2 * y2
+            x2, x1, y2, y1 = x1, x[n], y1, y[n]
+        x = y
+    return x
+
+
+@lru_cache(maxsize=None)
+def oversampling_phases(factor, taps=TRUE_PEAK_TAPS):
+    """(factor, taps) polyphase branches of a windowed-sinc interpolator, reversed for a sliding dot product."""
+    length = factor * taps
+    n = np.arange(length) - (length - 1) / 2
+    h = np.sinc(n / factor) * np.kaiser(length, 8.0)
+    h *= factor / h.sum()
+    return np.ascontiguousarray(h.reshape(taps, factor).T[:, ::-1], dtype=np.float32)
+
+
+class _Subblocks:
+    """Sums a per-frame stream into fixed-size sub-blocks across block boundaries."""
+
+    def __init__(self, size):
+        self.size = size
+        self.carry = np.zeros(0)
+        self.sums = []
+
+    def add(self, values):
+        values = np.concatenate([self.carry, values]) if len(self.carry) else values
+        whole = len(values) // self.size * self.size
+        if whole:
+            self.sums.append(values[:whole].reshape(-1, self.size).sum(axis=1))
+        self.carry = values[whole:]
+
+    def total(self):
+        return np.concatenate(self.sums) if self.sums else np.zeros(0)
+
+
+def _window_power(subblocks, count, size):
+    """Mean power of every window of `count` consecutive sub-blocks (hop of one sub-block)."""
+    if len(subblocks) < count:
+        return np.zeros(0)
+    cumulative = np.concatenate([[0.0], np.cumsum(subblocks)])
+    return (cumulative[count:] - cumulative[:-count]) / (count * size)
+
+
+def _gated_power(power, relative_gate_lu):
+    """Blocks that pass the absolute gate and the relative gate below their mean."""
+    power = power[_lufs(power) > ABSOLUTE_GATE_LUFS]
+    if not len(power):
+        return power
+    return power[_lufs(power) > _lufs(power.mean()) + relative_gate_lu]
+
+
+class AudioAnalyzer:
+    """Streaming analyzer: feed float32 (frames, channels) blocks in order, then call result()."""
+
+    def __init__(self, sample_rate, channels=1):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.frames = 0
+        self.sample_peak = 0.0
+        self.true_peak = 0.0
+        self.sum_squares = 0.0
+        self.clipped_samples = 0
+        self.clip_events = 0
+        self._prev_clipped = np.zeros(channels, dtype=bool)
+
+        self._kernel = k_weighting_response(sample_rate)
+        self._k_history = np.zeros((len(self._kernel) - 1, channels))
+        # FFT size: a few filter lengths, so most of every segment is useful output
+        self._k_fft = 1 << (4 * len(self._kernel) - 1).bit_length()
+        self._k_spectrum = np.fft.rfft(self._kernel, self._k_fft)[:, None]
+        self._phases = oversampling_phases(max(1, math.ceil(TRUE_PEAK_RATE / sample_rate)))
+        self._tp_history = np.zeros((self._phases.shape[1] - 1, channels), dtype=np.float32)
+        self._tp_gain = float(np.abs(self._phases).sum(axis=1).max())
+
+        self.subblock = max(1, int(round(SUBBLOCK_SECONDS * sample_rate)))
+        self._weighted = _Subblocks(self.subblock)
+        self._plain = _Subblocks(self.subblock)
+
+    def _k_weight(self, block):
+        """K-weighted copy of a block (overlap-save with the truncated filter, segments FFT'd in one batch)."""
+        taps = len(self._kernel)
+        x = np.concatenate([self._k_history, block])
+        self._k_history = x[len(x) - (taps - 1):]
+        n_fft = self._k_fft
+        hop = n_fft - taps + 1
+        segments = -(-len(block) // hop)
+        x = np.concatenate([x, np.zeros((segments * hop + taps - 1 - len(x), self.channels))])
+        # (segments, n_fft, channels) overlapping views, hop apart
+        frames = np.lib.stride_tricks.as_strided(
+            x, (segments, n_fft, self.channels), (x.strides[0] * hop, x.strides[0], x.strides[1]))
+        y = np.fft.irfft(np.fft.rfft(frames, axis=1) * self._k_spectrum, n_fft, axis=1)
+        return y[:, taps - 1:].reshape(-1, self.channels)[:len(block)]
+
+    def _oversampled_peak(self, block, floor):
+        """Largest interpolated magnitude in the block, if it exceeds `floor` (else `floor`)."""
+        x = np.concatenate([self._tp_history, block])
+        self._tp_history = x[len(x) - len(self._tp_history):]
+        taps = self._phases.shape[1]
+        windows = np.lib.stride_tricks.sliding_window_view(x, taps, axis=0)
+        # An interpolated value is at most gain * the window's largest sample: only
+        # windows that could beat `floor` are interpolated (exact, and usually very few)
+        magnitude = np.abs(x)
+        local_max = magnitude[:len(windows)].copy()
+        for k in range(1, taps):
+            np.maximum(local_max, magnitude[k:k + len(windows)], out=local_max)
+        candidates = local_max * self._tp_gain > floor
+        if not candidates.any():
+            return floor
+        return max(floor, float(np.abs(windows[candidates] @ self._phases.T).max()))
+
+    def add(self, block):
+        block = np.asarray(block, dtype=np.float32).reshape(-1, self.channels)
+        if not len(block):
+            return
+        self.frames += len(block)
+        magnitude = np.abs(block)
+        self.sample_peak = max(self.sample_peak, float(magnitude.max()))
+        self.true_peak = self._oversampled_peak(block, max(self.true_peak, self.sample_peak))
+
+        squares = np.square(block, dtype=np.float64)
+        self.sum_squares += float(squares.sum())
+        self._plain.add(squares.mean(axis=1))
+        self._weighted.add(np.square(self._k_weight(block)).sum(axis=1))
+
+        # Clipping: count samples at full scale and the runs they form (per channel, across blocks)
+        clipped = magnitude >= CLIP_LEVEL
+        self.clipped_samples += int(clipped.sum())
+        previous = np.concatenate([self._prev_clipped[None], clipped[:-1]])
+        self.clip_events += int((clipped & ~previous).sum())
+        self._prev_clipped = clipped[-1]
+
+    def _noise_floor(self):
+        """(noise floor dB or None, seconds of pause) from the quiet runs of 100 ms frames."""
+        power = self._plain.total() / self.subblock
+        quiet = _db(power) < PAUSE_DB
+        edges = np.diff(np.concatenate([[0], quiet.astype(np.int8), [0]]))
+        starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+        keep = ends - starts >= math.ceil(PAUSE_MIN_SECONDS / SUBBLOCK_SECONDS)
+        marks = np.zeros(len(power) + 1, dtype=np.int64)
+        np.add.at(marks, starts[keep], 1)
+        np.add.at(marks, ends[keep], -1)
+        pauses = np.cumsum(marks)[:-1] > 0
+        if not pauses.any():
+            return None, 0.0
+        return float(_db(power[pauses].mean())), float(pauses.sum() * self.subblock / self.sample_rate)
+
+    def result(self):
+        """Summary dict (levels in dBFS / LUFS / LU; None where nothing qualifies)."""
+        # Flush the oversampler's delay line so the last samples' peaks are seen
+        self.true_peak = self._oversampled_peak(
+            np.zeros((self._phases.shape[1], self.channels), dtype=np.float32), max(self.true_peak, self.sample_peak))
+
+        weighted = self._weighted.total()
+        gated = _gated_power(_window_power(weighted, MOMENTARY_SUBBLOCKS, self.subblock), RELATIVE_GATE_LU)
+        short_term = _gated_power(_window_power(weighted, SHORT_TERM_SUBBLOCKS, self.subblock),
+                                  LRA_RELATIVE_GATE_LU)
+        low, high = np.percentile(_lufs(short_term), LRA_PERCENTILES) if len(short_term) > 1 else (0.0, 0.0)
+        noise_floor, pause_seconds = self._noise_floor()
+        samples = self.frames * self.channels
+        return {
+            'sample_rate': self.sample_rate,
+            'channels': self.channels,
+            'duration': self.frames / self.sample_rate,
+            'sample_peak_db': float(_db(self.sample_peak ** 2)),
+            'true_peak_db': float(_db(self.true_peak ** 2)),
+            'rms_db': float(_db(self.sum_squares / samples)) if samples else DB_FLOOR,
+            'integrated_lufs': float(_lufs(gated.mean())) if len(gated) else None,
+            'lra': float(high - low),
+            'noise_floor_db': noise_floor,
+            'pause_seconds': pause_seconds,
+            'clipped_samples': self.clipped_samples,
+            'clip_events': self.clip_events,
+        }
+
+
+def _audio_blocks(path):
+    """(sample rate, channels, float32 block iterator) for any file; WAVs are memory-mapped."""
+    try:
+        info = read_wav_info(path)
+        # ValueError for sample formats the WAV reader can't stream
+        return info['sample_rate'], info['channels'], iter_wav_blocks(path, BLOCK_FRAMES, info)
+    except (ValueError, struct.error):
+        import torchaudio as ta
+        from audio_meta import audio_info
+        info = audio_info(path, use_sidecar=False)
+
+        def blocks():
+            for start in range(0, info['frames'], BLOCK_FRAMES):
+                block, _ = ta.load(str(path), frame_offset=start, num_frames=BLOCK_FRAMES)
+                yield block.numpy().T
+        return info['sample_rate'], info['channels'], blocks()
+
+
+def analyze_audio(path):
+    """Analyse one file in a single streaming pass (uncached)."""
+    sample_rate, channels, blocks = _audio_blocks(path)
+    analyzer = AudioAnalyzer(sample_rate, channels)
+    for block in blocks:
+        analyzer.add(block)
+    return analyzer.result()
+
+
+def analyze_file(path, digest=None):
+    """analyze_audio(), cached in ANALYSIS_CACHE_DIR by the file's content hash."""
+    from mastering import content_hash
+
+    cache_path = ANALYSIS_CACHE_DIR / f"{digest or content_hash(path)}.json"
+    if cache_path.exists():
+        try:
+            with open(cache_path, 'r') as f:
+                cached = json.load(f)
+            if cached.get('version') == ANALYSIS_VERSION:
+                return cached['analysis']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    analysis = analyze_audio(path)
+    ANALYSIS_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_name(f"{cache_path.stem}.{os.getpid()}.tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump({'version': ANALYSIS_VERSION, 'file': Path(path).name, 'analysis': analysis}, f, indent=2)
+    tmp_path.replace(cache_path)
+    return analysis
+
+
+def analyze_files(paths, workers=None):
+    """Analyse several files in parallel; returns {path: analysis, or None if it failed}."""
+    paths = [Path(p) for p in paths]
+    results = {}
+    if len(paths) <= 1 or workers == 1:
+        for path in paths:
+            try:
+                results[path] = analyze_file(path)
+            except Exception as e:
+                print(f"❌ Analysis failed for {path.name}: {e}", flush=True)
+                results[path] = None
+        return results
+
+    workers = workers or min(len(paths), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {path: pool.submit(analyze_file, str(path)) for path in paths}
+        for path, future in futures.items():
+            try:
+                results[path] = future.result()
+            except Exception as e:
+                print(f"❌ Analysis failed for {path.name}: {e}", flush=True)
+                results[path] = None
+    return results
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Single-pass loudness/peak/noise analysis of audio files")
+    parser.add_argument("files", nargs="+", help="Audio files to analyse")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    for path, analysis in analyze_files(args.files, args.workers).items():
+        print(f"\n🔎 {path.name}")
+        print(json.dumps(analysis, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Audio metadata without decoding.
+
+Durations are needed all over the pipeline (book timestamps, caption offsets,
+validation) and used to be computed by decoding whole chapter WAVs. Here they
+come from the chapter's segment-map sidecar when it is up to date, else from the
+WAV header, and only for other formats from torchaudio's header probe.
+Nothing here imports torch, so the mastering and export stages can use it.
+"""
+
+import json
+import struct
+from pathlib import Path
+
+from wav_io import read_wav_info
+
+
+def segment_map_path(output_path):
+    """Sidecar holding a chapter WAV's per-paragraph sample offsets."""
+    output_path = Path(output_path)
+    return output_path.with_name(output_path.stem + '.segments.json')
+
+
+def audio_quality(wav_path):
+    """Quality profile a chapter WAV was rendered with, read from its segment map ('final' if unknown)."""
+    path = segment_map_path(wav_path)
+    if not path.exists():
+        return 'final'
+    try:
+        with open(path, 'r') as f:
+            return json.load(f).get('quality', 'final')
+    except (OSError, ValueError):
+        return 'final'
+
+
+def _sidecar_info(path):
+    """Sample rate and frame count from a chapter's `<stem>.segments.json`, if it describes this WAV."""
+    sidecar = segment_map_path(path)
+    try:
+        if sidecar.stat().st_mtime < path.stat().st_mtime:
+            # WAV rewritten after the map (e.g. by hand); don't trust it
+            return None
+        with open(sidecar, 'r') as f:
+            segment_map = json.load(f)
+        return dict(sample_rate=segment_map['sample_rate'], channels=1, frames=segment_map['frames'])
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def audio_info(path, use_sidecar=True):
+    """{'sample_rate', 'channels', 'frames', 'duration'} for an audio file, read from metadata only."""
+    path = Path(path)
+    info = _sidecar_info(path) if use_sidecar else None
+    if info is None:
+        try:
+            wav = read_wav_info(path)
+            info = dict(sample_rate=wav['sample_rate'], channels=wav['channels'], frames=wav['frames'])
+        except (ValueError, struct.error):
+            # Not a plain RIFF/WAVE file (or one read_wav_info can't parse)
+            import torchaudio as ta
+            meta = ta.info(str(path))
+            info = dict(sample_rate=meta.sample_rate, channels=meta.num_channels, frames=meta.num_frames)
+    info['duration'] = info['frames'] / info['sample_rate']
+    return info
+
+
+def audio_duration(path):
+    """Duration in seconds, from the sidecar or file header."""
+    return audio_info(path)['duration']
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Benchmark batched multi-line TTS inference on CPU.
+Reports real-time factor (synthesis seconds / audio seconds) per batch size.
+"""
+
+import argparse
+import time
+import torch
+from tts_model import load_tts_model
+
+from tts_helpers import _synthesize_batched, _synthesize_sequential
+from voice_conditionals import get_conditionals_cache
+
+# Force float32 globally to avoid CPU dtype mismatch (float != double)
+torch.set_default_dtype(torch.float32)
+
+BENCH_LINES = [
+    "The wolf waited at the edge of the forest.",
+    "Snow fell on the roofs of Vilnius, and the bells were silent.",
+    "Kęstutis raised his hand, and the riders stopped.",
+    "No one in the hall dared to speak first.",
+    "The river was black under the ice, and it remembered every oath sworn above it.",
+    "He had been a prince once. Now he was only a prisoner with a name.",
+    "Go.",
+    "Amber burns slowly, the old woman said, but it burns for a very long time.",
+]
+
+def benchmark(batch_sizes, repeats=1, voice=None):
+    device = "cpu"
+    print(f"🎙️ Loading Chatterbox-Turbo on {device}...")
+    model = load_tts_model(device, warmup=False)
+
+    conds_cache = get_conditionals_cache()
+    items = [
+        {'type': 'speech', 'line': i, 'chunk': 0, 'voice': voice, 'text': line}
+        for i, line in enumerate(BENCH_LINES * repeats)
+    ]
+
+    # Warm-up so one-off allocations don't skew the first measurement
+    _synthesize_sequential(model, items[:1], conds_cache)
+
+    print(f"\n{'BATCH':<6} | {'AUDIO (s)':<10} | {'WALL (s)':<9} | {'RTF':<6}")
+    print("-" * 40)
+    for batch_size in batch_sizes:
+        torch.manual_seed(0)
+        start = time.perf_counter()
+        if batch_size > 1:
+            wavs = _synthesize_batched(model, items, conds_cache, batch_size)
+        else:
+            wavs = _synthesize_sequential(model, items, conds_cache)
+        wall = time.perf_counter() - start
+        audio = sum(w.shape[1] for w in wavs if w is not None) / model.sr
+        rtf = wall / audio if audio else float('inf')
+        print(f"{batch_size:<6} | {audio:<10.1f} | {wall:<9.1f} | {rtf:<6.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark batched TTS inference (RTF vs batch size)")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--repeats", type=int, default=1, help="Repeat the fixed passage set N times")
+    parser.add_argument("--voice", type=str, default=None, help="Reference voice WAV (default: built-in)")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    benchmark(args.batch_sizes, repeats=args.repeats, voice=args.voice)
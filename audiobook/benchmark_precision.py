@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+A/B harness for reduced-precision TTS inference on CPU.
+
+Synthesizes the fixed benchmark passages with the same seed under each precision
+mode and reports speed (RTF) plus objective similarity to the fp32 reference:
+speaker-embedding cosine (voice encoder), DTW-aligned log-mel distance and
+duration ratio. Use it before switching the pipeline to --precision bf16/int8.
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+import torch
+
+from benchmark_batching import BENCH_LINES
+from tts_model import PRECISIONS, load_tts_model
+from tts_synth import QUALITY_PROFILES, generate_batch
+from voice_conditionals import get_conditionals_cache
+
+torch.set_default_dtype(torch.float32)
+
+
+def log_mel(wav, sr, n_mels=80):
+    import torchaudio
+    mel = torchaudio.transforms.MelSpectrogram(sr, n_fft=1024, hop_length=256, n_mels=n_mels)(wav)
+    return torch.log(mel.clamp(min=1e-5))[0].T.numpy()  # (frames, n_mels)
+
+
+def dtw_distance(a, b):
+    """Mean per-step Euclidean distance along the DTW path between two (frames, dims) arrays."""
+    cost = np.sqrt(((a[:, None, :] - b[None, :, :]) ** 2).sum(-1))
+    acc = np.full((len(a) + 1, len(b) + 1), np.inf)
+    steps = np.zeros_like(acc)
+    acc[0, 0] = 0.0
+    for i in range(1, len(a) + 1):
+        for j in range(1, len(b) + 1):
+            prev = min((acc[i - 1, j - 1], steps[i - 1, j - 1]),
+                       (acc[i - 1, j], steps[i - 1, j]),
+                       (acc[i, j - 1], steps[i, j - 1]))
+            acc[i, j] = cost[i - 1, j - 1] + prev[0]
+            steps[i, j] = prev[1] + 1
+    return float(acc[-1, -1] / steps[-1, -1])
+
+
+def speaker_embedding(model, wav):
+    emb = model.ve.embeds_from_wavs([wav.numpy()[0]], sample_rate=model.sr, as_spk=True)
+    emb = np.asarray(emb, dtype=np.float32).reshape(-1)
+    return emb / (np.linalg.norm(emb) + 1e-8)
+
+
+def render(model, voice, seed):
+    """Synthesize every passage with one seed each; returns (wavs, wall seconds)."""
+    conds_cache = get_conditionals_cache()
+    conds_cache.apply(model, voice)
+    profile = QUALITY_PROFILES['final']
+    # Warm-up so one-off allocations don't skew the first measurement
+    generate_batch(model, BENCH_LINES[:1], profile['n_cfm_timesteps'], **profile['sampling'])
+
+    wavs = []
+    wall = 0.0
+    for i, line in enumerate(BENCH_LINES):
+        torch.manual_seed(seed + i)
+        start = time.perf_counter()
+        wavs.append(generate_batch(model, [line], profile['n_cfm_timesteps'], **profile['sampling'])[0])
+        wall += time.perf_counter() - start
+    return wavs, wall
+
+
+def compare(model, reference, wavs):
+    """Similarity of `wavs` to the fp32 `reference`, averaged over passages."""
+    cosines, mel_dists, ratios = [], [], []
+    for ref, wav in zip(reference, wavs):
+        cosines.append(float(speaker_embedding(model, ref) @ speaker_embedding(model, wav)))
+        mel_dists.append(dtw_distance(log_mel(ref, model.sr), log_mel(wav, model.sr)))
+        ratios.append(wav.shape[1] / ref.shape[1])
+    return {
+        'speaker_cosine': float(np.mean(cosines)),
+        'mel_dtw': float(np.mean(mel_dists)),
+        'duration_ratio': float(np.mean(ratios)),
+    }
+
+
+def benchmark(modes, voice=None, seed=0):
+    results = {}
+    reference = None
+    fp32_model = None
+    for mode in ['fp32'] + [m for m in modes if m != 'fp32']:
+        print(f"🎙️ Loading Chatterbox-Turbo (precision {mode})...")
+        # Fresh load per mode: int8 quantizes the T3 modules in place
+        model = load_tts_model("cpu", warmup=False, precision=mode)
+        if model.precision != mode:
+            print(f"   ⚠️  {mode} is not available here; skipping")
+            continue
+        wavs, wall = render(model, voice, seed)
+        audio = sum(w.shape[1] for w in wavs) / model.sr
+        results[mode] = {'audio_seconds': audio, 'wall_seconds': wall, 'rtf': wall / audio if audio else None}
+        if mode == 'fp32':
+            reference, fp32_model = wavs, model
+        else:
+            results[mode].update(compare(fp32_model, reference, wavs))
+            del model
+
+    print(f"\n{'MODE':<6} | {'RTF':<6} | {'SPEEDUP':<7} | {'SPK COS':<7} | {'MEL DTW':<7} | {'DUR':<5}")
+    print("-" * 55)
+    base_rtf = results['fp32']['rtf']
+    for mode, r in results.items():
+        speedup = base_rtf / r['rtf'] if r['rtf'] else 0.0
+        cos = f"{r['speaker_cosine']:.3f}" if 'speaker_cosine' in r else "ref"
+        mel = f"{r['mel_dtw']:.3f}" if 'mel_dtw' in r else "ref"
+        dur = f"{r['duration_ratio']:.2f}" if 'duration_ratio' in r else "ref"
+        print(f"{mode:<6} | {r['rtf']:<6.2f} | {speedup:<7.2f} | {cos:<7} | {mel:<7} | {dur:<5}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="A/B reduced-precision TTS inference against fp32")
+    parser.add_argument("--modes", nargs="+", default=list(PRECISIONS), choices=PRECISIONS)
+    parser.add_argument("--voice", type=str, default=None, help="Reference voice WAV (default: built-in)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    parser.add_argument("--json", type=str, default=None, help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    results = benchmark(args.modes, voice=args.voice, seed=args.seed)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Repeatable narration-throughput benchmark.
+
+Renders a fixed corpus of narration passages (several lengths, voices and voice-tag
+densities) through `generate_long_audio` for every combination of chunk size,
+torch thread count, batch size and precision mode in the sweep. For each
+configuration it reports:
+
+    rtf               synthesis wall time / audio duration (lower is faster)
+    chars_per_sec     narrated characters per wall-clock second
+    peak_rss_mb       peak resident memory while rendering
+    first_audio_s     time until the first segment reached disk
+
+Results are written as JSON to cache/benchmarks/<host>/<time>_<commit>.json, so
+runs on the same machine can be compared across commits (`--compare`).
+
+Usage:
+    python benchmark_tts.py                                  # default sweep
+    python benchmark_tts.py --chunk-sizes 150 250 --threads 4 8 --batch-sizes 1 4
+    python benchmark_tts.py --compare                        # diff against the previous run
+"""
+
+import argparse
+import itertools
+import json
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+RESULTS_DIR = Path(__file__).parent / "cache" / "benchmarks"
+VOICE_DIR = Path(__file__).parent / "voices"
+
+# Fixed corpus: never edit in place, add new passages under new names so results stay comparable
+CORPUS = {
+    'short_plain': (
+        "The wolf waited at the edge of the forest. Snow fell on the roofs of Vilnius, and the bells were silent."
+    ),
+    'medium_plain': (
+        "Kęstutis raised his hand, and the riders stopped. No one in the hall dared to speak first. "
+        "The river was black under the ice, and it remembered every oath sworn above it. "
+        "He had been a prince once. Now he was only a prisoner with a name, and names, "
+        "the old woman said, were the last thing the Order ever took from a man.\n"
+        "Amber burns slowly, she said, but it burns for a very long time."
+    ),
+    'long_plain': (
+        "The road to Trakai ran through three days of pine and marsh, and Vytautas rode it without speaking. "
+        "Behind him the column stretched back along the causeway: spearmen in grey wool, the priests in their "
+        "carts, the Order's envoys on tall horses that did not like the cold. Every mile the forest closed in "
+        "a little more, and every mile the men sang a little less. By the second evening the only sounds were "
+        "the creak of harness, the hiss of sleet in the branches, and somewhere far off, too far to be sure of, "
+        "the long rising note of a wolf that had caught their scent and meant to keep it.\n\n"
+        "At the ford they found the bridge burned. The timbers still smoked. Whoever had done it had not "
+        "bothered to hide; their tracks ran straight up the far bank and into the trees, and they were not the "
+        "tracks of a war band but of two people, one of them small."
+    ),
+    'medium_dialogue_sparse': (
+        "The hall fell silent when the envoy entered.\n"
+        "[Envoy] The Grand Master sends his greetings, and his terms.\n"
+        "[Narrator] Vytautas did not rise. He turned the amber ring on his finger and waited until the silence "
+        "became uncomfortable for everyone but himself.\n"
+        "[Vytautas] Then read them. Slowly. My cousin will want to hear every word."
+    ),
+    'medium_dialogue_dense': (
+        "[Jogaila] You came back.\n"
+        "[Vytautas] I said I would.\n"
+        "[Jogaila] You say many things.\n"
+        "[Vytautas] And you believe few of them.\n"
+        "[Narrator] The fire cracked between them.\n"
+        "[Jogaila] What does the Order want?\n"
+        "[Vytautas] Everything. As always.\n"
+        "[Jogaila] And what do you want?\n"
+        "[Vytautas] Less than that. But not much less."
+    ),
+}
+
+BENCH_VOICES = {
+    "Narrator": Path(__file__).parent / "reference_voice.wav",
+    "Vytautas": VOICE_DIR / "vytautas.wav",
+    "Jogaila": VOICE_DIR / "jogaila.wav",
+    "Envoy": VOICE_DIR / "envoy.wav",
+}
+
+
+class PeakRSS:
+    """Samples this process's resident set size in a background thread."""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def current():
+        try:
+            with open("/proc/self/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        import resource
+        # ru_maxrss is KiB on Linux (a lifetime peak, but better than nothing)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.current())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.current()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current())
+
+
+def git_commit():
+    """Current commit (with a -dirty suffix for uncommitted changes), or 'unknown'."""
+    cwd = Path(__file__).parent
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=cwd, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=cwd,
+                               capture_output=True, text=True).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def machine_info():
+    import torch
+
+    cpu = platform.processor()
+    try:
+        for line in Path("/proc/cpuinfo").read_text().splitlines():
+            if line.startswith("model name"):
+                cpu = line.split(":", 1)[1].strip()
+                break
+    except OSError:
+        pass
+    from tts_pool import available_cores
+    return {
+        'host': socket.gethostname(),
+        'cpu': cpu,
+        'cores': len(available_cores()),
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+    }
+
+
+def run_passage(model, name, text, chunk_size, batch_size, voice_map, default_voice, seed):
+    """Render one passage; returns its metrics."""
+    from tts_helpers import generate_long_audio
+    from tts_profiler import profiling
+
+    with tempfile.TemporaryDirectory() as tmp, PeakRSS() as rss, profiling(name) as profiler:
+        start = time.perf_counter()
+        audio_seconds = generate_long_audio(
+            text, model, Path(tmp) / f"{name}.wav",
+            chunk_size=chunk_size, voice_map=voice_map, default_voice=default_voice,
+            batch_size=batch_size, seed=seed, segment_cache=False,
+        )
+        wall = time.perf_counter() - start
+    # First audio on disk: the end of the first segment write
+    writes = [ev for ev in profiler.events if ev[0] == 'write']
+    first_audio = min(s + d for _, s, d, _, _ in writes) if writes else None
+    return {
+        'passage': name,
+        'chars': len(text),
+        'audio_seconds': round(audio_seconds, 3),
+        'wall_seconds': round(wall, 3),
+        'rtf': round(wall / audio_seconds, 4) if audio_seconds else None,
+        'chars_per_sec': round(len(text) / wall, 2),
+        'peak_rss_mb': round(rss.peak / 2**20, 1),
+        'first_audio_s': round(first_audio, 3) if first_audio is not None else None,
+    }
+
+
+def summarize(passages):
+    audio = sum(p['audio_seconds'] for p in passages)
+    wall = sum(p['wall_seconds'] for p in passages)
+    chars = sum(p['chars'] for p in passages)
+    first = [p['first_audio_s'] for p in passages if p['first_audio_s'] is not None]
+    return {
+        'rtf': round(wall / audio, 4) if audio else None,
+        'chars_per_sec': round(chars / wall, 2) if wall else None,
+        'peak_rss_mb': max(p['peak_rss_mb'] for p in passages),
+        'first_audio_s': round(sum(first) / len(first), 3) if first else None,
+    }
+
+
+def config_key(config):
+    return (config['precision'], config['threads'], config['chunk_size'], config['batch_size'])
+
+
+def benchmark(chunk_sizes, threads_list, batch_sizes, precisions, passages=None, seed=0, device="cpu"):
+    import torch
+    from tts_model import load_tts_model
+
+    passages = passages or list(CORPUS)
+    voice_map = {name: path for name, path in BENCH_VOICES.items() if path.exists()}
+    default_voice = voice_map.get("Narrator")
+    configs = []
+
+    print(f"\n{'PREC':<5} | {'THR':>3} | {'CHUNK':>5} | {'BATCH':>5} | {'RTF':>6} | {'CHAR/S':>7} | "
+          f"{'RSS MB':>7} | {'1ST (s)':>7}")
+    print("-" * 66)
+    for precision in precisions:
+        # One model per precision mode (int8 quantizes in place)
+        model = load_tts_model(device, precision=precision)
+        if model.precision != precision:
+            print(f"⚠️  {precision} is not available here; skipping")
+            continue
+        for threads, chunk_size, batch_size in itertools.product(threads_list, chunk_sizes, batch_sizes):
+            torch.set_num_threads(threads)
+            # Untimed warm-up at this thread count
+            run_passage(model, 'warmup', CORPUS['short_plain'], chunk_size, batch_size, voice_map, default_voice, seed)
+            results = [run_passage(model, name, CORPUS[name], chunk_size, batch_size, voice_map, default_voice, seed)
+                       for name in passages]
+            config = {'precision': precision, 'threads': threads, 'chunk_size': chunk_size,
+                      'batch_size': batch_size, 'summary': summarize(results), 'passages': results}
+            configs.append(config)
+            s = config['summary']
+            print(f"{precision:<5} | {threads:>3} | {chunk_size:>5} | {batch_size:>5} | {s['rtf']:>6.3f} | "
+                  f"{s['chars_per_sec']:>7.1f} | {s['peak_rss_mb']:>7.0f} | {s['first_audio_s'] or 0:>7.2f}")
+        del model
+    return configs
+
+
+def save_results(configs, seed):
+    info = machine_info()
+    commit = git_commit()
+    out_dir = RESULTS_DIR / info['host']
+    out_dir.mkdir(parents=True, exist_ok=True)
+    path = out_dir / f"{time.strftime('%Y%m%d-%H%M%S')}_{commit}.json"
+    with open(path, 'w') as f:
+        json.dump({'commit': commit, 'machine': info, 'seed': seed, 'corpus': sorted(CORPUS),
+                   'configs': configs}, f, indent=2)
+    return path
+
+
+def previous_results(current_path):
+    """Most recent earlier result file from the same machine."""
+    runs = sorted(p for p in current_path.parent.glob("*.json") if p != current_path)
+    return runs[-1] if runs else None
+
+
+def compare(current_path, baseline_path):
+    with open(current_path) as f:
+        current = json.load(f)
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    base = {config_key(c): c['summary'] for c in baseline['configs']}
+    print(f"\n📊 {current['commit']} vs {baseline['commit']} ({Path(baseline_path).name})")
+    print(f"{'PREC':<5} | {'THR':>3} | {'CHUNK':>5} | {'BATCH':>5} | {'RTF':>15} | {'CHAR/S':>17}")
+    print("-" * 62)
+    for config in current['configs']:
+        old = base.get(config_key(config))
+        if not old or not old['rtf']:
+            continue
+        new = config['summary']
+        rtf_change = 100 * (new['rtf'] - old['rtf']) / old['rtf']
+        cps_change = 100 * (new['chars_per_sec'] - old['chars_per_sec']) / old['chars_per_sec']
+        print(f"{config['precision']:<5} | {config['threads']:>3} | {config['chunk_size']:>5} | "
+              f"{config['batch_size']:>5} | {new['rtf']:>6.3f} ({rtf_change:+5.1f}%) | "
+              f"{new['chars_per_sec']:>7.1f} ({cps_change:+5.1f}%)")
+
+
+def main():
+    import torch
+
+    parser = argparse.ArgumentParser(description="Benchmark narration throughput on a fixed corpus")
+    parser.add_argument("--chunk-sizes", type=int, nargs="+", default=[150, 250])
+    parser.add_argument("--threads", type=int, nargs="+", default=[torch.get_num_threads()])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--precisions", nargs="+", default=["fp32"], choices=["fp32", "bf16", "int8"])
+    parser.add_argument("--passages", nargs="+", default=None, choices=sorted(CORPUS))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--device", default="cpu", choices=["cuda", "cpu"])
+    parser.add_argument("--compare", nargs="?", const="previous", default=None,
+                        help="Compare with a result JSON (default: the previous run on this machine)")
+    args = parser.parse_args()
+
+    configs = benchmark(args.chunk_sizes, args.threads, args.batch_sizes, args.precisions,
+                        args.passages, args.seed, args.device)
+    path = save_results(configs, args.seed)
+    print(f"\n💾 Results: {path}")
+    if args.compare:
+        baseline = previous_results(path) if args.compare == "previous" else Path(args.compare)
+        if baseline:
+            compare(path, baseline)
+        else:
+            print("ℹ️  No earlier run on this machine to compare with")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Fast SRT/VTT caption merging.
+
+Chapter captions are merged into one book (or series) file by offsetting each
+chapter's cues by the running audio duration. Cue times are parsed once per file
+into integer-millisecond NumPy arrays (one regex pass, then the digits are read
+column-wise from the raw bytes), shifted with one vectorized add per chapter, and written out chapter by chapter, so nothing but
+the current chapter is held in memory. Book offsets are the chapter starts
+Stage 3 recorded in chapters.json; without it, chapter durations come from file
+headers or segment-map sidecars (see audio_meta), never from decoding audio.
+
+Usage:
+    python caption_merge.py                  # book captions from transcripts/*.srt
+    python caption_merge.py --format vtt
+"""
+
+import argparse
+import re
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+AUDIOBOOK_DIR = Path(__file__).parent
+OUTPUT_DIR = AUDIOBOOK_DIR / "output"
+TRANSCRIPTS_DIR = AUDIOBOOK_DIR / "transcripts"
+BOOK_CAPTIONS = OUTPUT_DIR / "GelezinioVilkoSaga_Book1_Complete.srt"
+
+# Timing line, then the cue text up to the next blank line (SRT always has hours, VTT may omit them)
+CUE = re.compile(
+    r'^[ \t]*((?:\d+:)?\d{1,2}:\d{2}[,.]\d{3})[ \t]+-->[ \t]+((?:\d+:)?\d{1,2}:\d{2}[,.]\d{3})[^\n]*\n?'
+    r'((?:[ \t]*\S[^\n]*(?:\n|\Z))*)',
+    re.MULTILINE,
+)
+STAMP_WIDTH = len("00:00:00,000")
+# Multipliers of the digit columns of 'HH:MM:SS,mmm' (0 for the separators)
+STAMP_WEIGHTS = np.array([36000000, 3600000, 0, 600000, 60000, 0, 10000, 1000, 0, 100, 10, 1], dtype=np.int64)
+
+
+def stamps_to_ms(stamps):
+    """Vectorized 'HH:MM:SS,mmm' (or VTT 'MM:SS.mmm') strings -> int64 milliseconds."""
+    if not stamps:
+        return np.zeros(0, np.int64)
+    raw = ''.join(stamps).encode('ascii')
+    if len(raw) == STAMP_WIDTH * len(stamps):
+        # All fixed width (the usual case): read every digit column at once from the raw bytes
+        digits = np.frombuffer(raw, dtype=np.uint8).reshape(-1, STAMP_WIDTH).astype(np.int64) - ord('0')
+        numeric = STAMP_WEIGHTS > 0
+        if (digits[:, numeric] >= 0).all() and (digits[:, numeric] <= 9).all():
+            return digits @ STAMP_WEIGHTS
+    ms = np.empty(len(stamps), np.int64)
+    for k, stamp in enumerate(stamps):
+        clock, millis = stamp.replace(',', '.').split('.')
+        seconds = 0
+        for part in clock.split(':'):
+            seconds = seconds * 60 + int(part)
+        ms[k] = seconds * 1000 + int(millis)
+    return ms
+
+
+def parse_cues(text):
+    """Parse SRT or VTT text into (start_ms, end_ms, cue texts).
+
+    Times are int64 millisecond arrays; cue text is everything between a timing
+    line and the next blank line.
+    """
+    cues = CUE.findall(text)
+    if not cues:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64), []
+    starts, ends, bodies = zip(*cues)
+    return stamps_to_ms(starts), stamps_to_ms(ends), [body.strip() for body in bodies]
+
+
+def format_times(ms, vtt=False):
+    """Vectorized ms -> 'HH:MM:SS,mmm' (or '.mmm' for VTT) strings."""
+    ms = np.maximum(np.asarray(ms, dtype=np.int64), 0)
+    if not len(ms):
+        return []
+    sep = '.' if vtt else ','
+    h, rem = np.divmod(ms, 3600000)
+    if h.max() > 99:
+        m, rem = np.divmod(rem, 60000)
+        s, rem = np.divmod(rem, 1000)
+        return [f"{a:02d}:{b:02d}:{c:02d}{sep}{d:03d}" for a, b, c, d in zip(h.tolist(), m.tolist(), s.tolist(), rem.tolist())]
+    # Write every digit column at once, then cut the bytes into fixed-width stamps
+    columns = np.empty((len(ms), STAMP_WIDTH), dtype=np.int64)
+    rest = ms
+    for col, weight in enumerate(STAMP_WEIGHTS):
+        if weight:
+            columns[:, col], rest = np.divmod(rest, weight)
+    columns += ord('0')
+    columns[:, [2, 5]] = ord(':')
+    columns[:, 8] = ord(sep)
+    # Column 0 (tens of hours) can only be 0-9 here, so no digit overflows
+    raw = columns.astype(np.uint8).tobytes().decode('ascii')
+    return [raw[i:i + STAMP_WIDTH] for i in range(0, len(raw), STAMP_WIDTH)]
+
+
+def merge_captions(chapters, output_path):
+    """Stream-merge chapter captions into one file.
+
+    Args:
+        chapters: Iterable of (caption path or None, offset in ms) in book order
+        output_path: .srt or .vtt output (format follows the suffix)
+    Returns the number of cues written.
+    """
+    output_path = Path(output_path)
+    vtt = output_path.suffix.lower() == '.vtt'
+    cue = 0
+    with open(output_path, 'w', encoding='utf-8') as out:
+        if vtt:
+            out.write("WEBVTT\n\n")
+        for caption_path, offset_ms in chapters:
+            if caption_path is None or not Path(caption_path).exists():
+                continue
+            start, end, bodies = parse_cues(Path(caption_path).read_text(encoding='utf-8'))
+            if not bodies:
+                continue
+            # One vectorized shift per chapter
+            starts = format_times(start + offset_ms, vtt)
+            ends = format_times(end + offset_ms, vtt)
+            lines = []
+            for a, b, body in zip(starts, ends, bodies):
+                cue += 1
+                lines.append(f"{a} --> {b}\n{body}\n" if vtt else f"{cue}\n{a} --> {b}\n{body}\n")
+            out.write("\n".join(lines) + "\n")
+    return cue
+
+
+def chapter_offsets(audio_paths, gap_seconds=0.0):
+    """Start offset in ms of each chapter when joined with `gap_seconds` of silence between chapters."""
+    from audio_meta import audio_info
+
+    offsets = []
+    clock = 0.0
+    for k, path in enumerate(audio_paths):
+        if k:
+            clock += gap_seconds
+        offsets.append(int(round(clock * 1000)))
+        clock += audio_info(path)['duration']
+    return offsets
+
+
+def joined_offsets(audio_paths, chapters_file):
+    """Start offset in ms of each chapter as Stage 3 joined it (chapters.json), or None if it lists other files."""
+    import json
+
+    try:
+        with open(chapters_file, 'r') as f:
+            book = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if [c['file'] for c in book['chapters']] != [Path(p).name for p in audio_paths]:
+        return None
+    return [int(round(c['start'] * 1000 / book['sample_rate'])) for c in book['chapters']]
+
+
+def merge_book_captions(output_path=BOOK_CAPTIONS, transcripts_dir=TRANSCRIPTS_DIR):
+    """Merge every chapter's captions in Stage 3's order and gaps; returns the cue count.
+
+    Offsets are the exact chapter starts from Stage 3's chapters.json when it
+    lists the same chapters, else chapter durations plus Stage 3's gap.
+    """
+    concat_mod = __import__('3_concatenate_audio')
+
+    wav_files = concat_mod.book_chapter_files()
+    offsets = joined_offsets(wav_files, concat_mod.CHAPTERS_FILE)
+    if offsets is None:
+        offsets = chapter_offsets(wav_files, concat_mod.CHAPTER_GAP_SECONDS)
+    chapters = []
+    for wav_file, offset in zip(wav_files, offsets):
+        captions = next((p for p in (transcripts_dir / f"{wav_file.stem}.srt", transcripts_dir / f"{wav_file.stem}.vtt")
+                         if p.exists()), None)
+        chapters.append((captions, offset))
+    return merge_captions(chapters, output_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge chapter captions into one book caption file")
+    parser.add_argument("--format", default="srt", choices=["srt", "vtt"])
+    parser.add_argument("--output", default=None, help="Output file (default: the book's caption file)")
+    args = parser.parse_args()
+
+    output = Path(args.output) if args.output else BOOK_CAPTIONS.with_suffix(f".{args.format}")
+    cues = merge_book_captions(output)
+    print(f"✅ Merged {cues} captions into {output.name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Length-balanced TTS chunk planner.
+
+Chatterbox synthesis cost per character is lowest and most predictable for
+mid-length inputs: very short fragments pay the fixed per-call overhead, and very
+long ones slow down the T3 decode and are the ones that ramble or get cut off.
+Long narration lines are therefore split at real sentence boundaries (aware of
+abbreviations, initials, ellipses, ?, ! and quoted dialogue) and the sentences
+are packed into the fewest chunks that fit `max_chars`, with lengths balanced
+across those chunks instead of greedily filled.
+
+A quoted passage is never split across chunks unless it alone exceeds
+max_chars; sentences that are still too long are broken at em-dashes,
+semicolons, colons and commas before falling back to word boundaries, and a
+single word longer than max_chars is cut at max_chars. No chunk ever exceeds
+max_chars.
+"""
+
+import math
+import re
+
+# Chunk length band in characters. The upper bound is the pipeline's chunk_size;
+# below MIN_CHARS the fixed per-call overhead is expected to dominate the
+# real-time factor. MIN_CHARS = 80 is an estimate, not a measurement: no RTF sweep
+# has been recorded for it yet. To tune it, run
+# `python benchmark_tts.py --chunk-sizes 60 80 120 160 250` on the target machine,
+# take the shortest chunk length whose RTF is within ~10% of the best, and note
+# the run's results file here.
+DEFAULT_MAX_CHARS = 250
+MIN_CHARS = 80
+
+ABBREVIATIONS = {
+    'mr', 'mrs', 'ms', 'dr', 'prof', 'sr', 'jr', 'st', 'mt', 'ft', 'gen', 'col', 'capt', 'lt', 'sgt', 'rev',
+    'hon', 'fr', 'vs', 'etc', 'e.g', 'i.e', 'cf', 'approx', 'no', 'vol', 'ch', 'fig', 'jan', 'feb', 'mar',
+    'apr', 'jun', 'jul', 'aug', 'sep', 'sept', 'oct', 'nov', 'dec', 'a.m', 'p.m', 'b.c', 'a.d',
+}
+
+OPEN_QUOTES = '"“„«'
+CLOSE_QUOTES = '"”“»'
+CLOSERS = CLOSE_QUOTES + ")]’'"
+SENTENCE_END = re.compile(r'(\.\.\.|…|[.?!]+)')
+CLAUSE_BREAK = re.compile(r'(?<=[—;:,])\s+|\s+(?=—)|\s+-{2,}\s+')
+WHITESPACE = re.compile(r'\s+')
+LIST_MARKER = re.compile(r'^\s*\d+\.$')
+# Dotted single letters: "u.s", "u.k", "j.r.r"
+DOTTED_LETTERS = re.compile(r'^(?:[^\W\d_]\.)+[^\W\d_]$')
+
+
+def _is_abbreviation(text, dot_pos):
+    """True if the period at `dot_pos` ends an abbreviation or an initial."""
+    start = dot_pos
+    while start > 0 and (text[start - 1].isalpha() or text[start - 1] == '.'):
+        start -= 1
+    word = text[start:dot_pos].lower()
+    if not word:
+        return False
+    # Single initials ("J. R. R."), dotted letters ("U.S.") and listed forms ("e.g.") never end a sentence
+    return word in ABBREVIATIONS or len(word) == 1 or bool(DOTTED_LETTERS.match(word))
+
+
+def _quote_spans(text):
+    """Character ranges of double-quoted passages (straight or typographic quotes)."""
+    spans = []
+    open_at = None
+    for i, ch in enumerate(text):
+        if open_at is None and ch in OPEN_QUOTES:
+            open_at = i
+        elif open_at is not None and ch in CLOSE_QUOTES and i > open_at:
+            spans.append((open_at, i + 1))
+            open_at = None
+    if open_at is not None:
+        # Unbalanced quote: treat it as running to the end of the line
+        spans.append((open_at, len(text)))
+    return spans
+
+
+def split_sentences(text, keep_quotes=True):
+    """Split a line into sentences. With `keep_quotes`, never split inside a quoted passage."""
+    quotes = _quote_spans(text) if keep_quotes else []
+    sentences = []
+    start = 0
+    for match in SENTENCE_END.finditer(text):
+        end = match.end()
+        # Closing quotes/brackets belong to the sentence they close
+        while end < len(text) and text[end] in CLOSERS:
+            end += 1
+        if any(a < match.start() and end < b for a, b in quotes):
+            # Still inside a quoted passage
+            continue
+        if end >= len(text) or not text[end].isspace():
+            continue
+        rest = text[end:].lstrip()
+        if not rest:
+            continue
+        punct = match.group(1)
+        if punct == '.' and (_is_abbreviation(text, match.start()) or LIST_MARKER.match(text[start:end])):
+            # "Dr. Smith", "J. R. R.", or a list number such as "2."
+            continue
+        if punct in ('...', '…') and rest[0].islower():
+            # Trailing-off ellipsis inside a sentence
+            continue
+        if rest[0].islower() and text[end - 1] in CLOSERS:
+            # "Run!" she said. -- the attribution continues the sentence
+            continue
+        sentences.append(text[start:end].strip())
+        start = end
+    tail = text[start:].strip()
+    if tail:
+        sentences.append(tail)
+    return sentences
+
+
+def _split_points(text, pattern, protected):
+    """Split `text` at `pattern` matches that do not fall inside any protected span."""
+    pieces = []
+    start = 0
+    for match in pattern.finditer(text):
+        if any(a < match.start() < b for a, b in protected):
+            continue
+        pieces.append(text[start:match.start()])
+        start = match.end()
+    pieces.append(text[start:])
+    return [p.strip() for p in pieces if p.strip()]
+
+
+def _hard_split(word, max_chars):
+    """Last resort for a run without spaces: cut it every max_chars characters."""
+    return [word[i:i + max_chars] for i in range(0, len(word), max_chars)]
+
+
+def _split_long(sentence, max_chars, keep_quotes=True):
+    """Break an over-long sentence at clause boundaries, then at word boundaries (outside quotes).
+
+    With `keep_quotes`, a quoted passage stays whole, so units may exceed max_chars.
+    """
+    protected = _quote_spans(sentence) if keep_quotes else []
+    units = []
+    for piece in _split_points(sentence, CLAUSE_BREAK, protected):
+        if len(piece) <= max_chars:
+            units.append(piece)
+            continue
+        current = ""
+        piece_quotes = _quote_spans(piece) if keep_quotes else []
+        for word in _split_points(piece, WHITESPACE, piece_quotes):
+            if len(word) > max_chars and not piece_quotes:
+                if current:
+                    units.append(current)
+                *cut, current = _hard_split(word, max_chars)
+                units.extend(cut)
+                continue
+            if current and len(current) + 1 + len(word) > max_chars:
+                units.append(current)
+                current = word
+            else:
+                current = f"{current} {word}" if current else word
+        if current:
+            units.append(current)
+    return units
+
+
+def _pack(units, max_chars):
+    """Join consecutive units into the fewest chunks <= max_chars, balancing their lengths.
+
+    Chooses the number of chunks k from the total length, then the contiguous
+    partition into k groups that minimizes the longest group (raising k if some
+    group would still exceed max_chars).
+    """
+    if not units:
+        return []
+    lengths = [len(u) for u in units]
+    total = sum(lengths) + len(units) - 1
+    k = max(1, math.ceil(total / max_chars))
+    while k < len(units):
+        groups = _balanced_partition(lengths, k)
+        chunks = [' '.join(units[a:b]) for a, b in groups]
+        if all(len(c) <= max_chars for c in chunks):
+            return chunks
+        k += 1
+    return list(units)
+
+
+def _balanced_partition(lengths, k):
+    """Contiguous split of `lengths` into k groups minimizing the longest group (joined with spaces)."""
+    n = len(lengths)
+    prefix = [0]
+    for length in lengths:
+        prefix.append(prefix[-1] + length)
+
+    def span(a, b):
+        return prefix[b] - prefix[a] + (b - a - 1)
+
+    # best[j][i]: minimal longest group when the first i units form j groups
+    inf = float('inf')
+    best = [[inf] * (n + 1) for _ in range(k + 1)]
+    cut = [[0] * (n + 1) for _ in range(k + 1)]
+    best[0][0] = 0
+    for j in range(1, k + 1):
+        for i in range(j, n + 1):
+            for a in range(j - 1, i):
+                cost = max(best[j - 1][a], span(a, i))
+                if cost < best[j][i]:
+                    best[j][i] = cost
+                    cut[j][i] = a
+    groups = []
+    i = n
+    for j in range(k, 0, -1):
+        a = cut[j][i]
+        groups.append((a, i))
+        i = a
+    return groups[::-1]
+
+
+def plan_chunks(text, max_chars=DEFAULT_MAX_CHARS):
+    """Split one narration line into length-balanced chunks of at most `max_chars` (quotes stay whole)."""
+    text = text.strip()
+    if len(text) <= max_chars:
+        return [text] if text else []
+
+    units = []
+    for sentence in split_sentences(text):
+        if len(sentence) <= max_chars:
+            units.append(sentence)
+            continue
+        # Quoted passages stay whole while they fit; an over-long one is split like narration
+        for part in _split_long(sentence, max_chars):
+            if len(part) <= max_chars:
+                units.append(part)
+            else:
+                for piece in split_sentences(part, keep_quotes=False):
+                    units.extend([piece] if len(piece) <= max_chars
+                                 else _split_long(piece, max_chars, keep_quotes=False))
+
+    return _merge_fragments(_pack(units, max_chars), max_chars)
+
+
+def _merge_fragments(chunks, max_chars):
+    """Fold chunks shorter than MIN_CHARS into a neighbour when the result still fits."""
+    merged = []
+    for chunk in chunks:
+        if merged and (len(chunk) < MIN_CHARS or len(merged[-1]) < MIN_CHARS) \
+                and len(merged[-1]) + 1 + len(chunk) <= max_chars:
+            merged[-1] = f"{merged[-1]} {chunk}"
+        else:
+            merged.append(chunk)
+    return merged
@@ -12,11 +12,11 @@ import torchaudio as ta
 import threading
 import time
 from pathlib import Path
-from chatterbox.tts_turbo import ChatterboxTurboTTS
 
 # Add current directory to path for imports
 sys.path.insert(0, str(Path(__file__).parent))
 from tts_helpers import generate_long_audio
+from tts_service import get_tts
 
 # Delayed import for module starting with number
 def generate_captions(*args, **kwargs):
@@ -101,7 +101,7 @@ def generate_intro_outro(reference_audio=None):
     try:
         print("🎙️  Loading Chatterbox-Turbo TTS...")
         device = "cuda" if torch.cuda.is_available() else "cpu"
-        model = ChatterboxTurboTTS.from_pretrained(device=device)
+        model = get_tts(device)
         
         output_dir = AUDIOBOOK_DIR / "output"
         output_dir.mkdir(parents=True, exist_ok=True)
@@ -169,6 +169,10 @@ def main():
                        help="Skip Ollama preprocessing stage")
     parser.add_argument("--skip-video", action="store_true",
                        help="Skip YouTube video generation")
+    parser.add_argument("--tts-workers", type=int, default=1,
+                       help="TTS worker processes for CPU narration")
+    parser.add_argument("--quality", default="final", choices=["final", "draft"],
+                       help="draft = fast proof-listening audio in output/draft/, no mastering or video")
     args = parser.parse_args()
     
     print("\n" + "🎙️" * 30)
@@ -182,7 +186,8 @@ def main():
     # Parallel Streaming Pipeline
     from generate_parallel_queues import PipelineManager
     
-    manager = PipelineManager(reference_audio=args.reference_audio)
+    manager = PipelineManager(reference_audio=args.reference_audio, tts_workers=args.tts_workers,
+                              quality=args.quality)
     
     # Check if we should skip preprocessing (managed inside the manager via file checks)
     # The manager automatically skips existing files.
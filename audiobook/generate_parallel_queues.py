@@ -15,7 +15,6 @@ sys.path.insert(0, str(Path(__file__).parent))
 
 # Import logic from existing scripts
 from tts_helpers import generate_long_audio
-from chatterbox.tts_turbo import ChatterboxTurboTTS
 
 # These will be imported inside workers to avoid conflicts
 # from 1_preprocess_with_ollama import NarrationMemory, preprocess_chapter, load_quarto_config, get_chapters_from_config, build_context_summary
@@ -27,17 +26,22 @@ PREPROCESSED_DIR = AUDIOBOOK_DIR / "preprocessed"
 TRANSCRIPTS_DIR = AUDIOBOOK_DIR / "transcripts"
 
 class PipelineManager:
-    def __init__(self, reference_audio=None):
+    def __init__(self, reference_audio=None, tts_workers=1, quality="final"):
         self.reference_audio = Path(reference_audio) if reference_audio else None
+        self.tts_workers = tts_workers
+        # Draft (proof-listening) audio and its captions live in draft/ subfolders and are never assembled
+        self.quality = quality
+        self.output_dir = OUTPUT_DIR / "draft" if quality == "draft" else OUTPUT_DIR
+        self.transcripts_dir = TRANSCRIPTS_DIR / "draft" if quality == "draft" else TRANSCRIPTS_DIR
         self.tts_queue = queue.Queue()
         self.caption_queue = queue.Queue()
         self.done_queue = queue.Queue()
         self.stop_signal = threading.Event()
         
         # Directories
-        OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
         PREPROCESSED_DIR.mkdir(parents=True, exist_ok=True)
-        TRANSCRIPTS_DIR.mkdir(parents=True, exist_ok=True)
+        self.transcripts_dir.mkdir(parents=True, exist_ok=True)
 
     async def preprocessor_worker_async(self):
         """Stage 1: LLM Preprocessing (Sequential due to RAG)"""
@@ -119,17 +123,19 @@ class PipelineManager:
 
     def audio_worker(self):
         """Stage 2: TTS Generation (Sequential to save VRAM)"""
+        if self.tts_workers > 1 and not torch.cuda.is_available():
+            return self.audio_pool_worker()
+        
         print("🎙️ Audio: Initializing Chatterbox-Turbo...", flush=True)
-        from chatterbox.tts_turbo import ChatterboxTurboTTS
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        model = ChatterboxTurboTTS.from_pretrained(device=device)
+        from tts_service import get_tts
+        model = get_tts()
         
         while not self.stop_signal.is_set():
             task = self.tts_queue.get()
             if task is None: break # End signal
             
             i, name, text = task['index'], task['name'], task['text']
-            output_wav = OUTPUT_DIR / f"{i:02d}_{name}.wav"
+            output_wav = self.output_dir / f"{i:02d}_{name}.wav"
             
             if not output_wav.exists():
                 print(f"🎵 Audio: Narrating Chapter {i}: {name}...", flush=True)
@@ -137,7 +143,9 @@ class PipelineManager:
                     generate_long_audio(
                         text, model, output_wav, 
                         chunk_size=250, silence_per_newline=0.3,
-                        audio_prompt_path=self.reference_audio
+                        audio_prompt_path=self.reference_audio,
+                        quality=self.quality,
+                        script=self.compile_script(i, name, text)
                     )
                 except Exception as e:
                     print(f"❌ Audio Error {name}: {e}", flush=True)
@@ -157,6 +165,59 @@ class PipelineManager:
         if torch.cuda.is_available(): torch.cuda.empty_cache()
         print("✅ Audio: Finished all tasks.", flush=True)
 
+    def compile_script(self, i, name, text):
+        """Compile the chapter's narration script next to its preprocessed text."""
+        from narration_script import compile_chapter
+        return compile_chapter(
+            PREPROCESSED_DIR / f"{i:02d}_{name}.txt", text,
+            chunk_size=250, silence_per_newline=0.3,
+            audio_prompt_path=self.reference_audio
+        )
+
+    def audio_pool_worker(self):
+        """Stage 2 (CPU pool): segments of every queued chapter share a multi-process TTS pool."""
+        from tts_pool import TTSWorkerPool
+        print(f"🎙️ Audio: Starting TTS pool with {self.tts_workers} workers...", flush=True)
+        pool = TTSWorkerPool(self.tts_workers, quality=self.quality).start()
+        in_flight = {}
+        
+        def push_captions(chapter_ids):
+            for chapter_id in chapter_ids:
+                task = in_flight.pop(chapter_id)
+                self.caption_queue.put(task)
+                self.tts_queue.task_done()
+        
+        producer_done = False
+        while not self.stop_signal.is_set() and (not producer_done or in_flight):
+            if not producer_done:
+                try:
+                    task = self.tts_queue.get(timeout=1)
+                except queue.Empty:
+                    task = False
+                if task is None:
+                    producer_done = True
+                elif task:
+                    i, name, text = task['index'], task['name'], task['text']
+                    output_wav = self.output_dir / f"{i:02d}_{name}.wav"
+                    caption_task = {'index': i, 'name': name, 'wav': str(output_wav)}
+                    in_flight[output_wav.stem] = caption_task
+                    if output_wav.exists():
+                        print(f"   ✓ Audio: {name} already exists.", flush=True)
+                        push_captions([output_wav.stem])
+                    else:
+                        print(f"🎵 Audio: Queued Chapter {i}: {name} for the TTS pool...", flush=True)
+                        done = pool.submit_chapter(
+                            output_wav.stem, text, output_wav,
+                            script=self.compile_script(i, name, text)
+                        )
+                        if done:
+                            push_captions([done])
+            push_captions(pool.poll(timeout=0 if not producer_done else 5))
+        
+        pool.close()
+        self.caption_queue.put(None)
+        print("✅ Audio: Finished all tasks.", flush=True)
+
     def caption_worker(self):
         """Stage 3: Whisper Transcription (Parallel with Audio)"""
         print("📝 Captioner: Waiting for audio files...", flush=True)
@@ -168,7 +229,7 @@ class PipelineManager:
             if task is None: break
             
             i, name, wav = task['index'], task['name'], task['wav']
-            output_srt = TRANSCRIPTS_DIR / f"{i:02d}_{name}.srt"
+            output_srt = self.transcripts_dir / f"{i:02d}_{name}.srt"
             
             if not output_srt.exists():
                 print(f"📝 Captioner: Transcribing {name}...", flush=True)
@@ -205,6 +266,10 @@ class PipelineManager:
         end_time = time.time()
         print(f"\n✨ Parallel Generation Complete in {(end_time - start_time)/60:.1f} minutes!")
         
+        if self.quality == "draft":
+            print(f"📝 Draft audio is in {self.output_dir} (proof listening only, not mastered)")
+            return
+        
         # Step 4: Combine Everything
         self.assemble_final_product()
 
@@ -242,72 +307,33 @@ class PipelineManager:
         print("STAGE 5: TECHNICAL VALIDATION (ACX/Audible Compliance)")
         print("="*60 + "\n")
         val_mod = __import__('5_technical_validation')
-        val_mod.validate_audio(master_audio)
+        val_mod.validate_audio(master_audio, val_mod.delivered_chapters())
+
+        # 6. Distribution Export (M4B, chapter MP3s, Opus from one read of the master)
+        print("\n" + "="*60)
+        print("STAGE 6: DISTRIBUTION EXPORT")
+        print("="*60 + "\n")
+        export_mod = __import__('6_export_distribution')
+        export_mod.export_distribution(master_audio)
 
     def merge_srt_files(self):
-        """Merges individual chapter SRTs into one, offset by chapter durations."""
+        """Merges individual chapter SRTs into one, offset by chapter durations and Stage 3's gaps."""
         print("🔗 Merging chapter transcripts into master SRT...", flush=True)
-        import torchaudio as ta
-        
-        srt_files = sorted(TRANSCRIPTS_DIR.glob("*.srt"))
-        master_srt = OUTPUT_DIR / "GelezinioVilkoSaga_Book1_Complete.srt"
-        
-        cumulative_offset = 0.0
-        master_lines = []
-        caption_index = 1
-        
-        for srt_file in srt_files:
-            # Get chapter duration for offset
-            wav_file = OUTPUT_DIR / (srt_file.stem + ".wav")
-            if not wav_file.exists(): continue
-            
-            waveform, sr = ta.load(str(wav_file))
-            duration = waveform.shape[1] / sr
-            
-            # Parse and offset SRT
-            with open(srt_file, 'r') as f:
-                content = f.read().strip()
-                if not content: continue
-                
-                blocks = content.split('\n\n')
-                for block in blocks:
-                    lines = block.split('\n')
-                    if len(lines) < 3: continue
-                    
-                    # Offset the time line: 00:00:01,000 --> 00:00:04,000
-                    timeline = lines[1]
-                    start_str, end_str = timeline.split(' --> ')
-                    
-                    new_start = self.offset_srt_time(start_str, cumulative_offset)
-                    new_end = self.offset_srt_time(end_str, cumulative_offset)
-                    
-                    master_lines.append(f"{caption_index}\n{new_start} --> {new_end}\n" + "\n".join(lines[2:]))
-                    caption_index += 1
-            
-            cumulative_offset += duration
-            
-        with open(master_srt, 'w') as f:
-            f.write("\n\n".join(master_lines))
-        print(f"✅ Master SRT saved: {master_srt.name}", flush=True)
-
-    def offset_srt_time(self, time_str, offset_sec):
-        # HH:MM:SS,mmm
-        h, m, s_m = time_str.split(':')
-        s, ms = s_m.split(',')
-        total_sec = int(h)*3600 + int(m)*60 + int(s) + int(ms)/1000.0
-        total_sec += offset_sec
+        from caption_merge import BOOK_CAPTIONS, merge_book_captions
         
-        nh = int(total_sec // 3600)
-        nm = int((total_sec % 3600) // 60)
-        ns = int(total_sec % 60)
-        nms = int((total_sec % 1) * 1000)
-        return f"{nh:02d}:{nm:02d}:{ns:02d},{nms:03d}"
+        cues = merge_book_captions(BOOK_CAPTIONS, TRANSCRIPTS_DIR)
+        print(f"✅ Master SRT saved: {BOOK_CAPTIONS.name} ({cues} captions)", flush=True)
 
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument("--reference-audio", type=str, default=None)
+    parser.add_argument("--tts-workers", type=int, default=1,
+                        help="TTS worker processes for CPU narration")
+    parser.add_argument("--quality", default="final", choices=["final", "draft"],
+                        help="draft = fast proof-listening audio, skipped by final assembly")
     args = parser.parse_args()
     
-    manager = PipelineManager(reference_audio=args.reference_audio)
+    manager = PipelineManager(reference_audio=args.reference_audio, tts_workers=args.tts_workers,
+                              quality=args.quality)
     manager.run()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Incremental per-chapter mastering.
+
+Instead of one dynamic-mode loudnorm pass over the whole concatenated book,
+every chapter is mastered on its own:
+
+1. Measure: native BS.1770 analysis (integrated loudness, true peak, LRA; see
+   audio_analysis.py). Results are cached by the chapter's content hash.
+2. Apply: one linear gain to reach TARGET_LUFS, plus a peak limiter only when
+   the gained true peak would exceed TARGET_TP. Chapters are processed in
+   parallel in a process pool; output goes to output/mastered/.
+3. Stage 3 then resamples the mastered chapters to the delivery rate (see
+   resampling.py) and joins them with a plain streaming copy.
+
+A mastered chapter is reused as long as its source hash and the mastering
+settings are unchanged, so editing one chapter re-masters only that chapter.
+Every chapter is brought to the same integrated loudness, so the joined book
+lands close to the target. It is not identical to a full-book pass: limiting is
+decided per chapter and the gaps between chapters are not measured.
+
+Mastering is all or nothing: if one chapter fails, Stage 3 stops rather than
+join mastered and unmastered chapters.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+AUDIOBOOK_DIR = Path(__file__).parent
+MASTERED_DIR = AUDIOBOOK_DIR / "output" / "mastered"
+
+# EBU R128-style targets for the narration (same as the former full-book loudnorm pass)
+TARGET_LUFS = -14.0
+TARGET_TP = -1.5
+TARGET_LRA = 11.0
+# The limiter works on sample peaks; keep this much headroom for inter-sample peaks
+TRUE_PEAK_MARGIN_DB = 0.5
+# Bump when the mastering chain changes, so cached masters are rebuilt
+MASTERING_VERSION = 3
+
+
+def settings():
+    return {'version': MASTERING_VERSION, 'lufs': TARGET_LUFS, 'tp': TARGET_TP, 'lra': TARGET_LRA,
+            'margin': TRUE_PEAK_MARGIN_DB}
+
+
+def content_hash(path):
+    """SHA-256 of a file's bytes."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def measure_loudness(path, digest=None):
+    """Integrated loudness, true peak and LRA of one file.
+
+    Native single-pass analysis (audio_analysis.py), cached by content hash.
+    Returns {'input_i', 'input_tp', 'input_lra'}; input_i is -inf for silence.
+    """
+    from audio_analysis import analyze_file
+
+    analysis = analyze_file(path, digest)
+    integrated = analysis['integrated_lufs']
+    return {'input_i': float('-inf') if integrated is None else integrated,
+            'input_tp': analysis['true_peak_db'], 'input_lra': analysis['lra']}
+
+
+def mastering_filter(measurement):
+    """(ffmpeg filter, gain dB, limited) for one chapter's measurement."""
+    if measurement['input_i'] == float('-inf') or measurement['input_i'] < -70:
+        # Silent chapter: nothing to normalize
+        return "anull", 0.0, False
+    gain = TARGET_LUFS - measurement['input_i']
+    filters = [f"volume={gain:.2f}dB"]
+    limited = measurement['input_tp'] + gain > TARGET_TP
+    if limited:
+        ceiling = 10 ** ((TARGET_TP - TRUE_PEAK_MARGIN_DB) / 20)
+        # latency=1 compensates the lookahead delay, so limited chapters stay sample-aligned
+        filters.append(f"alimiter=limit={ceiling:.4f}:attack=5:release=50:level=disabled:latency=1")
+    return ",".join(filters), gain, limited
+
+
+def ffmpeg_supports_mastering():
+    """True if ffmpeg is installed and its alimiter has the latency option (ffmpeg 5.1+)."""
+    if not shutil.which("ffmpeg"):
+        return False
+    try:
+        result = subprocess.run(["ffmpeg", "-hide_banner", "-h", "filter=alimiter"],
+                                capture_output=True, text=True, timeout=30)
+    except (OSError, subprocess.SubprocessError):
+        return False
+    return "latency" in result.stdout
+
+
+def mastered_path(wav_path, mastered_dir=MASTERED_DIR):
+    return Path(mastered_dir) / Path(wav_path).name
+
+
+def _master_info_path(output_path):
+    return output_path.with_name(output_path.stem + '.master.json')
+
+
+def is_mastered(wav_path, digest, mastered_dir=MASTERED_DIR):
+    """True if the mastered copy was made from this exact source with the current settings."""
+    output_path = mastered_path(wav_path, mastered_dir)
+    info_path = _master_info_path(output_path)
+    if not output_path.exists() or not info_path.exists():
+        return False
+    try:
+        with open(info_path, 'r') as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return info.get('source_sha256') == digest and info.get('settings') == settings()
+
+
+def master_chapter(wav_path, mastered_dir=MASTERED_DIR):
+    """Measure (or reuse the measurement) and write the mastered float32 copy of one chapter.
+
+    Runs in a worker process. Returns a dict describing what was done.
+    """
+    from wav_io import read_wav_info
+
+    wav_path = Path(wav_path)
+    output_path = mastered_path(wav_path, mastered_dir)
+    digest = content_hash(wav_path)
+    if is_mastered(wav_path, digest, mastered_dir):
+        return {'chapter': wav_path.name, 'cached': True}
+
+    measurement = measure_loudness(wav_path, digest)
+    audio_filter, gain, limited = mastering_filter(measurement)
+    tmp_path = output_path.with_name(output_path.stem + '.tmp.wav')
+    cmd = ["ffmpeg", "-y", "-hide_banner", "-nostats", "-i", str(wav_path),
+           "-af", audio_filter, "-c:a", "pcm_f32le", str(tmp_path)]
+    subprocess.run(cmd, check=True, capture_output=True)
+    # Chapter spans, captions and segment maps all assume mastering keeps every sample in place
+    source_frames, mastered_frames = read_wav_info(wav_path)['frames'], read_wav_info(tmp_path)['frames']
+    if mastered_frames != source_frames:
+        tmp_path.unlink()
+        raise ValueError(f"mastered length {mastered_frames} != source length {source_frames} frames")
+    tmp_path.replace(output_path)
+    with open(_master_info_path(output_path), 'w') as f:
+        json.dump({'source_sha256': digest, 'settings': settings(), 'measurement': measurement,
+                   'gain_db': gain, 'limited': limited}, f, indent=2)
+    return {'chapter': wav_path.name, 'cached': False, 'input_i': measurement['input_i'],
+            'gain_db': gain, 'limited': limited}
+
+
+def master_chapters(wav_files, mastered_dir=MASTERED_DIR, workers=None):
+    """Master every chapter in parallel; returns {source path: mastered path}.
+
+    Without a capable ffmpeg every chapter is returned unmastered. Raises
+    RuntimeError if any chapter fails, so the book is never a mix of both.
+    """
+    Path(mastered_dir).mkdir(parents=True, exist_ok=True)
+    if not ffmpeg_supports_mastering():
+        print("❌ ffmpeg 5.1+ (alimiter latency option) not found; chapters are joined unmastered")
+        return {Path(f): Path(f) for f in wav_files}
+
+    workers = workers or min(len(wav_files), os.cpu_count() or 1) or 1
+    results = {}
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {Path(f): pool.submit(master_chapter, str(f), str(mastered_dir)) for f in wav_files}
+        for wav_file, future in futures.items():
+            try:
+                report = future.result()
+            except subprocess.CalledProcessError as e:
+                stderr = e.stderr.decode(errors='replace') if isinstance(e.stderr, bytes) else e.stderr
+                print(f"❌ Mastering failed for {wav_file.name}: {(stderr or '').strip()[-300:]}", flush=True)
+                failed.append(wav_file.name)
+                continue
+            except Exception as e:
+                print(f"❌ Mastering failed for {wav_file.name}: {e}", flush=True)
+                failed.append(wav_file.name)
+                continue
+            if report['cached']:
+                print(f"   ♻️  {wav_file.name}: mastered copy is current")
+            else:
+                print(f"   🔊 {wav_file.name}: {report['input_i']:.1f} LUFS, gain {report['gain_db']:+.1f} dB"
+                      + (", peak-limited" if report['limited'] else ""))
+            results[wav_file] = mastered_path(wav_file, mastered_dir)
+    if failed:
+        raise RuntimeError(f"Mastering failed for {len(failed)} chapter(s): {', '.join(failed)}")
+    return results
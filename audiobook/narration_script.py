@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Compiled narration scripts: the contract between preprocessed text and TTS.
+
+A preprocessed chapter is parsed once (voice tags, implicit speaker cues, chunking,
+newline pauses) into `preprocessed/<chapter>.script.jsonl`. The first line is a
+header; every following line is one segment:
+
+    {"id": "3f2a9c01d4e7-0", "type": "speech", "paragraph": 4, "chunk": 0,
+     "voice": "/path/voice.wav", "text": "...", "pause": 0.3}
+    {"id": "3f2a9c01d4e7-0/pause1", "type": "pause", "paragraph": 5, "pause": 0.3}
+
+Speech IDs are derived from the voice and text (plus an occurrence counter), so
+they stay the same when other paragraphs are edited. `pause` is the silence in
+seconds after the segment; `chunk` is the segment's position within its paragraph
+(a chunk from chunk_planner, which may hold several sentences). TTS, splicing and captions all read the script instead
+of re-parsing the text.
+"""
+
+import hashlib
+import json
+import logging
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Bumped when parsing or chunking changes, so existing scripts are recompiled
+SCRIPT_VERSION = 3
+
+
+def script_path(text_path):
+    """Location of the compiled script for a preprocessed chapter file."""
+    text_path = Path(text_path)
+    return text_path.with_name(text_path.stem + '.script.jsonl')
+
+
+def _speech_id(voice, text, seen):
+    from segment_cache import normalize_segment_text
+
+    base = hashlib.sha1(f"{voice}\n{normalize_segment_text(text)}".encode('utf-8')).hexdigest()[:12]
+    occurrence = seen.get(base, 0)
+    seen[base] = occurrence + 1
+    return f"{base}-{occurrence}"
+
+
+def compile_script(text, chunk_size=250, silence_per_newline=0.3, voice_map=None, default_voice=None,
+                   audio_prompt_path=None):
+    """Parse narration text into a list of script segments."""
+    from tts_helpers import plan_narration
+
+    plan = plan_narration(text, chunk_size, voice_map, default_voice, audio_prompt_path)
+    records = []
+    seen = {}
+    last_id = "start"
+    pauses_since_speech = 0
+    for item in plan:
+        if item['type'] == 'speech':
+            last_id = _speech_id(item['voice'], item['text'], seen)
+            pauses_since_speech = 0
+            records.append({
+                'id': last_id,
+                'type': 'speech',
+                'paragraph': item['line'],
+                'chunk': item['chunk'],
+                'voice': str(item['voice']) if item['voice'] else None,
+                'text': item['text'],
+                'pause': 0.0,
+            })
+            continue
+        prev = records[-1] if records else None
+        if prev and prev['type'] == 'speech' and prev['paragraph'] == item['line'] and not prev['pause']:
+            # End-of-line pause belongs to the line's last segment
+            prev['pause'] = silence_per_newline
+        else:
+            # Blank line: a standalone pause
+            pauses_since_speech += 1
+            records.append({
+                'id': f"{last_id}/pause{pauses_since_speech}",
+                'type': 'pause',
+                'paragraph': item['line'],
+                'pause': silence_per_newline,
+            })
+    return records
+
+
+def script_to_plan(records):
+    """Expand script segments into the speech/pause items ChapterWriter consumes."""
+    plan = []
+    for record in records:
+        if record['type'] == 'speech':
+            plan.append({
+                'type': 'speech',
+                'line': record['paragraph'],
+                # Version 2 scripts called the chunk index 'sentence'
+                'chunk': record['chunk'] if 'chunk' in record else record['sentence'],
+                'voice': record['voice'],
+                'text': record['text'],
+                'id': record['id'],
+            })
+        if record['pause']:
+            plan.append({'type': 'pause', 'line': record['paragraph'], 'seconds': record['pause']})
+    return plan
+
+
+def write_script(path, records, header):
+    path = Path(path)
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(header, ensure_ascii=False) + '\n')
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    tmp_path.replace(path)
+
+
+def load_script(path):
+    """Return (header, records) for a compiled script."""
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = [json.loads(line) for line in f if line.strip()]
+    if not lines:
+        raise ValueError(f"{path} is empty")
+    return lines[0], lines[1:]
+
+
+def compile_chapter(text_path, text=None, chunk_size=250, silence_per_newline=0.3, voice_map=None,
+                    default_voice=None, audio_prompt_path=None):
+    """Compile (or reuse) the script for a preprocessed chapter file.
+
+    The script is rebuilt whenever the source text or any parsing setting changes.
+    """
+    text_path = Path(text_path)
+    if text is None:
+        text = text_path.read_text(encoding='utf-8')
+    settings = {
+        'chunk_size': chunk_size,
+        'silence_per_newline': silence_per_newline,
+        'voice_map': {name: str(path) for name, path in sorted((voice_map or {}).items())},
+        'default_voice': str(default_voice) if default_voice else None,
+        'audio_prompt_path': str(audio_prompt_path) if audio_prompt_path else None,
+    }
+    header = {
+        'script_version': SCRIPT_VERSION,
+        'source_sha1': hashlib.sha1(text.encode('utf-8')).hexdigest(),
+        'settings': settings,
+    }
+
+    path = script_path(text_path)
+    if path.exists():
+        try:
+            old_header, records = load_script(path)
+            if old_header == header:
+                return records
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ Recompiling unreadable script {path.name}: {e}")
+
+    records = compile_script(text, chunk_size, silence_per_newline, voice_map, default_voice, audio_prompt_path)
+    write_script(path, records, header)
+    speech = sum(1 for r in records if r['type'] == 'speech')
+    logger.info(f"📜 Compiled {path.name}: {speech} speech segments, {len(records) - speech} pauses")
+    return records
+
+
+def _caption_pieces(text, max_chars=84):
+    """Split a segment's text into caption-sized pieces at word boundaries."""
+    pieces = []
+    current = ""
+    for word in text.split():
+        if current and len(current) + 1 + len(word) > max_chars:
+            pieces.append(current)
+            current = word
+        else:
+            current = f"{current} {word}" if current else word
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def script_captions(records, segment_map, output_srt):
+    """Write an SRT straight from the script and the chapter's segment offsets (no ASR).
+
+    Each speech segment's time span is split across its caption pieces in
+    proportion to their length. Returns False when the segment map does not
+    match the script.
+    """
+    spans = {s['id']: (s['start'], s['end']) for s in segment_map.get('segments', []) if s.get('id')}
+    speech = [r for r in records if r['type'] == 'speech']
+    if not speech or any(r['id'] not in spans for r in speech):
+        return False
+
+    def fmt(seconds):
+        ms = int(round(seconds * 1000))
+        h, rem = divmod(ms, 3600000)
+        m, rem = divmod(rem, 60000)
+        s, ms = divmod(rem, 1000)
+        return f"{h:02d}:{m:02d}:{s:02d},{ms:03d}"
+
+    sr = segment_map['sample_rate']
+    cue = 1
+    with open(output_srt, 'w', encoding='utf-8') as f:
+        for record in speech:
+            start, end = spans[record['id']]
+            if end <= start:
+                continue
+            pieces = _caption_pieces(record['text'])
+            total = sum(len(p) for p in pieces)
+            t = start / sr
+            for piece in pieces:
+                duration = (end - start) / sr * len(piece) / total
+                f.write(f"{cue}\n{fmt(t)} --> {fmt(t + duration)}\n{piece}\n\n")
+                t += duration
+                cue += 1
+    return True
+
+
+def captions_from_script(audio_path, output_srt):
+    """Caption a chapter WAV from its compiled script if one matches; returns True on success."""
+    from audio_meta import segment_map_path
+
+    audio_path = Path(audio_path)
+    map_path = segment_map_path(audio_path)
+    path = script_path(Path(__file__).parent / "preprocessed" / f"{audio_path.stem}.txt")
+    if not map_path.exists() or not path.exists():
+        return False
+    try:
+        with open(map_path, 'r') as f:
+            segment_map = json.load(f)
+        _, records = load_script(path)
+    except (OSError, ValueError):
+        return False
+    return script_captions(records, segment_map, output_srt)
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+ONNX Runtime backend for the S3Gen waveform stage.
+
+After T3 has produced speech tokens, S3Gen turns them into audio in two
+fixed-shape convolutional networks: the flow-matching estimator (run once per
+MeanFlow step) and the body of the HiFT vocoder. Both are exported once to
+cache/onnx/ and then run through ONNX Runtime with tuned intra-op threads, which
+is faster than eager PyTorch on CPU. The small pieces that do not export cleanly
+(the conformer encoder, source excitation, STFT/iSTFT) stay in PyTorch.
+
+If onnxruntime is missing, the export fails or the exported graph does not match
+eager output, the model keeps the eager PyTorch backend.
+
+Usage:
+    python onnx_backend.py --export     # (re)build the ONNX graphs
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+logger = logging.getLogger(__name__)
+
+ONNX_DIR = Path(__file__).parent / "cache" / "onnx"
+BACKENDS = ("torch", "onnx")
+# Pipeline-wide default, like TTS_SERVICE_PORT; --backend flags override it
+DEFAULT_BACKEND = os.environ.get("TTS_BACKEND", "torch")
+OPSET = 17
+PARITY_TOLERANCE = 1e-3
+
+
+class HiftBody(torch.nn.Module):
+    """The convolutional part of HiFTGenerator.decode: (mel, source STFT) -> conv_post output."""
+
+    def __init__(self, hift):
+        super().__init__()
+        self.hift = hift
+
+    def forward(self, x, s_stft):
+        h = self.hift
+        x = h.conv_pre(x)
+        for i in range(h.num_upsamples):
+            x = F.leaky_relu(x, h.lrelu_slope)
+            x = h.ups[i](x)
+            if i == h.num_upsamples - 1:
+                x = h.reflection_pad(x)
+            x = x + h.source_resblocks[i](h.source_downs[i](s_stft))
+            xs = None
+            for j in range(h.num_kernels):
+                out = h.resblocks[i * h.num_kernels + j](x)
+                xs = out if xs is None else xs + out
+            x = xs / h.num_kernels
+        x = F.leaky_relu(x)
+        return h.conv_post(x)
+
+
+def _source_stft(hift, mel):
+    """Run the (eager) f0 predictor and source module the way HiFTGenerator.inference does."""
+    f0 = hift.f0_predictor(mel)
+    s = hift.f0_upsamp(f0[:, None]).transpose(1, 2)
+    s, _, _ = hift.m_source(s)
+    s_real, s_imag = hift._stft(s.transpose(1, 2).squeeze(1))
+    return torch.cat([s_real, s_imag], dim=1)
+
+
+def _estimator_inputs(frames, n_mels=80):
+    return (
+        torch.randn(1, n_mels, frames),   # x
+        torch.ones(1, 1, frames),         # mask
+        torch.randn(1, n_mels, frames),   # mu
+        torch.tensor([0.0]),              # t
+        torch.randn(1, n_mels),           # spks
+        torch.randn(1, n_mels, frames),   # cond
+        torch.tensor([0.5]),              # r
+    )
+
+
+ESTIMATOR_INPUTS = ['x', 'mask', 'mu', 't', 'spks', 'cond', 'r']
+
+
+def onnx_is_current(onnx_dir=ONNX_DIR):
+    """True if the exported graphs exist and match the installed model version."""
+    from voice_conditionals import model_version
+
+    manifest_path = Path(onnx_dir) / "manifest.json"
+    if not manifest_path.exists():
+        return False
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return manifest.get('model_version') == model_version()
+
+
+def _session(path, threads=None):
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.intra_op_num_threads = threads or 0  # 0 = one per physical core
+    options.inter_op_num_threads = 1
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    return ort.InferenceSession(str(path), options, providers=["CPUExecutionProvider"])
+
+
+def _check_parity(session, module, inputs, names):
+    """Compare an exported graph with eager output on a length it was not traced with."""
+    with torch.inference_mode():
+        expected = module(*inputs).numpy()
+    actual = session.run(None, {name: t.numpy() for name, t in zip(names, inputs)})[0]
+    error = float(np.abs(actual - expected).max())
+    if actual.shape != expected.shape or error > PARITY_TOLERANCE:
+        raise RuntimeError(f"ONNX output differs from eager (shape {actual.shape} vs {expected.shape}, "
+                           f"max error {error:.2e})")
+
+
+def export_onnx(model, onnx_dir=ONNX_DIR):
+    """Export the flow estimator and HiFT body of a float32 CPU model to ONNX."""
+    from voice_conditionals import model_version
+
+    onnx_dir = Path(onnx_dir)
+    tmp_dir = onnx_dir.with_name(f"{onnx_dir.name}.tmp{os.getpid()}")
+    if tmp_dir.exists():
+        shutil.rmtree(tmp_dir)
+    tmp_dir.mkdir(parents=True)
+
+    logger.info(f"📦 Exporting S3Gen to ONNX in {onnx_dir}...")
+    estimator = model.s3gen.flow.decoder.estimator
+    hift_body = HiftBody(model.s3gen.mel2wav).eval()
+    torch.manual_seed(0)
+    with torch.no_grad():
+        torch.onnx.export(
+            estimator, _estimator_inputs(200), str(tmp_dir / "estimator.onnx"),
+            input_names=ESTIMATOR_INPUTS, output_names=['dxdt'], opset_version=OPSET,
+            dynamic_axes={name: {2: 'frames'} for name in ('x', 'mask', 'mu', 'cond', 'dxdt')},
+        )
+        mel = torch.randn(1, 80, 100)
+        torch.onnx.export(
+            hift_body, (mel, _source_stft(model.s3gen.mel2wav, mel)), str(tmp_dir / "hift.onnx"),
+            input_names=['mel', 's_stft'], output_names=['spec'], opset_version=OPSET,
+            dynamic_axes={'mel': {2: 'frames'}, 's_stft': {2: 'stft_frames'}, 'spec': {2: 'stft_frames'}},
+        )
+
+    # Traced graphs can silently bake in a length; check them on a different one
+    _check_parity(_session(tmp_dir / "estimator.onnx"), estimator, _estimator_inputs(137), ESTIMATOR_INPUTS)
+    mel = torch.randn(1, 80, 73)
+    with torch.inference_mode():
+        s_stft = _source_stft(model.s3gen.mel2wav, mel)
+    _check_parity(_session(tmp_dir / "hift.onnx"), hift_body, (mel, s_stft), ['mel', 's_stft'])
+
+    with open(tmp_dir / "manifest.json", 'w') as f:
+        json.dump({'model_version': model_version(model), 'torch_version': torch.__version__, 'opset': OPSET},
+                  f, indent=2)
+    if onnx_dir.exists():
+        shutil.rmtree(onnx_dir)
+    tmp_dir.rename(onnx_dir)
+    logger.info("✅ ONNX export done")
+
+
+def ensure_onnx_export(onnx_dir=ONNX_DIR):
+    """Export once if missing or stale (call before spawning workers). Returns False on failure."""
+    if onnx_is_current(onnx_dir):
+        return True
+    from tts_model import load_snapshot, ensure_snapshot
+
+    try:
+        ensure_snapshot()
+        export_onnx(load_snapshot(device="cpu"), onnx_dir)
+        return True
+    except Exception as e:
+        logger.warning(f"⚠️ ONNX export failed ({e}); using the eager PyTorch backend")
+        return False
+
+
+class OnnxEstimator(torch.nn.Module):
+    """Drop-in for the flow-matching estimator module, backed by an ONNX Runtime session."""
+
+    def __init__(self, session):
+        super().__init__()
+        self.session = session
+
+    @property
+    def dtype(self):
+        # CausalConditionalCFM casts its inputs to the estimator's dtype
+        return torch.float32
+
+    def forward(self, x, mask, mu, t, spks=None, cond=None, r=None):
+        feeds = {name: tensor.detach().cpu().numpy()
+                 for name, tensor in zip(ESTIMATOR_INPUTS, (x, mask, mu, t, spks, cond, r))}
+        return torch.from_numpy(self.session.run(None, feeds)[0]).to(x.device)
+
+
+def _onnx_decode(hift, session):
+    """Replacement for HiFTGenerator.decode that runs the convolutional body in ONNX Runtime."""
+    def decode(x, s=torch.zeros(1, 1, 0)):
+        s_real, s_imag = hift._stft(s.squeeze(1))
+        s_stft = torch.cat([s_real, s_imag], dim=1)
+        spec = session.run(None, {'mel': x.detach().cpu().numpy(), 's_stft': s_stft.detach().cpu().numpy()})[0]
+        spec = torch.from_numpy(spec)
+        n_bins = hift.istft_params["n_fft"] // 2 + 1
+        magnitude = torch.exp(spec[:, :n_bins, :])
+        phase = torch.sin(spec[:, n_bins:, :])
+        wav = hift._istft(magnitude, phase)
+        return torch.clamp(wav, -hift.audio_limit, hift.audio_limit)
+
+    return decode
+
+
+def apply_backend(model, backend=None, threads=None, onnx_dir=ONNX_DIR):
+    """Switch S3Gen's estimator and vocoder to the given backend ("torch" or "onnx").
+
+    Args:
+        model: A float32 ChatterboxTurboTTS
+        backend: "torch" or "onnx" (None = DEFAULT_BACKEND, from TTS_BACKEND)
+        threads: ONNX Runtime intra-op threads (None = torch's thread count)
+    Sets `model.backend` to the backend actually in use.
+    """
+    backend = backend or DEFAULT_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend!r}; choose from {BACKENDS}")
+    model.backend = "torch"
+    if backend == "torch":
+        return model
+    if str(model.device) != "cpu":
+        logger.warning("⚠️ The ONNX backend is CPU-only; keeping PyTorch")
+        return model
+
+    try:
+        if not onnx_is_current(onnx_dir):
+            export_onnx(model, onnx_dir)
+        threads = threads or torch.get_num_threads()
+        estimator = _session(Path(onnx_dir) / "estimator.onnx", threads)
+        hift = _session(Path(onnx_dir) / "hift.onnx", threads)
+    except Exception as e:
+        logger.warning(f"⚠️ ONNX backend unavailable ({e}); keeping PyTorch")
+        return model
+
+    model.s3gen.flow.decoder.estimator = OnnxEstimator(estimator)
+    model.s3gen.mel2wav.decode = _onnx_decode(model.s3gen.mel2wav, hift)
+    model.backend = "onnx"
+    logger.info(f"⚡ S3Gen running on ONNX Runtime ({threads} threads)")
+    return model
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export S3Gen to ONNX and time it against PyTorch")
+    parser.add_argument("--export", action="store_true", help="Rebuild the ONNX graphs")
+    parser.add_argument("--threads", type=int, default=None, help="torch and ONNX Runtime intra-op threads")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    from tts_model import load_tts_model
+    from tts_synth import synthesize
+
+    if args.export:
+        model = load_tts_model("cpu", warmup=False)
+        export_onnx(model)
+    for backend in BACKENDS:
+        model = load_tts_model("cpu", backend=backend)
+        start = time.perf_counter()
+        wav = synthesize(model, "The wolf waited at the edge of the forest, and the snow kept falling.")
+        wall = time.perf_counter() - start
+        print(f"{model.backend:<6} | RTF {wall / (wav.shape[1] / model.sr):.2f}")
+
+
+if __name__ == "__main__":
+    main()
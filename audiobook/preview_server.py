@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+Streaming preview server for chapter narration.
+
+Checking how a preprocessed chapter sounds used to mean rendering the whole
+chapter WAV. This server keeps a warm model (or talks to the running TTS
+service) and streams narration segment by segment as each one finishes, so the
+first audio arrives after one segment instead of one chapter:
+
+    GET  /chapters                                   -> [{"index", "name", "ready"}]
+    GET  /preview?chapter=<name>&position=<seconds>  -> audio stream
+    POST /preview  {"text", "voice"}                 -> audio stream for a snippet
+
+Optional query/body fields: quality=draft|final (default draft), format=pcm|opus.
+`pcm` streams raw float32 mono samples (rate in X-Sample-Rate), `opus` streams
+Ogg/Opus through ffmpeg. A chapter preview starts with the segment nearest
+`position` (estimated from the chapter's segment map when it has been rendered,
+else from its text length) and continues forward with pauses as silence; to
+seek, close the stream and request a new position. Segments come from the
+segment cache when possible, and newly synthesized ones are cached so Stage 2
+reuses them.
+
+Usage:
+    python preview_server.py --port 8766
+    curl -s "localhost:8766/preview?chapter=gintaro_sapnas&position=120" | ffplay -f f32le -ar 24000 -ac 1 -
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import shutil
+import subprocess
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+logger = logging.getLogger(__name__)
+
+PREPROCESSED_DIR = Path(__file__).parent / "preprocessed"
+OUTPUT_DIR = Path(__file__).parent / "output"
+VOICE_DIR = Path(__file__).parent / "voices"
+NARRATOR_VOICE = Path(__file__).parent / "reference_voice.wav"
+DEFAULT_PORT = 8766
+# Pace used to place `position` in chapters that have not been rendered yet
+ESTIMATED_SECONDS_PER_CHAR = 0.07
+OPUS_BITRATE = "48k"
+
+
+def load_chapters():
+    """Chapters listed in Stage 1's manifest."""
+    manifest_path = PREPROCESSED_DIR / "manifest.json"
+    if not manifest_path.exists():
+        return []
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+
+def find_chapter(name):
+    """Manifest entry matching a chapter name or its `NN_name` output stem."""
+    for chapter in load_chapters():
+        if name in (chapter['name'], f"{chapter['index']:02d}_{chapter['name']}"):
+            return chapter
+    raise KeyError(f"unknown chapter {name!r}")
+
+
+def discover_voices():
+    """Voice map for chapters without a compiled script: voices/<name>.wav answers to [Name]."""
+    voices = {path.stem.title(): path for path in sorted(VOICE_DIR.glob("*.wav"))}
+    if NARRATOR_VOICE.exists():
+        voices["Narrator"] = NARRATOR_VOICE
+    return voices
+
+
+def chapter_plan(chapter):
+    """Plan items for a chapter, from the script Stage 2 compiled (or parsed here if there is none)."""
+    from narration_script import compile_script, load_script, script_path, script_to_plan
+
+    text_path = Path(chapter['file'])
+    path = script_path(text_path)
+    if path.exists():
+        _, records = load_script(path)
+    else:
+        voices = discover_voices()
+        records = compile_script(text_path.read_text(encoding='utf-8'), voice_map=voices,
+                                 default_voice=voices.get("Narrator"))
+    return script_to_plan(records)
+
+
+def snippet_plan(text, voice=None):
+    """Plan items for a free-text snippet (voice tags work as in chapters)."""
+    from tts_helpers import plan_narration
+
+    voices = discover_voices()
+    return plan_narration(text, voice_map=voices, default_voice=voice or voices.get("Narrator"))
+
+
+def speech_offsets(plan, segment_map_file=None):
+    """Estimated start time in seconds of each speech item.
+
+    Uses the real offsets from a rendered chapter's segment map where the segment
+    ids still match, and a characters-based estimate elsewhere.
+    """
+    known = {}
+    if segment_map_file and Path(segment_map_file).exists():
+        try:
+            with open(segment_map_file, 'r') as f:
+                segment_map = json.load(f)
+            rate = segment_map['sample_rate']
+            known = {s['id']: s['start'] / rate for s in segment_map.get('segments', []) if s.get('id')}
+        except (OSError, ValueError, KeyError):
+            known = {}
+
+    offsets = []
+    clock = 0.0
+    for item in plan:
+        if item['type'] == 'pause':
+            clock += item.get('seconds', 0.3)
+            continue
+        clock = known.get(item.get('id'), clock)
+        offsets.append(clock)
+        clock += len(item['text']) * ESTIMATED_SECONDS_PER_CHAR
+    return offsets
+
+
+def nearest_speech(offsets, position):
+    """Index of the speech item whose start is nearest `position` seconds."""
+    if not offsets:
+        return 0
+    return int(np.argmin(np.abs(np.asarray(offsets) - position)))
+
+
+class PreviewRenderer:
+    """Synthesizes plan items one at a time, through the segment cache, for any number of streams."""
+
+    def __init__(self, model):
+        from segment_cache import get_segment_cache
+        from voice_conditionals import get_conditionals_cache
+
+        self.model = model
+        self.sr = model.sr
+        self.conds_cache = get_conditionals_cache()
+        self.segment_cache = get_segment_cache()
+        # An in-process model serves one segment at a time; the TTS service queues its own jobs
+        self._lock = contextlib.nullcontext() if hasattr(model, 'synthesize_segments') else threading.Lock()
+
+    def render(self, item, quality):
+        """Float32 samples for one speech item (None if synthesis failed)."""
+        from segment_cache import segment_key
+        from tts_helpers import _iter_segments, segment_params
+
+        params = segment_params(quality, getattr(self.model, 'precision', 'fp32'),
+                                getattr(self.model, 'backend', 'torch'))
+        key = segment_key(item['text'], item['voice'], None, params)
+        wav = self.segment_cache.get(key) if self.segment_cache.contains(key) else None
+        if wav is None:
+            with self._lock:
+                _, wav = next(iter(_iter_segments(self.model, [item], self.conds_cache, quality=quality)))
+            if wav is None:
+                return None
+            self.segment_cache.put(key, wav, self.sr)
+        return wav.numpy().reshape(-1).astype(np.float32)
+
+    def stream(self, plan, start, quality, write):
+        """Render speech item `start` onwards (with pauses), passing float32 PCM bytes to `write`."""
+        speech_index = -1
+        started = False
+        for item in plan:
+            if item['type'] == 'speech':
+                speech_index += 1
+                started = started or speech_index >= start
+                if not started:
+                    continue
+                samples = self.render(item, quality)
+                if samples is None:
+                    logger.warning(f"⚠️ Preview skipped a failed segment (line {item['line'] + 1})")
+                    continue
+            elif started:
+                samples = np.zeros(int(item.get('seconds', 0.3) * self.sr), dtype=np.float32)
+            else:
+                continue
+            write(samples.astype('<f4').tobytes())
+
+
+class _OpusWriter:
+    """Pipes float32 PCM through ffmpeg and forwards the Ogg/Opus pages to `write` as they appear."""
+
+    def __init__(self, sample_rate, write):
+        self.process = subprocess.Popen(
+            ['ffmpeg', '-loglevel', 'error', '-f', 'f32le', '-ar', str(sample_rate), '-ac', '1', '-i', 'pipe:0',
+             '-c:a', 'libopus', '-b:a', OPUS_BITRATE, '-page_duration', '200000', '-f', 'ogg', 'pipe:1'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        )
+        self.error = None
+        self._reader = threading.Thread(target=self._forward, args=(write,), daemon=True)
+        self._reader.start()
+
+    def _forward(self, write):
+        try:
+            for chunk in iter(lambda: self.process.stdout.read1(4096), b''):
+                write(chunk)
+        except OSError as e:
+            self.error = e
+            self.process.kill()
+
+    def write(self, data):
+        if self.error:
+            raise self.error
+        self.process.stdin.write(data)
+        self.process.stdin.flush()
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        self._reader.join()
+        self.process.wait()
+        if self.error:
+            raise self.error
+
+
+class _Handler(BaseHTTPRequestHandler):
+    renderer = None
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        if url.path == "/chapters":
+            return self._send_json([{'index': c['index'], 'name': c['name'],
+                                     'ready': Path(c['file']).exists()} for c in load_chapters()])
+        if url.path != "/preview" or 'chapter' not in query:
+            return self._send_json({"error": "not found"}, 404)
+        try:
+            chapter = find_chapter(query['chapter'])
+            plan = chapter_plan(chapter)
+            position = float(query.get('position', 0))
+        except (KeyError, OSError, ValueError) as e:
+            return self._send_json({"error": str(e)}, 400)
+
+        stem = f"{chapter['index']:02d}_{chapter['name']}"
+        from audio_meta import segment_map_path
+        offsets = speech_offsets(plan, segment_map_path(OUTPUT_DIR / f"{stem}.wav"))
+        start = nearest_speech(offsets, position)
+        self._stream(plan, start, offsets[start] if offsets else 0.0, query)
+
+    def do_POST(self):
+        if urlsplit(self.path).path != "/preview":
+            return self._send_json({"error": "not found"}, 404)
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            plan = snippet_plan(request['text'], request.get('voice'))
+        except (ValueError, KeyError) as e:
+            return self._send_json({"error": f"bad request: {e}"}, 400)
+        self._stream(plan, 0, 0.0, request)
+
+    def _stream(self, plan, start, start_seconds, options):
+        quality = options.get('quality', 'draft')
+        audio_format = options.get('format', 'pcm')
+        if quality not in ('draft', 'final') or audio_format not in ('pcm', 'opus'):
+            return self._send_json({"error": "quality must be draft|final and format pcm|opus"}, 400)
+        if audio_format == 'opus' and not shutil.which('ffmpeg'):
+            return self._send_json({"error": "ffmpeg is required for opus streams"}, 400)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/ogg" if audio_format == 'opus' else "application/octet-stream")
+        self.send_header("X-Sample-Rate", str(self.renderer.sr))
+        self.send_header("X-Sample-Format", "float32")
+        self.send_header("X-Start-Segment", str(start))
+        self.send_header("X-Start-Seconds", f"{start_seconds:.2f}")
+        self.end_headers()
+
+        def send(data):
+            self.wfile.write(data)
+            self.wfile.flush()
+
+        # No Content-Length: the stream ends when the connection closes
+        sink = _OpusWriter(self.renderer.sr, send) if audio_format == 'opus' else None
+        try:
+            self.renderer.stream(plan, start, quality, sink.write if sink else send)
+            if sink:
+                sink.close()
+        except (BrokenPipeError, ConnectionResetError):
+            # Client seeked or stopped listening: stop rendering for it
+            if sink:
+                sink.process.kill()
+            logger.debug("Preview client disconnected")
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def serve(host="127.0.0.1", port=DEFAULT_PORT, device=None, precision="fp32", backend=None):
+    """Load (or connect to) the TTS model once and serve previews until interrupted."""
+    from tts_service import PRIORITY_INTERACTIVE, get_tts
+
+    # Previews are interactive: with the TTS service running they jump ahead of chapter rendering
+    model = get_tts(device, priority=PRIORITY_INTERACTIVE, precision=precision, backend=backend)
+    _Handler.renderer = PreviewRenderer(model)
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    logger.info(f"🎧 Preview server listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("🛑 Preview server stopped")
+    finally:
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream chapter narration previews segment by segment")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--device", default=None, choices=["cuda", "cpu"])
+    parser.add_argument("--precision", default="fp32", choices=["fp32", "bf16", "int8"],
+                        help="T3 inference precision when the model is loaded here")
+    parser.add_argument("--backend", default=None, choices=["torch", "onnx"],
+                        help="S3Gen backend when the model is loaded here (default: $TTS_BACKEND or torch)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    serve(args.host, args.port, args.device, args.precision, args.backend)
+
+
+if __name__ == "__main__":
+    main()
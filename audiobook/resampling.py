@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Streaming polyphase resampling to distribution sample rates.
+
+Chatterbox narrates at 24 kHz; ACX and most stores want 44.1 kHz. Chapters are
+resampled block by block with a windowed-sinc polyphase filter:
+
+- the filter bank for a (source, target) rate pair is designed once and cached
+- each output sample is one short dot product against its phase's taps, and
+  all outputs of the same phase are computed together from strided windows
+- only a few blocks of float audio are in memory at any time
+
+Stage 3 resamples the mastered chapters in parallel (one process per chapter)
+into output/resampled/ as 24-bit WAVs. A chapter is only resampled again when
+its source or the settings change.
+
+Usage:
+    python resampling.py output/mastered/*.wav --rate 44100 --format int24
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from wav_io import StreamingWavWriter, iter_wav_blocks, read_wav_info
+
+AUDIOBOOK_DIR = Path(__file__).parent
+RESAMPLED_DIR = AUDIOBOOK_DIR / "output" / "resampled"
+# ACX delivery rate
+DELIVERY_SAMPLE_RATE = 44100
+DELIVERY_FORMAT = 'int24'
+
+BLOCK_FRAMES = 1 << 16
+# Filter half-length in zero crossings of the low-pass, its passband edge as a
+# fraction of the lower Nyquist, and the Kaiser window shape (~-100 dB stopband)
+ZERO_CROSSINGS = 24
+ROLLOFF = 0.94
+KAISER_BETA = 10.0
+# Bump when the filter design changes, so cached chapters are rebuilt
+RESAMPLER_VERSION = 1
+
+
+@lru_cache(maxsize=None)
+def filter_bank(orig_sr, new_sr):
+    """Polyphase filter bank for orig_sr -> new_sr: (up, down, half, bank).
+
+    The ratio is up/down in lowest terms. Output n sits at input time
+    n * down / up; bank[phase] holds the 2 * half taps that weight the inputs
+    around it, for phase = n * down % up.
+    """
+    g = math.gcd(orig_sr, new_sr)
+    up, down = new_sr // g, orig_sr // g
+    # Low-pass cutoff in cycles per input sample (below the lower of the two Nyquists)
+    cutoff = 0.5 * ROLLOFF * min(1.0, up / down)
+    half = math.ceil(ZERO_CROSSINGS / (2 * cutoff))
+    # Offset of each phase's output from each tap's input sample, in input samples
+    taps = np.arange(-half + 1, half + 1)
+    tau = np.arange(up)[:, None] / up - taps[None, :]
+    bank = 2 * cutoff * np.sinc(2 * cutoff * tau) * np.i0(KAISER_BETA * np.sqrt(np.clip(1 - (tau / half) ** 2, 0, 1)))
+    bank /= np.i0(KAISER_BETA)
+    # Unity gain at DC for every phase
+    bank /= bank.sum(axis=1, keepdims=True)
+    # Tap rows run in input time order, like the sliding windows they are applied to
+    return up, down, half, np.ascontiguousarray(bank, dtype=np.float32)
+
+
+class PolyphaseResampler:
+    """Stateful block resampler: process() blocks in order, then flush() once."""
+
+    def __init__(self, orig_sr, new_sr, channels=1):
+        self.orig_sr, self.new_sr, self.channels = orig_sr, new_sr, channels
+        self.up, self.down, self.half, self.bank = filter_bank(orig_sr, new_sr)
+        # Input frames still needed (the signal is zero before its first sample)
+        self._buffer = np.zeros((self.half - 1, channels), dtype=np.float32)
+        self._buffer_start = -(self.half - 1)
+        self._inputs = 0
+        self._outputs = 0
+
+    def _emit(self, end):
+        """Compute outputs [self._outputs, end) from the buffered input."""
+        first = self._outputs
+        if end <= first:
+            return np.zeros((0, self.channels), dtype=np.float32)
+        windows = np.lib.stride_tricks.sliding_window_view(self._buffer, 2 * self.half, axis=0)
+        out = np.empty((end - first, self.channels), dtype=np.float32)
+        # Outputs `up` apart share a phase and read windows `down` inputs apart
+        for r in range(min(self.up, end - first)):
+            n = first + r
+            phase = n * self.down % self.up
+            start = n * self.down // self.up - self.half + 1 - self._buffer_start
+            count = len(range(r, end - first, self.up))
+            out[r::self.up] = windows[start:start + (count - 1) * self.down + 1:self.down] @ self.bank[phase]
+        self._outputs = end
+        # Drop input the next output no longer reaches
+        keep = self._outputs * self.down // self.up - self.half + 1 - self._buffer_start
+        self._buffer = self._buffer[keep:]
+        self._buffer_start += keep
+        return out
+
+    def process(self, block):
+        """Resample the next (frames, channels) block; returns every output it completes."""
+        block = np.asarray(block, dtype=np.float32).reshape(-1, self.channels)
+        self._buffer = np.concatenate([self._buffer, block])
+        self._inputs += len(block)
+        available = self._buffer_start + len(self._buffer)
+        # Output n needs inputs up to n * down // up + half
+        return self._emit(max(0, -(-(available - self.half) * self.up // self.down)))
+
+    def flush(self):
+        """Remaining outputs (the signal is zero after its last sample)."""
+        self._buffer = np.concatenate([self._buffer, np.zeros((self.half, self.channels), dtype=np.float32)])
+        return self._emit(-(-self._inputs * self.up // self.down))
+
+
+def resample_blocks(blocks, orig_sr, new_sr):
+    """Resample a stream of (frames, channels) blocks without loading the whole signal."""
+    resampler = None
+    for block in blocks:
+        if resampler is None:
+            resampler = PolyphaseResampler(orig_sr, new_sr, block.shape[1])
+        out = resampler.process(block)
+        if len(out):
+            yield out
+    if resampler is not None:
+        tail = resampler.flush()
+        if len(tail):
+            yield tail
+
+
+def resample_file(src_path, dst_path, new_sr=DELIVERY_SAMPLE_RATE, sample_format=DELIVERY_FORMAT):
+    """Stream one WAV into `dst_path` at `new_sr` (int16 / int24 / float32)."""
+    info = read_wav_info(src_path)
+    dst_path = Path(dst_path)
+    tmp_path = dst_path.with_name(dst_path.stem + '.tmp.wav')
+    blocks = iter_wav_blocks(src_path, BLOCK_FRAMES, info)
+    if info['sample_rate'] != new_sr:
+        blocks = resample_blocks(blocks, info['sample_rate'], new_sr)
+    with StreamingWavWriter(tmp_path, new_sr, info['channels'], sample_format) as writer:
+        for block in blocks:
+            writer.write(block.T)
+    tmp_path.replace(dst_path)
+    return writer
+
+
+def _settings(new_sr, sample_format):
+    return {'version': RESAMPLER_VERSION, 'sample_rate': new_sr, 'format': sample_format}
+
+
+def _resample_info_path(output_path):
+    return output_path.with_name(output_path.stem + '.resample.json')
+
+
+def _warm_analysis(path):
+    """Analyse a delivered chapter now (cached by content hash for Stage 5)."""
+    from audio_analysis import analyze_file
+    try:
+        analyze_file(path)
+    except Exception as e:
+        print(f"⚠️ Could not analyse {Path(path).name}: {e}", flush=True)
+
+
+def resample_chapter(wav_path, new_sr=DELIVERY_SAMPLE_RATE, resampled_dir=RESAMPLED_DIR,
+                     sample_format=DELIVERY_FORMAT):
+    """Deliver one chapter at `new_sr` (runs in a worker process).
+
+    Chapters already at the rate are used as they are. The delivered file is
+    analysed right away, so Stage 5's per-chapter report is ready as soon as
+    the chapters land. Returns {'path', 'resampled', 'cached'}.
+    """
+    from mastering import content_hash
+
+    wav_path = Path(wav_path)
+    if read_wav_info(wav_path)['sample_rate'] == new_sr:
+        _warm_analysis(wav_path)
+        return {'path': str(wav_path), 'resampled': False, 'cached': False}
+
+    output_path = Path(resampled_dir) / wav_path.name
+    info_path = _resample_info_path(output_path)
+    digest = content_hash(wav_path)
+    record = {'source_sha256': digest, 'settings': _settings(new_sr, sample_format)}
+    try:
+        with open(info_path, 'r') as f:
+            if output_path.exists() and json.load(f) == record:
+                return {'path': str(output_path), 'resampled': True, 'cached': True}
+    except (OSError, ValueError):
+        pass
+
+    resample_file(wav_path, output_path, new_sr, sample_format)
+    with open(info_path, 'w') as f:
+        json.dump(record, f, indent=2)
+    _warm_analysis(output_path)
+    return {'path': str(output_path), 'resampled': True, 'cached': False}
+
+
+def resample_chapters(wav_files, new_sr=DELIVERY_SAMPLE_RATE, resampled_dir=RESAMPLED_DIR,
+                      sample_format=DELIVERY_FORMAT, workers=None):
+    """Resample every chapter in parallel; returns {source path: delivered path (or the source on failure)}."""
+    wav_files = [Path(f) for f in wav_files]
+    if not wav_files:
+        return {}
+    Path(resampled_dir).mkdir(parents=True, exist_ok=True)
+    workers = workers or min(len(wav_files), os.cpu_count() or 1)
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {f: pool.submit(resample_chapter, str(f), new_sr, str(resampled_dir), sample_format)
+                   for f in wav_files}
+        for wav_file, future in futures.items():
+            try:
+                report = future.result()
+            except Exception as e:
+                print(f"❌ Resampling failed for {wav_file.name}: {e}", flush=True)
+                results[wav_file] = wav_file
+                continue
+            if report['cached']:
+                print(f"   ♻️  {wav_file.name}: {new_sr} Hz copy is current")
+            elif report['resampled']:
+                print(f"   🎚️  {wav_file.name}: resampled to {new_sr} Hz ({sample_format})")
+            results[wav_file] = Path(report['path'])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resample chapter WAVs to a distribution sample rate")
+    parser.add_argument("files", nargs="+", help="WAV files to resample")
+    parser.add_argument("--rate", type=int, default=DELIVERY_SAMPLE_RATE)
+    parser.add_argument("--format", default=DELIVERY_FORMAT, choices=["int16", "int24", "float32"])
+    parser.add_argument("--output-dir", type=str, default=str(RESAMPLED_DIR))
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    results = resample_chapters(args.files, args.rate, Path(args.output_dir), args.format, args.workers)
+    print(f"✅ {len(results)} file(s) at {args.rate} Hz in {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
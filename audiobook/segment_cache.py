@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Content-addressed audio segment cache for TTS.
+
+Every synthesized speech segment is stored as FLAC under cache/segments/, keyed by
+a hash of (normalized text, voice reference hash, model id and version, seed,
+generation params). Chapters are assembled from cache hits and only the misses
+are synthesized, so editing one sentence costs one segment of TTS. The store is
+size-capped and evicts least-recently-used segments.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_CACHE_DIR = Path(__file__).parent / "cache" / "segments"
+DEFAULT_MAX_BYTES = 4 * 1024 ** 3  # 4 GB
+
+
+def normalize_segment_text(text):
+    """Whitespace-insensitive form of a segment's text."""
+    return " ".join(text.split())
+
+
+def segment_key(text, voice, seed=None, params=None, model_id=None):
+    """Content address of one synthesized segment."""
+    from voice_conditionals import file_sha256, model_version
+
+    payload = {
+        'text': normalize_segment_text(text),
+        'voice': file_sha256(voice) if voice else "builtin",
+        'model': model_id or model_version(),
+        'seed': seed,
+        'params': params or {},
+    }
+    blob = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+
+class SegmentCache:
+    """Size-capped, LRU-evicting FLAC store of synthesized segments."""
+
+    def __init__(self, cache_dir=SEGMENT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._total_bytes = None
+        # Segments a render in progress will still read; never evicted
+        self._pinned = set()
+
+    def _path(self, key):
+        return self.cache_dir / key[:2] / f"{key}.flac"
+
+    def contains(self, key):
+        return self._path(key).exists()
+
+    def pin(self, keys):
+        """Protect `keys` from eviction until unpin() (a chapter's cache hits while it renders)."""
+        self._pinned.update(self._path(key) for key in keys)
+
+    def unpin(self, keys):
+        self._pinned.difference_update(self._path(key) for key in keys)
+
+    def get(self, key):
+        """Return the cached (1, samples) float32 tensor for `key`, or None."""
+        import torchaudio as ta
+
+        path = self._path(key)
+        if not path.exists():
+            self.misses += 1
+            return None
+        try:
+            wav, _ = ta.load(str(path))
+        except Exception as e:
+            logger.warning(f"⚠️ Dropping unreadable cached segment {path.name}: {e}")
+            self._remove(path)
+            self.misses += 1
+            return None
+        # Touch so eviction treats it as recently used
+        os.utime(path)
+        self.hits += 1
+        return wav
+
+    def put(self, key, wav, sample_rate):
+        """Store a (1, samples) waveform as 24-bit FLAC and enforce the size cap."""
+        import torchaudio as ta
+
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.stem + ".tmp.flac")
+        # Counted before the write: a first put() must not find the new file in its scan,
+        # and a retake replaces the old take's bytes rather than adding to them
+        total = self.total_bytes()
+        old_size = path.stat().st_size if path.exists() else 0
+        try:
+            ta.save(str(tmp_path), wav.clamp(-1.0, 1.0), sample_rate, format="flac", bits_per_sample=24)
+            tmp_path.replace(path)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not cache segment: {e}")
+            if tmp_path.exists():
+                tmp_path.unlink()
+            return
+
+        self._total_bytes = total - old_size + path.stat().st_size
+        if self._total_bytes > self.max_bytes:
+            self.evict()
+
+    def total_bytes(self):
+        if self._total_bytes is None:
+            self._total_bytes = sum(p.stat().st_size for p in self._segment_files())
+        return self._total_bytes
+
+    def _segment_files(self):
+        # Skips another put()'s in-flight temp file
+        return [p for p in self.cache_dir.glob("*/*.flac") if not p.name.endswith(".tmp.flac")]
+
+    def evict(self, target_ratio=0.9):
+        """Delete least-recently-used segments until the store is below the cap."""
+        files = sorted(self._segment_files(), key=lambda p: p.stat().st_mtime)
+        total = sum(p.stat().st_size for p in files)
+        target = self.max_bytes * target_ratio
+        evicted = 0
+        for path in files:
+            if total <= target:
+                break
+            if path in self._pinned:
+                continue
+            total -= path.stat().st_size
+            self._remove(path)
+            evicted += 1
+        self._total_bytes = total
+        if evicted:
+            logger.info(f"🧹 Evicted {evicted} cached segments ({total / 1024 ** 2:.0f} MB kept)")
+
+    def _remove(self, path):
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+
+_default_cache = None
+
+
+def get_segment_cache():
+    """Process-wide segment cache."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = SegmentCache()
+    return _default_cache
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Fast NumPy QA scan for synthesized speech segments.
+
+Chatterbox occasionally returns a segment that is near-silent, has a long dead
+gap in the middle, clips, or loops the same babble. Each freshly synthesized
+segment is scanned here before it is written to the chapter:
+
+    silent       the whole segment is (almost) silence
+    gap          an internal silence longer than MAX_GAP_SECONDS
+    pace         seconds per character far outside normal narration pace
+    clipping     runs of consecutive samples at full scale
+    repetition   a strongly periodic loudness envelope (looping output),
+                 found through frame-level autocorrelation
+
+Only flagged segments are re-synthesized, with a new seed, up to QA_RETRIES
+times (see SegmentReview); the take with the fewest issues is kept. Every flag
+and retry goes into a `<chapter>.qa.json` report next to the WAV.
+"""
+
+import json
+from pathlib import Path
+
+import numpy as np
+
+FRAME_SECONDS = 0.02
+SILENCE_DB = -45.0
+SILENT_PEAK = 0.01
+MAX_GAP_SECONDS = 1.5
+# Normal narration is ~0.06-0.08 s per character; allow a wide band
+MIN_SECONDS_PER_CHAR = 0.025
+MAX_SECONDS_PER_CHAR = 0.2
+PACE_MIN_CHARS = 20
+CLIP_LEVEL = 0.99
+CLIP_RUN_SAMPLES = 8
+CLIP_MAX_RUNS = 3
+REPEAT_MIN_LAG_SECONDS = 0.8
+REPEAT_MIN_CYCLES = 3
+REPEAT_CORRELATION = 0.85
+QA_RETRIES = 2
+
+
+def frame_db(samples, sr, frame_seconds=FRAME_SECONDS):
+    """Per-frame RMS level in dBFS."""
+    frame = max(1, int(sr * frame_seconds))
+    n = len(samples) // frame
+    if n == 0:
+        return np.full(1, -120.0)
+    frames = samples[:n * frame].reshape(n, frame).astype(np.float64)
+    rms = np.sqrt(np.mean(frames ** 2, axis=1))
+    return 20 * np.log10(np.maximum(rms, 1e-6))
+
+
+def _longest_run(mask):
+    """Length of the longest run of True values in a boolean array."""
+    if not mask.any():
+        return 0
+    padded = np.concatenate(([False], mask, [False])).astype(np.int8)
+    edges = np.flatnonzero(np.diff(padded))
+    return int((edges[1::2] - edges[::2]).max())
+
+
+def _clip_runs(samples):
+    """Number of runs of at least CLIP_RUN_SAMPLES consecutive full-scale samples."""
+    hot = np.abs(samples) >= CLIP_LEVEL
+    if not hot.any():
+        return 0
+    padded = np.concatenate(([False], hot, [False])).astype(np.int8)
+    edges = np.flatnonzero(np.diff(padded))
+    return int(np.count_nonzero(edges[1::2] - edges[::2] >= CLIP_RUN_SAMPLES))
+
+
+def _repetition(db, frame_seconds=FRAME_SECONDS):
+    """(best correlation, lag seconds) of the loudness envelope's autocorrelation."""
+    min_lag = int(REPEAT_MIN_LAG_SECONDS / frame_seconds)
+    if len(db) < min_lag * REPEAT_MIN_CYCLES:
+        return 0.0, 0.0
+    env = np.maximum(db, SILENCE_DB) - SILENCE_DB
+    env = env - env.mean()
+    energy = float(np.dot(env, env))
+    if energy <= 0:
+        return 0.0, 0.0
+    size = 1 << int(np.ceil(np.log2(2 * len(env))))
+    spectrum = np.fft.rfft(env, size)
+    acf = np.fft.irfft(spectrum * np.conj(spectrum), size)[:len(env)]
+    # Unbiased normalization so long lags are not penalized for their shorter overlap
+    acf = acf / energy * len(env) / (len(env) - np.arange(len(env)))
+    max_lag = len(env) // REPEAT_MIN_CYCLES
+    if max_lag <= min_lag:
+        return 0.0, 0.0
+    lag = min_lag + int(np.argmax(acf[min_lag:max_lag]))
+    return float(acf[lag]), lag * frame_seconds
+
+
+def check_segment(samples, sr, text=""):
+    """Scan one segment; returns a list of {'check', 'detail'} issues (empty if it looks fine)."""
+    if hasattr(samples, 'detach'):
+        samples = samples.detach().cpu().numpy()
+    samples = np.asarray(samples, dtype=np.float32).reshape(-1)
+    duration = len(samples) / sr
+    issues = []
+
+    peak = float(np.abs(samples).max()) if samples.size else 0.0
+    if peak < SILENT_PEAK:
+        return [{'check': 'silent', 'detail': f"peak {peak:.4f}"}]
+
+    db = frame_db(samples, sr)
+    silent = db < SILENCE_DB
+    voiced = np.flatnonzero(~silent)
+    if len(voiced):
+        # Leading/trailing silence is trimmed by the pause logic; only internal gaps count
+        gap = _longest_run(silent[voiced[0]:voiced[-1] + 1]) * FRAME_SECONDS
+        if gap > MAX_GAP_SECONDS:
+            issues.append({'check': 'gap', 'detail': f"{gap:.1f}s internal silence"})
+
+    chars = len(text.strip())
+    if chars >= PACE_MIN_CHARS:
+        pace = duration / chars
+        if not MIN_SECONDS_PER_CHAR <= pace <= MAX_SECONDS_PER_CHAR:
+            issues.append({'check': 'pace', 'detail': f"{pace:.3f}s per character ({duration:.1f}s for {chars})"})
+
+    runs = _clip_runs(samples)
+    if runs > CLIP_MAX_RUNS:
+        issues.append({'check': 'clipping', 'detail': f"{runs} clipped runs"})
+
+    correlation, lag = _repetition(db)
+    if correlation > REPEAT_CORRELATION:
+        issues.append({'check': 'repetition', 'detail': f"envelope repeats every {lag:.1f}s (r={correlation:.2f})"})
+    return issues
+
+
+def qa_report_path(output_path):
+    output_path = Path(output_path)
+    return output_path.with_name(output_path.stem + '.qa.json')
+
+
+def retry_seed(seed, index, attempt):
+    """Deterministic seed for the `attempt`-th re-take of segment `index`."""
+    return ((seed or 0) + 7919 * attempt + 104729 * index) % (2 ** 31)
+
+
+class SegmentReview:
+    """QA bookkeeping for one chapter: which segments to retake, and the report.
+
+    Call `review(index, wav)` with each freshly synthesized take. It returns
+    (wav, None) once the segment is settled (the passing take, or the best one
+    after QA_RETRIES retakes) or (None, seed) when the caller should synthesize
+    the segment again with `seed` and review that take.
+    """
+
+    def __init__(self, speech_items, sample_rate, seed=None, retries=QA_RETRIES):
+        self.speech_items = speech_items
+        self.sample_rate = sample_rate
+        self.seed = seed
+        self.retries = retries
+        self.entries = {}
+        self._best = {}
+
+    def review(self, index, wav):
+        item = self.speech_items[index]
+        entry = self.entries.get(index)
+        if wav is None:
+            # A failed retake counts as an attempt; a failed first take is reported by the caller
+            if entry is None:
+                return None, None
+            issues = [{'check': 'error', 'detail': 'synthesis failed'}]
+        else:
+            issues = check_segment(wav, self.sample_rate, item['text'])
+            if entry is None and not issues:
+                return wav, None
+
+        if entry is None:
+            entry = self.entries[index] = {
+                'index': index, 'line': item['line'] + 1, 'chunk': item['chunk'] + 1,
+                'text': item['text'], 'attempts': [], 'resolved': False,
+            }
+            print(f"   🔎 QA flagged line {entry['line']}, chunk {entry['chunk']}: "
+                  + ", ".join(issue['check'] for issue in issues))
+        entry['attempts'].append({'seed': entry.get('next_seed', self.seed), 'issues': issues})
+        entry.pop('next_seed', None)
+
+        best = self._best.get(index)
+        if wav is not None and (best is None or len(issues) < best[0]):
+            self._best[index] = (len(issues), wav)
+        if not issues:
+            entry['resolved'] = True
+        elif len(entry['attempts']) <= self.retries:
+            entry['next_seed'] = retry_seed(self.seed, index, len(entry['attempts']))
+            return None, entry['next_seed']
+        return self._best.pop(index)[1], None
+
+    def write_report(self, output_path):
+        """Write `<chapter>.qa.json` (or remove a stale one when nothing was flagged)."""
+        path = qa_report_path(output_path)
+        if not self.entries:
+            if path.exists():
+                path.unlink()
+            return None
+        entries = [self.entries[index] for index in sorted(self.entries)]
+        unresolved = sum(1 for e in entries if not e['resolved'])
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'segments': len(self.speech_items),
+                'flagged': len(entries),
+                'unresolved': unresolved,
+                'entries': entries,
+            }, f, indent=2, ensure_ascii=False)
+        print(f"   🔎 QA: {len(entries)} segments flagged, {len(entries) - unresolved} fixed by a retake, "
+              f"{unresolved} kept as best take ({path.name})")
+        return path
@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+"""
+Surgical re-render: splice changed paragraphs into an existing chapter WAV.
+
+Every chapter rendered by generate_long_audio has a `<chapter>.segments.json`
+sidecar with the sample range and content hash of each paragraph. After an
+editorial fix this script diffs the new narration against that map, synthesizes
+only the paragraphs whose text changed, copies every other sample range straight
+from the old WAV, and shifts the chapter's captions and the book's chapter
+positions (chapters.json and timestamps.txt) by the resulting duration delta.
+"""
+
+import argparse
+import difflib
+import json
+import re
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent))
+from tts_helpers import (
+    _iter_segments, _retake, plan_narration, plan_paragraphs, segment_map_path, segment_params,
+)
+from wav_io import StreamingWavWriter, float_to_int16, memmap_wav, read_wav_info
+
+AUDIOBOOK_DIR = Path(__file__).parent
+OUTPUT_DIR = AUDIOBOOK_DIR / "output"
+TRANSCRIPTS_DIR = AUDIOBOOK_DIR / "transcripts"
+TIMESTAMPS_FILE = OUTPUT_DIR / "timestamps.txt"
+CHAPTERS_FILE = OUTPUT_DIR / "chapters.json"
+
+COPY_BLOCK_FRAMES = 1 << 16
+
+
+def load_segment_map(output_path):
+    path = segment_map_path(output_path)
+    if not path.exists():
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def _render_paragraph(writer, para, wavs, gain, silence_per_newline, segment_spans):
+    """Write one new paragraph at the chapter's existing normalization gain; returns its peak."""
+    peak = 0.0
+    for item in para['items']:
+        if item['type'] == 'pause':
+            writer.write_silence(item.get('seconds', silence_per_newline))
+            continue
+        start = writer.frames
+        wav = wavs.get(id(item))
+        if wav is not None:
+            samples = wav.detach().cpu().numpy()[0] * gain
+            peak = max(peak, float(np.abs(samples).max()) if samples.size else 0.0)
+            writer.write(float_to_int16(samples))
+        segment_spans.append({'id': item.get('id'), 'start': start, 'end': writer.frames})
+    return peak
+
+
+def _map_time(seconds, time_map):
+    """Map a time in the old chapter to the new one using the splice's (old, new) ranges."""
+    for old_start, old_end, new_start, new_end, equal in time_map:
+        if seconds < old_end or old_end == time_map[-1][1]:
+            if equal or old_end == old_start:
+                return new_start + (seconds - old_start)
+            # Inside a re-rendered region: stretch proportionally
+            ratio = (seconds - old_start) / (old_end - old_start)
+            return new_start + min(max(ratio, 0.0), 1.0) * (new_end - new_start)
+    return seconds
+
+
+def _parse_srt_time(value):
+    h, m, rest = value.strip().split(':')
+    s, ms = rest.split(',')
+    return int(h) * 3600 + int(m) * 60 + int(s) + int(ms) / 1000.0
+
+
+def _format_srt_time(seconds):
+    total_ms = max(0, int(round(seconds * 1000)))
+    h, rem = divmod(total_ms, 3600000)
+    m, rem = divmod(rem, 60000)
+    s, ms = divmod(rem, 1000)
+    return f"{h:02d}:{m:02d}:{s:02d},{ms:03d}"
+
+
+def shift_captions(srt_path, time_map):
+    """Re-time a chapter SRT after a splice."""
+    if not srt_path.exists():
+        return False
+    blocks = srt_path.read_text().strip().split('\n\n')
+    out = []
+    for block in blocks:
+        lines = block.split('\n')
+        if len(lines) >= 2 and ' --> ' in lines[1]:
+            start_str, end_str = lines[1].split(' --> ')
+            start = _map_time(_parse_srt_time(start_str), time_map)
+            end = _map_time(_parse_srt_time(end_str), time_map)
+            lines[1] = f"{_format_srt_time(start)} --> {_format_srt_time(end)}"
+        out.append('\n'.join(lines))
+    srt_path.write_text('\n\n'.join(out))
+    return True
+
+
+def shift_timestamps(output_path, delta_seconds, timestamps_file=TIMESTAMPS_FILE, chapters_file=CHAPTERS_FILE):
+    """Shift every book chapter after `output_path`'s chapter by `delta_seconds`.
+
+    Stage 3's chapters.json frame offsets are shifted exactly and timestamps.txt
+    is rewritten from them. Without chapters.json (or when it does not list the
+    chapter) the timestamps.txt lines are shifted in place.
+    """
+    if not delta_seconds:
+        return False
+    concat_mod = __import__('3_concatenate_audio')
+
+    if chapters_file.exists():
+        with open(chapters_file, 'r') as f:
+            book = json.load(f)
+        names = [c['file'] for c in book['chapters']]
+        if output_path.name in names:
+            chapter_pos = names.index(output_path.name)
+            sample_rate = book['sample_rate']
+            delta = round(delta_seconds * sample_rate)
+            book['chapters'][chapter_pos]['end'] += delta
+            for chapter in book['chapters'][chapter_pos + 1:]:
+                for field in ('marker', 'start', 'end'):
+                    chapter[field] += delta
+            book['frames'] += delta
+            with open(chapters_file, 'w') as f:
+                json.dump(book, f, indent=2)
+            timestamps_file.write_text('\n'.join(
+                f"{concat_mod.format_timestamp(c['marker'] / sample_rate)} {c['title']}" for c in book['chapters']
+            ))
+            return True
+        # Stale: Stage 3 rewrites it on the next join
+        chapters_file.unlink()
+
+    if not timestamps_file.exists():
+        return False
+    # Same chapters, in the same order, as concatenate_audiobook
+    wav_names = [f.name for f in concat_mod.book_chapter_files()]
+    if output_path.name not in wav_names:
+        return False
+    chapter_pos = wav_names.index(output_path.name)
+
+    lines = timestamps_file.read_text().split('\n')
+    for k in range(chapter_pos + 1, len(lines)):
+        match = re.match(r'^(\d+(?::\d+){1,2}) (.*)$', lines[k])
+        if not match:
+            continue
+        seconds = 0.0
+        for p in match.group(1).split(':'):
+            seconds = seconds * 60 + int(p)
+        lines[k] = f"{concat_mod.format_timestamp(max(0.0, seconds + delta_seconds))} {match.group(2)}"
+    timestamps_file.write_text('\n'.join(lines))
+    return True
+
+
+def _merge_qa_report(output_path, review, kept_items, speech_index):
+    """Rewrite the chapter's QA report: earlier entries for segments the splice kept, plus the new ones."""
+    from segment_qa import qa_report_path
+
+    path = qa_report_path(output_path)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            old_entries = json.load(f)['entries']
+    except (OSError, ValueError, KeyError):
+        old_entries = []
+    by_text = {}
+    for entry in old_entries:
+        by_text.setdefault(entry['text'], []).append(entry)
+    for item in kept_items:
+        idx = speech_index[id(item)]
+        if by_text.get(item['text']) and idx not in review.entries:
+            # Same take copied from the old WAV: carry its entry over at the segment's new position
+            entry = by_text[item['text']].pop(0)
+            review.entries[idx] = {**entry, 'index': idx, 'line': item['line'] + 1, 'chunk': item['chunk'] + 1}
+    review.write_report(output_path)
+
+
+def splice_chapter(text, model, output_path, chunk_size=250, silence_per_newline=0.3, voice_map=None,
+                   default_voice=None, audio_prompt_path=None, conds_cache=None, seed=None,
+                   segment_cache=None, transcript_path=None, quality='final', script=None, qa=True):
+    """Re-render only the changed paragraphs of an existing chapter WAV.
+
+    `script` is the chapter's compiled narration script; without it `text` is parsed.
+    With `qa`, re-rendered segments go through the same QA scan and retakes as a
+    full render, and the chapter's QA report is updated.
+    Returns the duration delta in seconds. Raises ValueError when the chapter
+    has no usable segment map (a full render is needed instead).
+    """
+    from voice_conditionals import get_conditionals_cache
+    from segment_cache import get_segment_cache, segment_key
+
+    output_path = Path(output_path)
+    segment_map = load_segment_map(output_path)
+    if not segment_map or not output_path.exists():
+        raise ValueError(f"No segment map for {output_path.name}; render the full chapter first")
+    if segment_map['silence_per_newline'] != silence_per_newline or segment_map['sample_rate'] != model.sr:
+        raise ValueError(f"{output_path.name} was rendered with different settings; full render needed")
+    if segment_map.get('quality', 'final') != quality:
+        raise ValueError(f"{output_path.name} is {segment_map.get('quality', 'final')} quality; full render needed")
+
+    info = read_wav_info(output_path)
+    if info['frames'] != segment_map['frames']:
+        raise ValueError(f"{output_path.name} does not match its segment map; full render needed")
+
+    conds_cache = conds_cache or get_conditionals_cache()
+    if segment_cache is None:
+        segment_cache = get_segment_cache()
+
+    old_pars = segment_map['paragraphs']
+    if script is not None:
+        from narration_script import script_to_plan
+        new_plan = script_to_plan(script)
+    else:
+        new_plan = plan_narration(text, chunk_size, voice_map, default_voice, audio_prompt_path)
+    new_pars = plan_paragraphs(new_plan)
+    matcher = difflib.SequenceMatcher(a=[p['hash'] for p in old_pars], b=[p['hash'] for p in new_pars],
+                                      autojunk=False)
+    opcodes = matcher.get_opcodes()
+    changed = [j for tag, _, _, j1, j2 in opcodes if tag != 'equal' for j in range(j1, j2)]
+    removed = sum(i2 - i1 for tag, i1, i2, _, _ in opcodes if tag in ('replace', 'delete'))
+    if not changed and not removed:
+        print(f"   ✓ {output_path.name} is already up to date")
+        return 0.0
+
+    # Synthesize only the changed paragraphs (segment cache first)
+    items = [item for j in changed for item in new_pars[j]['items'] if item['type'] == 'speech']
+    print(f"   ✂️  Splicing {output_path.name}: {len(changed)} paragraphs re-rendered "
+          f"({len(items)} segments), {removed} replaced or removed")
+    wavs = {}
+    keys = {}
+    if segment_cache:
+        params = segment_params(quality, getattr(model, 'precision', 'fp32'), getattr(model, 'backend', 'torch'))
+        keys = {id(item): segment_key(item['text'], item['voice'], seed, params) for item in items}
+    misses = []
+    for item in items:
+        wav = segment_cache.get(keys[id(item)]) if segment_cache else None
+        if wav is None:
+            misses.append(item)
+        wavs[id(item)] = wav
+    review = None
+    if qa:
+        from segment_qa import SegmentReview
+        # Indexed like a full render, so retake seeds and report entries match it
+        speech_items = [item for item in new_plan if item['type'] == 'speech']
+        speech_index = {id(item): idx for idx, item in enumerate(speech_items)}
+        review = SegmentReview(speech_items, model.sr, seed)
+    # Collected first: retakes cannot run while a remote stream is still using the model
+    for k, wav in list(_iter_segments(model, misses, conds_cache, seed=seed, quality=quality)):
+        item = misses[k]
+        if review:
+            idx = speech_index[id(item)]
+            wav, retake = review.review(idx, wav)
+            if retake is not None:
+                wav = _retake(model, item, idx, retake, review, conds_cache, quality)
+        wavs[id(item)] = wav
+        if wav is not None and segment_cache:
+            segment_cache.put(keys[id(item)], wav, model.sr)
+
+    # Rebuild the chapter: old sample ranges for unchanged paragraphs, new audio for the rest
+    gain = segment_map['gain']
+    old_audio = memmap_wav(output_path, info)[:, 0]
+    tmp_path = output_path.with_name(output_path.name + '.splice')
+    new_map = []
+    old_segments = segment_map.get('segments')
+    new_segments = []
+    time_map = []
+    peak = 0.0
+    sr = info['sample_rate']
+    with StreamingWavWriter(tmp_path, sr, 1, 'int16') as writer:
+        for tag, i1, i2, j1, j2 in opcodes:
+            new_start = writer.frames
+            old_start = old_pars[i1]['start'] if i1 < len(old_pars) else info['frames']
+            old_end = old_pars[i2 - 1]['end'] if i2 > i1 else old_start
+            for k in range(j2 - j1):
+                para = new_pars[j1 + k]
+                para_start = writer.frames
+                if tag == 'equal':
+                    old = old_pars[i1 + k]
+                    for pos in range(old['start'], old['end'], COPY_BLOCK_FRAMES):
+                        writer.write(np.array(old_audio[pos:min(pos + COPY_BLOCK_FRAMES, old['end'])]))
+                    shift = para_start - old['start']
+                    new_segments.extend(
+                        {**seg, 'start': seg['start'] + shift, 'end': seg['end'] + shift}
+                        for seg in old_segments or () if old['start'] <= seg['start'] < old['end']
+                    )
+                else:
+                    peak = max(peak, _render_paragraph(writer, para, wavs, gain, silence_per_newline, new_segments))
+                new_map.append({'line': para['line'], 'hash': para['hash'], 'start': para_start, 'end': writer.frames})
+            time_map.append((old_start / sr, old_end / sr, new_start / sr, writer.frames / sr, tag == 'equal'))
+        new_frames = writer.frames
+    del old_audio
+
+    if peak > 1.0:
+        print(f"   ⚠️  Spliced audio clips at the chapter's gain (peak {peak:.2f}); consider a full re-render")
+
+    tmp_path.replace(output_path)
+    segment_map.update(frames=new_frames, paragraphs=new_map)
+    if old_segments is not None:
+        segment_map['segments'] = new_segments
+    with open(segment_map_path(output_path), 'w') as f:
+        json.dump(segment_map, f)
+    if review:
+        kept = [item for tag, _, _, j1, j2 in opcodes if tag == 'equal'
+                for j in range(j1, j2) for item in new_pars[j]['items'] if item['type'] == 'speech']
+        _merge_qa_report(output_path, review, kept, speech_index)
+
+    delta = (new_frames - info['frames']) / sr
+    if transcript_path is None:
+        transcript_dir = TRANSCRIPTS_DIR / "draft" if quality == 'draft' else TRANSCRIPTS_DIR
+        transcript_path = transcript_dir / f"{output_path.stem}.srt"
+    if shift_captions(Path(transcript_path), time_map):
+        print(f"   📝 Captions re-timed: {Path(transcript_path).name}")
+    if shift_timestamps(output_path, delta):
+        print(f"   📍 Book timestamps shifted by {delta:+.2f}s")
+    print(f"   ✅ Spliced {output_path.name} ({delta:+.2f}s)")
+    return delta
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Splice changed paragraphs into an existing chapter WAV")
+    parser.add_argument("chapter", help="Chapter stem, e.g. 03_gintaro_sapnas")
+    parser.add_argument("--reference-audio", type=str, default=None,
+                        help="Default voice when the chapter has no compiled script")
+    parser.add_argument("--no-qa", action="store_true", help="Skip the QA scan of re-rendered segments")
+    args = parser.parse_args()
+
+    from narration_script import compile_chapter, load_script, script_path
+    from tts_service import get_tts
+
+    text_path = AUDIOBOOK_DIR / "preprocessed" / f"{args.chapter}.txt"
+    output_path = OUTPUT_DIR / f"{args.chapter}.wav"
+    if not text_path.exists():
+        print(f"❌ Error: {text_path} not found")
+        return
+
+    # Parse with the voices Stage 2 used (recorded in the chapter's compiled script),
+    # so unchanged paragraphs keep their hashes and character voices
+    try:
+        settings = load_script(script_path(text_path))[0]['settings']
+        voice_map = {name: Path(path) for name, path in settings['voice_map'].items()}
+        default_voice = settings['default_voice'] and Path(settings['default_voice'])
+        audio_prompt_path = settings['audio_prompt_path'] and Path(settings['audio_prompt_path'])
+        chunk_size, silence_per_newline = settings['chunk_size'], settings['silence_per_newline']
+    except (OSError, ValueError, KeyError):
+        from preview_server import discover_voices
+        print("⚠️  No compiled script for this chapter; using the voices in voices/")
+        voice_map = discover_voices()
+        default_voice = voice_map.get("Narrator")
+        audio_prompt_path = args.reference_audio
+        chunk_size, silence_per_newline = 250, 0.3
+    text = text_path.read_text(encoding='utf-8')
+    script = compile_chapter(text_path, text, chunk_size, silence_per_newline, voice_map, default_voice,
+                             audio_prompt_path)
+
+    model = get_tts()
+    splice_chapter(text, model, output_path, chunk_size, silence_per_newline, voice_map, default_voice,
+                   audio_prompt_path, script=script, qa=not args.no_qa)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,88 +4,38 @@ Helper functions for TTS chunking
 """
 
 import logging
+from pathlib import Path
 import torch
 import torchaudio as ta
 
+# Re-exported: these live in the torch-free audio_meta so Stage 3 can use them
+from audio_meta import audio_quality, segment_map_path
+
 logger = logging.getLogger(__name__)
 
 # Force float32 for CPU stability
 torch.set_default_dtype(torch.float32)
 
 def chunk_text(text, max_chars=250):
-    """Split text into chunks at natural boundaries (paragraphs/sentences)."""
-    chunks = []
-    paragraphs = text.split('\n\n')
-    
-    current_chunk = []
-    current_size = 0
-    
-    for para in paragraphs:
-        para_size = len(para)
-        
-        # If single paragraph is too long, split by sentences
-        if para_size > max_chars:
-            sentences = para.split('. ')
-            for sentence in sentences:
-                sentence = sentence.strip()
-                if not sentence:
-                    continue
-                    
-                # Add period back if it was removed
-                if not sentence.endswith('.') and not sentence.endswith('[pause]'):
-                    sentence += '.'
-                
-                sent_size = len(sentence)
-                
-                if current_size + sent_size > max_chars and current_chunk:
-                    chunks.append('\n\n'.join(current_chunk))
-                    current_chunk = [sentence]
-                    current_size = sent_size
-                else:
-                    current_chunk.append(sentence)
-                    current_size += sent_size
-        else:
-            if current_size + para_size > max_chars and current_chunk:
-                chunks.append('\n\n'.join(current_chunk))
-                current_chunk = [para]
-                current_size = para_size
-            else:
-                current_chunk.append(para)
-                current_size += para_size
-    
-    if current_chunk:
-        chunks.append('\n\n'.join(current_chunk))
+    """Split text into length-balanced chunks at sentence boundaries (see chunk_planner)."""
+    from chunk_planner import plan_chunks
     
+    chunks = []
+    for para in text.split('\n\n'):
+        chunks.extend(plan_chunks(para, max_chars))
     return chunks
 
-def generate_long_audio(text, model, output_path, chunk_size=250, silence_per_newline=0.3, voice_map=None, default_voice=None, audio_prompt_path=None):
-    """Generate audio for long text by chunking and concatenating, with dynamic voice switching.
+def plan_narration(text, chunk_size=250, voice_map=None, default_voice=None, audio_prompt_path=None):
+    """Parse narration text into an ordered list of speech and pause items.
     
-    Args:
-        text: Text to generate audio for
-        model: ChatterboxTurboTTS model
-        output_path: Path to save output WAV file
-        chunk_size: Maximum characters per chunk
-        silence_per_newline: Seconds of silence per newline
-        voice_map: Dictionary mapping [Name] to voice reference WAV files
-        default_voice: Default voice path if no tag is present or found
-        audio_prompt_path: Shortcut for a single reference voice (backward-compatible)
+    Speech items are dicts {'type': 'speech', 'line': i, 'chunk': j, 'voice': path, 'text': str};
+    pause items are {'type': 'pause', 'line': i} and stand for one newline of silence.
     """
-    import torch
-    import torchaudio as ta
     import re
     
     # Split text by newlines to insert silence
     lines = text.split('\n')
-    
-    logger.info(f"Processing {len(lines)} lines with silence insertion and voice switching")
-    
-    all_audio = []
-    sample_rate = model.sr
-    
-    # Create silence tensor
-    silence_samples = int(sample_rate * silence_per_newline)
-    silence = torch.zeros(1, silence_samples, dtype=torch.float32)
+    plan = []
     
     # Prefer explicit prompt if provided, otherwise fall back to legacy default voice
     current_voice = audio_prompt_path or default_voice
@@ -97,7 +47,7 @@ def generate_long_audio(text, model, output_path, chunk_size=250, silence_per_ne
         # Skip empty lines but add silence for them
         if not line:
             if i > 0:
-                all_audio.append(silence)
+                plan.append({'type': 'pause', 'line': i})
             continue
         
         # Detect voice switching tag: [Name]
@@ -132,49 +82,413 @@ def generate_long_audio(text, model, output_path, chunk_size=250, silence_per_ne
         if len(line) > chunk_size:
             chunks = chunk_text(line, max_chars=chunk_size)
             logger.info(f"Line {i+1} ({current_voice.name if hasattr(current_voice, 'name') else 'default'}): {len(chunks)} chunks")
-            
-            for j, chunk in enumerate(chunks):
-                try:
-                    wav = model.generate(chunk, audio_prompt_path=str(current_voice) if current_voice else None, norm_loudness=False)
-                    all_audio.append(wav.to(torch.float32))
-                except Exception as e:
-                    import traceback
-                    print(f"   ⚠️  Error on line {i+1}, chunk {j+1}: {e}")
-                    traceback.print_exc()
-                    continue
         else:
-            # Generate audio for the line
-            try:
-                wav = model.generate(line, audio_prompt_path=str(current_voice) if current_voice else None, norm_loudness=False)
-                all_audio.append(wav.to(torch.float32))
-            except Exception as e:
-                import traceback
-                print(f"   ⚠️  Error on line {i+1}: {e}")
-                traceback.print_exc()
-                continue
+            chunks = [line]
+        
+        for j, chunk in enumerate(chunks):
+            plan.append({'type': 'speech', 'line': i, 'chunk': j, 'voice': current_voice, 'text': chunk})
         
         # Add silence after each line
         if i < len(lines) - 1:
-            all_audio.append(silence)
+            plan.append({'type': 'pause', 'line': i})
     
-    if not all_audio:
-        raise Exception("No audio segments were generated successfully")
+    return plan
+
+def plan_paragraphs(plan):
+    """Group plan items by source line; each paragraph gets a hash of its voice, text and pauses.
     
-    # Concatenate all audio segments
-    final_audio = torch.cat(all_audio, dim=1)
+    Returns a list of {'line', 'hash', 'items'} in plan order.
+    """
+    import hashlib
+    import json
     
-    # PEAK NORMALIZATION: Boost the signal so it is audible
-    max_val = final_audio.abs().max()
-    if max_val > 0:
-        print(f"   🔊 Normalizing audio (current peak: {max_val.item():.4f})")
-        final_audio = final_audio / max_val * 0.9
-    else:
-        print("   ⚠️  Warning: Generated audio is completely silent!")
+    paragraphs = []
+    for item in plan:
+        if not paragraphs or paragraphs[-1]['line'] != item['line']:
+            paragraphs.append({'line': item['line'], 'items': []})
+        paragraphs[-1]['items'].append(item)
+    for para in paragraphs:
+        signature = [
+            [item['type'], str(item['voice']) if item.get('voice') else None, item.get('text')]
+            for item in para['items']
+        ]
+        para['hash'] = hashlib.sha1(json.dumps(signature, ensure_ascii=False).encode('utf-8')).hexdigest()
+    return paragraphs
+
+def segment_params(quality='final', precision='fp32', backend='torch'):
+    """Generation settings that affect a segment's audio (part of its segment-cache key)."""
+    from tts_synth import QUALITY_PROFILES
+    profile = QUALITY_PROFILES[quality]
+    params = dict(profile['sampling'], n_cfm_timesteps=profile['n_cfm_timesteps'], norm_loudness=False)
+    if precision != 'fp32':
+        params['precision'] = precision
+    if backend != 'torch':
+        # ONNX S3Gen matches eager torch only to a tolerance; keep its segments apart
+        params['backend'] = backend
+    return params
+
+def _iter_sequential(model, items, conds_cache, seed=None, quality='final'):
+    """Generate each speech item with its own model.generate call (batch size 1), yielding in order."""
+    import torch
+    from tts_profiler import segment, span
+    from tts_synth import synthesize
+    
+    for idx, item in enumerate(items):
+        try:
+            with segment(idx, line=item['line'], chars=len(item['text'])):
+                with span('conditioning'):
+                    conds_cache.apply(model, item['voice'])
+                if seed is not None:
+                    torch.manual_seed(seed)
+                wav = synthesize(model, item['text'], quality)
+                with span('cast'):
+                    wav = wav.to(torch.float32)
+            yield wav
+        except Exception as e:
+            import traceback
+            print(f"   ⚠️  Error on line {item['line']+1}, chunk {item['chunk']+1}: {e}")
+            traceback.print_exc()
+            yield None
+
+def _synthesize_sequential(model, items, conds_cache, seed=None, quality='final'):
+    return list(_iter_sequential(model, items, conds_cache, seed, quality))
 
-    # Save as 16-bit PCM
-    ta.save(str(output_path), final_audio, sample_rate, encoding="PCM_S", bits_per_sample=16)
+def _iter_batched(model, items, conds_cache, batch_size, seed=None, quality='final'):
+    """Generate speech items in length-bucketed, same-voice batches, yielding (index, wav).
+    
+    Items are grouped by voice across the whole chapter (conditionals are cached,
+    so switching is free); results come out batch by batch, not in item order.
+    """
+    import torch
+    from tts_profiler import span
+    from tts_synth import QUALITY_PROFILES, generate_batch, plan_batches
     
-    duration = final_audio.shape[1] / sample_rate
-    print(f"   ✅ Generated {duration:.1f}s of audio with {len(all_audio)} segments")
+    profile = QUALITY_PROFILES[quality]
+    by_voice = {}
+    for idx, item in enumerate(items):
+        by_voice.setdefault(str(item['voice']) if item['voice'] else None, []).append(idx)
+    
+    for voice_indices in by_voice.values():
+        texts = [items[idx]['text'] for idx in voice_indices]
+        for batch in plan_batches(texts, batch_size):
+            batch_indices = [voice_indices[k] for k in batch]
+            try:
+                with span('batch', segments=batch_indices):
+                    with span('conditioning'):
+                        conds_cache.apply(model, items[batch_indices[0]]['voice'])
+                    if seed is not None:
+                        torch.manual_seed(seed)
+                    batch_wavs = generate_batch(model, [items[idx]['text'] for idx in batch_indices],
+                                                profile['n_cfm_timesteps'], **profile['sampling'])
+                    with span('cast'):
+                        batch_wavs = [wav.to(torch.float32) for wav in batch_wavs]
+            except Exception as e:
+                print(f"   ⚠️  Batch of {len(batch_indices)} failed ({e}), retrying one by one")
+                batch_wavs = _synthesize_sequential(model, [items[idx] for idx in batch_indices], conds_cache, seed, quality)
+            yield from zip(batch_indices, batch_wavs)
+
+def _synthesize_batched(model, items, conds_cache, batch_size, seed=None, quality='final'):
+    """Batched synthesis with results returned in the original order."""
+    wavs = [None] * len(items)
+    for idx, wav in _iter_batched(model, items, conds_cache, batch_size, seed, quality):
+        wavs[idx] = wav
+    return wavs
+
+def _iter_pipelined(model, items, conds_cache, quality='final'):
+    """Overlap T3 token generation of the next item with vocoding of the current one, yielding (index, wav)."""
+    import torch
+    from tts_profiler import span
+    from tts_synth import iter_pipelined
     
-    return final_audio
+    jobs = ((idx, item['text'], item['voice']) for idx, item in enumerate(items))
+    for idx, wav, error in iter_pipelined(model, jobs, conds_cache, quality):
+        if error is not None:
+            item = items[idx]
+            print(f"   ⚠️  Error on line {item['line']+1}, chunk {item['chunk']+1}: {error}")
+            yield idx, None
+        else:
+            with span('cast', segment=idx):
+                wav = wav.to(torch.float32)
+            yield idx, wav
+
+def _iter_segments(model, items, conds_cache, batch_size=1, seed=None, quality='final', pipeline=False):
+    """Synthesize speech items with whatever backend `model` is, yielding (index, wav) as they finish."""
+    if hasattr(model, 'synthesize_segments'):
+        # TTS service client: the daemon holds the model and voice conditionals
+        return model.synthesize_segments(items, quality, seed)
+    if batch_size > 1:
+        return _iter_batched(model, items, conds_cache, batch_size, seed, quality)
+    if pipeline and seed is None:
+        # Seeded runs stay sequential: the two stages would share torch's RNG
+        return _iter_pipelined(model, items, conds_cache, quality)
+    return enumerate(_iter_sequential(model, items, conds_cache, seed, quality))
+
+class ChapterWriter:
+    """Streams a chapter's speech segments and pauses to disk in plan order.
+    
+    Segments may arrive in any order; each one is written as soon as everything
+    before it is on disk, so memory use does not grow with chapter length. Audio
+    goes to a float32 `<name>.wav.partial` file (a valid WAV after every segment,
+    so a crash leaves usable output) and `close()` applies peak normalization in
+    a streaming second pass into the final 16-bit WAV. Draft-quality chapters
+    skip normalization and are tagged as drafts in their segment map.
+    
+    Cached segments (`cached_indices`) are loaded with `load_cached` when it is
+    their turn; one that comes back None is reported by `take_uncached()`
+    rather than written as an empty segment.
+    """
+    
+    def __init__(self, plan, sample_rate, output_path, silence_per_newline=0.3,
+                 cached_indices=(), load_cached=None, quality='final'):
+        from wav_io import StreamingWavWriter
+        
+        self.plan = plan
+        self.sample_rate = sample_rate
+        self.output_path = Path(output_path)
+        self.partial_path = self.output_path.with_name(self.output_path.name + '.partial')
+        self.silence_per_newline = silence_per_newline
+        self.cached_indices = set(cached_indices)
+        self.load_cached = load_cached
+        self.quality = quality
+        self.speech_count = sum(1 for item in plan if item['type'] == 'speech')
+        self.segments_written = 0
+        self.blocks_written = 0
+        self._pending = {}
+        self._line_spans = {}
+        self._segment_spans = []
+        self._plan_pos = 0
+        self._speech_pos = 0
+        self._uncached = []
+        self._writer = StreamingWavWriter(self.partial_path, sample_rate, sample_format='float32')
+        self._advance()
+    
+    @property
+    def next_speech_index(self):
+        return self._speech_pos if self._speech_pos < self.speech_count else None
+    
+    def take_uncached(self):
+        """Cached segments that could not be loaded; the caller must synthesize and add() them."""
+        uncached, self._uncached = self._uncached, []
+        return uncached
+    
+    def add(self, speech_index, wav):
+        """Hand over the waveform (or None if it failed) for one speech item."""
+        self._pending[speech_index] = wav
+        self._advance()
+    
+    def _advance(self):
+        from tts_profiler import span
+        
+        while self._plan_pos < len(self.plan):
+            item = self.plan[self._plan_pos]
+            line_span = self._line_spans.setdefault(item['line'], [self._writer.frames, self._writer.frames])
+            if item['type'] == 'pause':
+                with span('silence'):
+                    self._writer.write_silence(item.get('seconds', self.silence_per_newline))
+                self.blocks_written += 1
+            else:
+                if self._speech_pos not in self._pending:
+                    if self._speech_pos not in self.cached_indices:
+                        return
+                    # Cached segments are read from disk only when it is their turn
+                    wav = self.load_cached(self._speech_pos)
+                    self.cached_indices.discard(self._speech_pos)
+                    if wav is None:
+                        # Gone or unreadable: wait for the caller to synthesize it instead
+                        self._uncached.append(self._speech_pos)
+                        return
+                    self._pending[self._speech_pos] = wav
+                wav = self._pending.pop(self._speech_pos)
+                segment_start = self._writer.frames
+                if wav is not None:
+                    with span('write', segment=self._speech_pos):
+                        self._writer.write(wav)
+                    self.segments_written += 1
+                    self.blocks_written += 1
+                self._segment_spans.append({'id': item.get('id'), 'start': segment_start, 'end': self._writer.frames})
+                self._speech_pos += 1
+            line_span[1] = self._writer.frames
+            self._plan_pos += 1
+    
+    def close(self):
+        """Finish the chapter: normalize into the final WAV and return its duration in seconds."""
+        from tts_profiler import span
+        from wav_io import write_scaled_wav
+        
+        self._writer.close()
+        if self._plan_pos < len(self.plan):
+            raise Exception(f"Chapter closed with {self.speech_count - self._speech_pos} segments still missing")
+        if not self.segments_written:
+            self.partial_path.unlink()
+            raise Exception("No audio segments were generated successfully")
+        
+        # PEAK NORMALIZATION: Boost the signal so it is audible
+        from tts_synth import QUALITY_PROFILES
+        max_val = self._writer.peak
+        gain = 1.0
+        if not QUALITY_PROFILES[self.quality]['normalize']:
+            print(f"   📝 {self.quality.title()} quality: skipping normalization")
+        elif max_val > 0:
+            print(f"   🔊 Normalizing audio (current peak: {max_val:.4f})")
+            gain = 0.9 / max_val
+        else:
+            print("   ⚠️  Warning: Generated audio is completely silent!")
+        
+        # Save as 16-bit PCM
+        with span('normalize'):
+            write_scaled_wav(self.partial_path, self.output_path, gain, sample_format='int16')
+        self.partial_path.unlink()
+        self._save_segment_map(gain)
+        
+        duration = self._writer.duration
+        print(f"   ✅ Generated {duration:.1f}s of audio with {self.blocks_written} segments")
+        return duration
+
+    def _save_segment_map(self, gain):
+        """Record where each paragraph landed so it can later be spliced in place."""
+        import json
+        
+        paragraphs = [
+            {'line': para['line'], 'hash': para['hash'],
+             'start': self._line_spans[para['line']][0], 'end': self._line_spans[para['line']][1]}
+            for para in plan_paragraphs(self.plan)
+        ]
+        segment_map = {
+            'sample_rate': self.sample_rate,
+            'silence_per_newline': self.silence_per_newline,
+            'quality': self.quality,
+            'gain': gain,
+            'frames': self._writer.frames,
+            'paragraphs': paragraphs,
+            'segments': self._segment_spans,
+        }
+        with open(segment_map_path(self.output_path), 'w') as f:
+            json.dump(segment_map, f)
+
+def generate_long_audio(text, model, output_path, chunk_size=250, silence_per_newline=0.3, voice_map=None, default_voice=None, audio_prompt_path=None, conds_cache=None, batch_size=1, seed=None, segment_cache=None, quality='final', script=None, pipeline=False, profile=False, qa=True):
+    """Generate audio for long text by chunking and concatenating, with dynamic voice switching.
+    
+    Args:
+        text: Text to generate audio for
+        model: ChatterboxTurboTTS model, or a TTSClient for the running TTS service
+        output_path: Path to save output WAV file
+        chunk_size: Maximum characters per chunk
+        silence_per_newline: Seconds of silence per newline
+        voice_map: Dictionary mapping [Name] to voice reference WAV files
+        default_voice: Default voice path if no tag is present or found
+        audio_prompt_path: Shortcut for a single reference voice (backward-compatible)
+        conds_cache: VoiceConditionalsCache to reuse per-voice conditionals (defaults to the shared one)
+        batch_size: Lines synthesized together per batched T3 decode (1 = one generate() per line)
+        seed: Torch seed set before each segment (None = unseeded); part of the segment-cache key
+        segment_cache: SegmentCache to reuse previously synthesized segments (None = shared one, False = off)
+        quality: 'final', or 'draft' for fast proof-listening audio that must not be mastered
+        script: Compiled narration script segments (see narration_script); replaces parsing `text`
+        pipeline: Overlap T3 token generation and vocoding in two threads (batch size 1, unseeded only)
+        profile: Time every synthesis stage per segment; prints a summary table and writes a
+            Chrome trace to output/profiles/<chapter>.trace.json (see tts_profiler)
+        qa: Scan each synthesized segment and re-synthesize flagged ones with a new seed;
+            writes <chapter>.qa.json when anything was flagged (see segment_qa)
+    """
+    if profile:
+        from tts_profiler import profiling
+        
+        sync_cuda = str(getattr(model, 'device', '')).startswith('cuda')
+        with profiling(Path(output_path).stem, sync_cuda=sync_cuda) as profiler:
+            duration = generate_long_audio(
+                text, model, output_path, chunk_size, silence_per_newline, voice_map, default_voice,
+                audio_prompt_path, conds_cache, batch_size, seed, segment_cache, quality, script, pipeline,
+                qa=qa,
+            )
+        profiler.report(audio_seconds=duration)
+        return duration
+    
+    from voice_conditionals import get_conditionals_cache
+    from segment_cache import get_segment_cache, segment_key
+    
+    conds_cache = conds_cache or get_conditionals_cache()
+    if segment_cache is None:
+        segment_cache = get_segment_cache()
+    
+    if script is not None:
+        from narration_script import script_to_plan
+        plan = script_to_plan(script)
+    else:
+        plan = plan_narration(text, chunk_size, voice_map, default_voice, audio_prompt_path)
+    speech_items = [item for item in plan if item['type'] == 'speech']
+    
+    logger.info(f"Processing {len(speech_items)} speech segments with silence insertion and voice switching")
+    
+    # Assemble from cached segments where possible; synthesize only the misses
+    keys = []
+    hits = set()
+    if segment_cache:
+        params = segment_params(quality, getattr(model, 'precision', 'fp32'), getattr(model, 'backend', 'torch'))
+        keys = [segment_key(item['text'], item['voice'], seed, params) for item in speech_items]
+        hits = {idx for idx, key in enumerate(keys) if segment_cache.contains(key)}
+        # Storing this chapter's misses must not evict the hits it has yet to read
+        segment_cache.pin(keys[idx] for idx in hits)
+        print(f"   ♻️  Segment cache: {len(hits)} hits, {len(speech_items) - len(hits)} to synthesize")
+    misses = [idx for idx in range(len(speech_items)) if idx not in hits]
+    
+    writer = ChapterWriter(
+        plan, model.sr, output_path, silence_per_newline,
+        cached_indices=hits, load_cached=lambda idx: segment_cache.get(keys[idx]), quality=quality
+    )
+    
+    review = None
+    if qa:
+        from segment_qa import SegmentReview
+        review = SegmentReview(speech_items, model.sr, seed)
+    # Retakes cannot run while a pipelined or remote stream is still using the model
+    defer_retakes = hasattr(model, 'synthesize_segments') or (pipeline and seed is None and batch_size == 1)
+    deferred = {}
+    
+    def accept(idx, wav):
+        if wav is not None and segment_cache:
+            # Stored under the original key, so a retake is reused like a first take
+            segment_cache.put(keys[idx], wav, model.sr)
+        writer.add(idx, wav)
+    
+    try:
+        miss_items = [speech_items[idx] for idx in misses]
+        for k, wav in _iter_segments(model, miss_items, conds_cache, batch_size, seed, quality, pipeline):
+            idx = misses[k]
+            if review:
+                wav, retake = review.review(idx, wav)
+                if retake is not None:
+                    if defer_retakes:
+                        deferred[idx] = retake
+                        continue
+                    wav = _retake(model, speech_items[idx], idx, retake, review, conds_cache, quality)
+            accept(idx, wav)
+        for idx, retake in deferred.items():
+            accept(idx, _retake(model, speech_items[idx], idx, retake, review, conds_cache, quality))
+        # Cache hits that could not be read back are synthesized after all
+        while True:
+            lost = writer.take_uncached()
+            if not lost:
+                break
+            print(f"   ♻️  {len(lost)} cached segment(s) unreadable, synthesizing")
+            lost_items = [speech_items[idx] for idx in lost]
+            for k, wav in _iter_segments(model, lost_items, conds_cache, batch_size, seed, quality):
+                idx = lost[k]
+                if review:
+                    wav, retake = review.review(idx, wav)
+                    if retake is not None:
+                        wav = _retake(model, speech_items[idx], idx, retake, review, conds_cache, quality)
+                accept(idx, wav)
+    finally:
+        if segment_cache:
+            segment_cache.unpin(keys[idx] for idx in hits)
+    
+    duration = writer.close()
+    if review:
+        review.write_report(output_path)
+    return duration
+
+def _retake(model, item, idx, seed, review, conds_cache, quality):
+    """Re-synthesize a QA-flagged segment with new seeds until it passes or retries run out."""
+    while seed is not None:
+        _, wav = next(iter(_iter_segments(model, [item], conds_cache, seed=seed, quality=quality)))
+        wav, seed = review.review(idx, wav)
+    return wav
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Fast-startup loading of Chatterbox-Turbo.
+
+`ChatterboxTurboTTS.from_pretrained` checks the Hugging Face hub, copies every
+checkpoint into freshly initialized modules and, on CPU, is followed by a deep
+float32 cast. This module exports the ready-to-run (already cast) weights once to
+a local safetensors snapshot under cache/tts_snapshot/. Later loads memory-map
+that snapshot and assign the tensors directly to the modules, so there is no hub
+round-trip, no copy and no cast, and worker processes share the page-cached
+weights. A short warm-up utterance then primes the kernels before real work.
+
+Usage:
+    python tts_model.py --export     # (re)build the snapshot
+"""
+
+import argparse
+import json
+import logging
+import shutil
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = Path(__file__).parent / "cache" / "tts_snapshot"
+SNAPSHOT_MODULES = ['ve', 't3', 's3gen']
+WARMUP_TEXT = "The wolf walked on alone, into the winter forest."
+PRECISIONS = ("fp32", "bf16", "int8")
+
+
+def load_pretrained(device="cpu"):
+    """The original load path: hub checkpoint plus a float32 cast on CPU."""
+    import torch
+    from chatterbox.tts_turbo import ChatterboxTurboTTS
+
+    torch.set_default_dtype(torch.float32)
+    model = ChatterboxTurboTTS.from_pretrained(device=device)
+    if device == "cpu":
+        for attr in ['t3', 've', 's3gen', 'vocoder']:
+            if hasattr(model, attr):
+                getattr(model, attr).to(torch.float32)
+    return model
+
+
+def snapshot_is_current(snapshot_dir=SNAPSHOT_DIR):
+    """True if the snapshot exists and was exported from the installed model version."""
+    from voice_conditionals import model_version
+
+    manifest_path = Path(snapshot_dir) / "manifest.json"
+    if not manifest_path.exists():
+        return False
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return manifest.get('model_version') == model_version()
+
+
+def export_snapshot(model=None, snapshot_dir=SNAPSHOT_DIR):
+    """Write the cast weights, tokenizer and built-in voice of `model` to a local snapshot."""
+    import torch
+    from safetensors.torch import save_file
+    from voice_conditionals import model_version
+
+    model = model or load_pretrained("cpu")
+    snapshot_dir = Path(snapshot_dir)
+    tmp_dir = snapshot_dir.with_name(snapshot_dir.name + ".tmp")
+    if tmp_dir.exists():
+        shutil.rmtree(tmp_dir)
+    tmp_dir.mkdir(parents=True)
+
+    logger.info(f"📦 Exporting TTS snapshot to {snapshot_dir}...")
+    for name in SNAPSHOT_MODULES:
+        # Clone so tensors that share storage are saved independently
+        state = {k: v.detach().to("cpu", torch.float32 if v.is_floating_point() else v.dtype).contiguous().clone()
+                 for k, v in getattr(model, name).state_dict().items()}
+        save_file(state, str(tmp_dir / f"{name}.safetensors"))
+    model.tokenizer.save_pretrained(str(tmp_dir))
+    if model.conds is not None:
+        model.conds.save(tmp_dir / "conds.pt")
+
+    with open(tmp_dir / "manifest.json", 'w') as f:
+        json.dump({
+            'model_version': model_version(model),
+            'torch_version': torch.__version__,
+            'dtype': 'float32',
+            'modules': SNAPSHOT_MODULES,
+        }, f, indent=2)
+
+    if snapshot_dir.exists():
+        shutil.rmtree(snapshot_dir)
+    tmp_dir.rename(snapshot_dir)
+    logger.info("✅ TTS snapshot exported")
+    return model
+
+
+def ensure_snapshot(snapshot_dir=SNAPSHOT_DIR):
+    """Export the snapshot once if it is missing or stale (call before spawning workers)."""
+    if not snapshot_is_current(snapshot_dir):
+        model = export_snapshot(snapshot_dir=snapshot_dir)
+        del model
+
+
+def load_snapshot(snapshot_dir=SNAPSHOT_DIR, device="cpu"):
+    """Build ChatterboxTurboTTS from a snapshot, memory-mapping the weights."""
+    import torch
+    from safetensors.torch import load_file
+    from transformers import AutoTokenizer
+    from chatterbox.tts_turbo import ChatterboxTurboTTS, Conditionals
+    from chatterbox.models.s3gen import S3Gen
+    from chatterbox.models.t3 import T3
+    from chatterbox.models.t3.modules.t3_config import T3Config
+    from chatterbox.models.voice_encoder import VoiceEncoder
+
+    snapshot_dir = Path(snapshot_dir)
+    torch.set_default_dtype(torch.float32)
+
+    # Same module construction as ChatterboxTurboTTS.from_local
+    hp = T3Config(text_tokens_dict_size=50276)
+    hp.llama_config_name = "GPT2_medium"
+    hp.speech_tokens_dict_size = 6563
+    hp.input_pos_emb = None
+    hp.speech_cond_prompt_len = 375
+    hp.use_perceiver_resampler = False
+    hp.emotion_adv = False
+    t3 = T3(hp)
+    del t3.tfmr.wte
+    modules = {'ve': VoiceEncoder(), 't3': t3, 's3gen': S3Gen(meanflow=True)}
+
+    for name, module in modules.items():
+        # load_file maps the file; assign=True keeps those tensors instead of copying into the init weights
+        state = load_file(str(snapshot_dir / f"{name}.safetensors"), device="cpu")
+        module.load_state_dict(state, strict=True, assign=True)
+        module.to(device).eval()
+
+    tokenizer = AutoTokenizer.from_pretrained(str(snapshot_dir))
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+
+    conds = None
+    conds_path = snapshot_dir / "conds.pt"
+    if conds_path.exists():
+        conds = Conditionals.load(conds_path, map_location="cpu").to(device)
+
+    return ChatterboxTurboTTS(modules['t3'], modules['s3gen'], modules['ve'], tokenizer, device, conds=conds)
+
+
+def warm_up(model, text=WARMUP_TEXT):
+    """Synthesize one short fixed utterance so first-call allocations and kernel selection happen now."""
+    from tts_synth import synthesize
+
+    start = time.time()
+    synthesize(model, text)
+    logger.info(f"🔥 TTS warm-up took {time.time() - start:.1f}s")
+
+
+def cpu_supports_bf16():
+    """bf16 autocast only pays off on CPUs with native bf16 instructions (AVX512-BF16 or AMX)."""
+    try:
+        flags = Path("/proc/cpuinfo").read_text()
+    except OSError:
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+
+def _linearize_conv1d(module):
+    """Swap transformers' GPT-2 Conv1D layers for equivalent nn.Linear so dynamic quantization sees them."""
+    import torch
+    from transformers.pytorch_utils import Conv1D
+
+    for name, child in module.named_children():
+        if isinstance(child, Conv1D):
+            nx, nf = child.weight.shape
+            linear = torch.nn.Linear(nx, nf)
+            linear.weight = torch.nn.Parameter(child.weight.detach().t().contiguous(), requires_grad=False)
+            linear.bias = torch.nn.Parameter(child.bias.detach().clone(), requires_grad=False)
+            setattr(module, name, linear)
+        else:
+            _linearize_conv1d(child)
+
+
+def apply_precision(model, precision="fp32"):
+    """Switch the T3 decoder to a reduced-precision inference mode.
+
+    fp32: unchanged. bf16: T3 runs under bf16 autocast (see tts_synth.t3_precision).
+    int8: T3's linear layers are dynamically quantized to int8. The S3Gen vocoder
+    always stays in float32. Sets `model.precision` to the mode actually used.
+    """
+    import torch
+
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision!r}; choose from {PRECISIONS}")
+    on_cpu = str(model.device) == "cpu"
+    if precision == "bf16" and on_cpu and not cpu_supports_bf16():
+        logger.warning("⚠️ This CPU has no native bf16 support; staying in fp32")
+        precision = "fp32"
+    if precision == "int8":
+        if not on_cpu:
+            raise ValueError("int8 dynamic quantization is CPU-only")
+        _linearize_conv1d(model.t3.tfmr)
+        torch.ao.quantization.quantize_dynamic(model.t3, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    model.precision = precision
+    if precision != "fp32":
+        logger.info(f"🧮 T3 inference precision: {precision}")
+    return model
+
+
+def load_tts_model(device=None, snapshot=True, warmup=True, precision="fp32", backend=None):
+    """Load Chatterbox-Turbo for this process, preferring the local snapshot.
+
+    Args:
+        device: "cuda" or "cpu" (None = CUDA if available)
+        snapshot: Use (and create on first run) the memory-mapped snapshot
+        warmup: Run a short warm-up utterance after loading
+        precision: T3 inference mode: "fp32", "bf16" or "int8" (see apply_precision)
+        backend: S3Gen backend, "torch" or "onnx" (None = $TTS_BACKEND, see onnx_backend)
+    """
+    import torch
+    from onnx_backend import apply_backend
+
+    device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+    start = time.time()
+    model = None
+    if snapshot:
+        try:
+            if not snapshot_is_current():
+                # First run: the exported model is already loaded, so use it directly
+                model = export_snapshot()
+                if device != "cpu":
+                    model = None
+            if model is None:
+                model = load_snapshot(SNAPSHOT_DIR, device)
+        except Exception as e:
+            logger.warning(f"⚠️ TTS snapshot unavailable ({e}); loading from the hub checkpoint")
+            model = None
+    if model is None:
+        model = load_pretrained(device)
+    logger.info(f"✅ TTS model loaded on {device} in {time.time() - start:.1f}s")
+
+    apply_precision(model, precision)
+    apply_backend(model, backend)
+    if warmup:
+        warm_up(model)
+    return model
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or test the fast-startup TTS snapshot")
+    parser.add_argument("--export", action="store_true", help="Rebuild the snapshot from the hub checkpoint")
+    parser.add_argument("--device", default=None, choices=["cuda", "cpu"])
+    parser.add_argument("--precision", default="fp32", choices=PRECISIONS)
+    parser.add_argument("--backend", default=None, choices=["torch", "onnx"])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.export:
+        export_snapshot()
+    load_tts_model(args.device, precision=args.precision, backend=args.backend)
+
+
+if __name__ == "__main__":
+    main()
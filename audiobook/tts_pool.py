@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+Multi-process TTS worker pool with segment-level work stealing.
+
+A single torch process stops scaling after a few cores. The pool starts N worker
+processes, each pinned to its own slice of CPU cores with a matching torch thread
+count and its own Chatterbox model. Chapters are split into speech segments and
+pushed onto one shared queue, so an idle worker always picks up the next segment,
+whichever chapter it belongs to. The parent streams each chapter to disk in order as its segments land.
+Workers announce each task they take; if one dies, its tasks go back on the queue.
+"""
+
+import logging
+import multiprocessing as mp
+import os
+import queue
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def available_cores():
+    """CPU cores this process is allowed to run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def split_cores(num_workers, cores=None):
+    """Divide the available cores into `num_workers` contiguous, disjoint slices."""
+    cores = cores or available_cores()
+    num_workers = max(1, min(num_workers, len(cores)))
+    per_worker, extra = divmod(len(cores), num_workers)
+    slices = []
+    start = 0
+    for w in range(num_workers):
+        size = per_worker + (1 if w < extra else 0)
+        slices.append(cores[start:start + size])
+        start += size
+    return slices
+
+
+def _worker_main(worker_id, cores, device, task_queue, result_queue, quality="final", precision="fp32",
+                 backend=None, pipeline=False):
+    """Worker process: pin to cores, load the model, synthesize segments until told to stop."""
+    # Thread pools must be sized before torch initializes them
+    threads = str(len(cores))
+    os.environ["OMP_NUM_THREADS"] = threads
+    os.environ["MKL_NUM_THREADS"] = threads
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+
+    import torch
+    torch.set_default_dtype(torch.float32)
+    torch.set_num_threads(len(cores))
+    torch.set_num_interop_threads(1)
+
+    from tts_model import load_tts_model
+    from tts_synth import iter_pipelined, synthesize
+    from voice_conditionals import get_conditionals_cache
+
+    # Memory-mapped snapshot: every worker shares the same page-cached weights
+    model = load_tts_model(device, precision=precision, backend=backend)
+    conds_cache = get_conditionals_cache()
+    result_queue.put(('ready', worker_id, model.sr, (model.precision, model.backend)))
+
+    def tasks():
+        # Announce every task taken, so the parent can requeue it if this process dies
+        for task in iter(task_queue.get, None):
+            result_queue.put(('taken', worker_id, task, None))
+            yield task
+
+    if pipeline:
+        # Token generation for the next task overlaps vocoding of the current one
+        jobs = (((chapter_id, index), text, voice) for chapter_id, index, text, voice, _ in tasks())
+        for (chapter_id, index), wav, error in iter_pipelined(model, jobs, conds_cache, quality):
+            if error is not None:
+                result_queue.put((chapter_id, index, None, f"worker {worker_id}: {error}"))
+            else:
+                result_queue.put((chapter_id, index, wav.to(torch.float32).numpy(), None))
+        return
+
+    for task in tasks():
+        chapter_id, index, text, voice, seed = task
+        try:
+            conds_cache.apply(model, voice)
+            if seed is not None:
+                torch.manual_seed(seed)
+            wav = synthesize(model, text, quality)
+            result_queue.put((chapter_id, index, wav.to(torch.float32).numpy(), None))
+        except Exception as e:
+            result_queue.put((chapter_id, index, None, f"worker {worker_id}: {e}"))
+
+
+class TTSWorkerPool:
+    """Pool of pinned Chatterbox worker processes sharing one segment queue."""
+
+    def __init__(self, num_workers, device="cpu", silence_per_newline=0.3, seed=None, segment_cache=None,
+                 quality="final", precision="fp32", backend=None, pipeline=False, qa=True):
+        self.core_slices = split_cores(num_workers)
+        self.device = device
+        self.quality = quality
+        self.precision = precision
+        self.backend = backend
+        # Seeded runs stay sequential (see tts_synth.iter_pipelined)
+        self.pipeline = pipeline and seed is None
+        self.silence_per_newline = silence_per_newline
+        self.seed = seed
+        self.segment_cache = segment_cache
+        self.qa = qa
+        self.sample_rate = None
+        self.chapters = {}
+        self.processes = []
+        # Tasks each worker has taken and not yet answered: {worker_id: {(chapter_id, index): task}}
+        self._in_flight = {}
+        self._ctx = mp.get_context("spawn")
+        self.task_queue = self._ctx.Queue()
+        self.result_queue = self._ctx.Queue()
+
+    def start(self):
+        """Spawn the workers and wait until every model is loaded."""
+        from onnx_backend import DEFAULT_BACKEND, ensure_onnx_export
+        from tts_model import ensure_snapshot
+        # Export once here so the workers don't race to create the snapshot (or ONNX graphs)
+        ensure_snapshot()
+        if (self.backend or DEFAULT_BACKEND) == "onnx" and self.device == "cpu":
+            ensure_onnx_export()
+        for worker_id, cores in enumerate(self.core_slices):
+            p = self._ctx.Process(
+                target=_worker_main,
+                args=(worker_id, cores, self.device, self.task_queue, self.result_queue,
+                      self.quality, self.precision, self.backend, self.pipeline),
+                daemon=True,
+            )
+            p.start()
+            self.processes.append(p)
+            self._in_flight[worker_id] = {}
+            logger.info(f"🧵 TTS worker {worker_id}: cores {cores[0]}-{cores[-1]} ({len(cores)} threads)")
+
+        ready = 0
+        while ready < len(self.processes):
+            kind, _, sample_rate, settings = self._get_result(timeout=None)
+            if kind == 'ready':
+                ready += 1
+                self.sample_rate = sample_rate
+                # Workers may fall back (e.g. bf16 on a CPU without bf16 support)
+                self.precision, self.backend = settings
+        logger.info(f"✅ TTS pool ready with {ready} workers")
+        return self
+
+    def submit_chapter(self, chapter_id, text, output_path, script=None, **plan_kwargs):
+        """Queue every speech segment of a chapter (from `script` if given); returns immediately."""
+        from tts_helpers import ChapterWriter, plan_narration, segment_params
+        from segment_cache import get_segment_cache, segment_key
+
+        if self.segment_cache is None:
+            self.segment_cache = get_segment_cache()
+        cache = self.segment_cache
+
+        if script is not None:
+            from narration_script import script_to_plan
+            plan = script_to_plan(script)
+        else:
+            plan = plan_narration(text, **plan_kwargs)
+        speech_items = [item for item in plan if item['type'] == 'speech']
+        keys = []
+        hits = set()
+        if cache:
+            params = segment_params(self.quality, self.precision, self.backend)
+            keys = [segment_key(item['text'], item['voice'], self.seed, params) for item in speech_items]
+            hits = {index for index, key in enumerate(keys) if cache.contains(key)}
+            # Other chapters' segments stored meanwhile must not evict the hits this one has yet to read
+            cache.pin(keys[index] for index in hits)
+
+        review = None
+        if self.qa:
+            from segment_qa import SegmentReview
+            review = SegmentReview(speech_items, self.sample_rate, self.seed)
+        chapter = {
+            'items': speech_items,
+            'hits': hits,
+            # Segments sent to the workers and not yet answered: {index: seed}
+            'queued': {},
+            'review': review,
+            'output_path': output_path,
+            'keys': keys,
+            'pending': len(speech_items) - len(hits),
+            'writer': ChapterWriter(
+                plan, self.sample_rate, output_path, self.silence_per_newline,
+                cached_indices=hits, load_cached=lambda index: cache.get(keys[index]),
+                quality=self.quality
+            ),
+        }
+        self.chapters[chapter_id] = chapter
+
+        for index, item in enumerate(speech_items):
+            if index in hits:
+                continue
+            self._queue_segment(chapter_id, index, self.seed)
+        self._requeue_uncached(chapter_id)
+
+        if not chapter['pending']:
+            return self._finish(chapter_id)
+
+    def poll(self, timeout=None):
+        """Collect finished segments; returns the chapters completed during this call."""
+        completed = []
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while any(c['pending'] for c in self.chapters.values()):
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                chapter_id, index, wav, error = self._get_result(remaining)
+            except queue.Empty:
+                break
+
+            chapter = self.chapters.get(chapter_id)
+            if chapter is None or index not in chapter['queued']:
+                # Late answer to a task that was requeued after its worker died
+                continue
+            del chapter['queued'][index]
+            if error:
+                print(f"   ⚠️  Error on {chapter_id}, segment {index + 1}: {error}")
+            else:
+                import torch
+                wav = torch.from_numpy(wav)
+            if chapter['review']:
+                wav, retake = chapter['review'].review(index, wav)
+                if retake is not None:
+                    # Flagged by QA: queue a retake with a new seed (pipelined workers sample it
+                    # unseeded, which is a new take too); the segment stays pending
+                    self._queue_segment(chapter_id, index, retake)
+                    continue
+            if wav is not None and self.segment_cache:
+                self.segment_cache.put(chapter['keys'][index], wav, self.sample_rate)
+            chapter['writer'].add(index, wav)
+            chapter['pending'] -= 1
+            self._requeue_uncached(chapter_id)
+
+            if chapter['pending'] == 0:
+                completed.append(self._finish(chapter_id))
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+        return [c for c in completed if c]
+
+    def _get_result(self, timeout):
+        """Wait for a worker message, requeueing the tasks of any worker that died."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            self._check_workers()
+            wait = 5.0 if deadline is None else min(5.0, max(0.0, deadline - time.monotonic()))
+            try:
+                message = self.result_queue.get(timeout=wait)
+            except queue.Empty:
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise
+                continue
+            if message[0] == 'taken':
+                _, worker_id, task, _ = message
+                if worker_id in self._in_flight:
+                    self._in_flight[worker_id][task[:2]] = task
+                else:
+                    # Read after its worker was found dead
+                    self.task_queue.put(task)
+                continue
+            # (chapter_id, index) answered
+            for tasks in self._in_flight.values():
+                tasks.pop(message[:2], None)
+            return message
+
+    def _check_workers(self):
+        """Requeue what a dead worker had taken; fail loudly once every worker is gone."""
+        for worker_id, p in enumerate(self.processes):
+            if p.exitcode is None or worker_id not in self._in_flight:
+                continue
+            lost = self._in_flight.pop(worker_id)
+            logger.warning(f"⚠️ TTS worker {worker_id} exited (code {p.exitcode}); "
+                           f"requeueing {len(lost)} segment(s)")
+            for task in lost.values():
+                self.task_queue.put(task)
+        if not self._in_flight:
+            raise RuntimeError("All TTS workers exited unexpectedly")
+
+    def _queue_segment(self, chapter_id, index, seed):
+        chapter = self.chapters[chapter_id]
+        item = chapter['items'][index]
+        voice = str(item['voice']) if item['voice'] else None
+        chapter['queued'][index] = seed
+        self.task_queue.put((chapter_id, index, item['text'], voice, seed))
+
+    def _requeue_uncached(self, chapter_id):
+        """Send cache hits that could not be read back to the workers."""
+        chapter = self.chapters[chapter_id]
+        for index in chapter['writer'].take_uncached():
+            print(f"   ♻️  {chapter_id}: cached segment {index + 1} unreadable, synthesizing")
+            self._queue_segment(chapter_id, index, self.seed)
+            chapter['pending'] += 1
+
+    def _finish(self, chapter_id):
+        chapter = self.chapters.pop(chapter_id)
+        if self.segment_cache:
+            self.segment_cache.unpin(chapter['keys'][index] for index in chapter['hits'])
+        try:
+            chapter['writer'].close()
+            if chapter['review']:
+                chapter['review'].write_report(chapter['output_path'])
+        except Exception as e:
+            print(f"❌ Error assembling {chapter_id}: {e}")
+            return None
+        return chapter_id
+
+    def render_chapters(self, jobs, **plan_kwargs):
+        """Narrate several chapters at once. `jobs` is a list of (chapter_id, text, output_path[, script])."""
+        for chapter_id, text, output_path, *script in jobs:
+            self.submit_chapter(chapter_id, text, output_path, *script, **plan_kwargs)
+        done = []
+        while self.chapters:
+            done.extend(self.poll())
+        return done
+
+    def close(self):
+        for _ in self.processes:
+            self.task_queue.put(None)
+        for p in self.processes:
+            p.join(timeout=30)
+        self.processes = []
+        self._in_flight = {}
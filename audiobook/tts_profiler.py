@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Lightweight hot-path profiler for TTS rendering.
+
+Synthesis code marks its stages with `span(name)`. Spans are no-ops unless a
+`Profiler` is active (`generate_long_audio(..., profile=True)`, or `--profile`
+in Stage 2). In that case each span's wall time is recorded with its thread and
+the segment it belongs to. At the end of a chapter, `report()` prints a
+per-stage summary table and writes a Chrome trace (open it in chrome://tracing
+or https://ui.perfetto.dev) to output/profiles/<chapter>.trace.json.
+
+Stages: segment, conditioning, tokenize, t3_prefix, t3, s3gen, watermark, cast,
+write, silence, normalize.
+"""
+
+import contextlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+PROFILE_DIR = Path(__file__).parent / "output" / "profiles"
+
+_active = None
+_local = threading.local()
+
+
+class Profiler:
+    """Collects timed spans for one chapter."""
+
+    def __init__(self, name, sync_cuda=False):
+        self.name = name
+        self.sync_cuda = sync_cuda
+        self.events = []
+        self._lock = threading.Lock()
+        self._t0 = time.perf_counter()
+        self._wall = None
+
+    @contextlib.contextmanager
+    def span(self, name, **args):
+        if self.sync_cuda:
+            import torch
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.sync_cuda:
+                import torch
+                torch.cuda.synchronize()
+            end = time.perf_counter()
+            segment = getattr(_local, 'segment', None)
+            if segment is not None and 'segment' not in args:
+                args['segment'] = segment
+            with self._lock:
+                self.events.append((name, start - self._t0, end - start, threading.get_ident(), args))
+
+    def finish(self):
+        self._wall = time.perf_counter() - self._t0
+
+    def summary(self):
+        """Per-stage totals: {stage: {'calls', 'total', 'mean', 'max'}} in seconds."""
+        stages = {}
+        for name, _, duration, _, _ in self.events:
+            s = stages.setdefault(name, {'calls': 0, 'total': 0.0, 'max': 0.0})
+            s['calls'] += 1
+            s['total'] += duration
+            s['max'] = max(s['max'], duration)
+        for s in stages.values():
+            s['mean'] = s['total'] / s['calls']
+        return stages
+
+    def print_summary(self, audio_seconds=None):
+        wall = self._wall or (time.perf_counter() - self._t0)
+        print(f"\n   ⏱️  Profile: {self.name} (wall {wall:.1f}s"
+              + (f", RTF {wall / audio_seconds:.2f})" if audio_seconds else ")"))
+        print(f"   {'STAGE':<13} | {'CALLS':>6} | {'TOTAL (s)':>9} | {'MEAN (ms)':>9} | {'MAX (ms)':>9} | {'% WALL':>6}")
+        print("   " + "-" * 68)
+        for name, s in sorted(self.summary().items(), key=lambda kv: -kv[1]['total']):
+            print(f"   {name:<13} | {s['calls']:>6} | {s['total']:>9.2f} | {s['mean'] * 1000:>9.1f} | "
+                  f"{s['max'] * 1000:>9.1f} | {100 * s['total'] / wall:>5.1f}%")
+
+    def write_chrome_trace(self, path):
+        """Write the spans in Chrome trace-event format ("X" complete events, microseconds)."""
+        pid = os.getpid()
+        events = [{
+            'name': name, 'ph': 'X', 'pid': pid, 'tid': tid,
+            'ts': round(start * 1e6, 1), 'dur': round(duration * 1e6, 1), 'args': args,
+        } for name, start, duration, tid, args in self.events]
+        events.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': self.name}})
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        return path
+
+    def report(self, audio_seconds=None, trace_path=None):
+        """Print the summary table and write the Chrome trace; returns the trace path."""
+        self.finish()
+        self.print_summary(audio_seconds)
+        path = self.write_chrome_trace(trace_path or PROFILE_DIR / f"{self.name}.trace.json")
+        print(f"   📈 Chrome trace: {path}")
+        return path
+
+
+def span(name, **args):
+    """Time a block under the active profiler (no-op when profiling is off)."""
+    if _active is None:
+        return contextlib.nullcontext()
+    return _active.span(name, **args)
+
+
+@contextlib.contextmanager
+def segment(index, **args):
+    """Mark the enclosing block as work for speech segment `index` (in this thread)."""
+    if _active is None:
+        yield
+        return
+    previous = getattr(_local, 'segment', None)
+    _local.segment = index
+    try:
+        with _active.span('segment', segment=index, **args):
+            yield
+    finally:
+        _local.segment = previous
+
+
+@contextlib.contextmanager
+def profiling(name, sync_cuda=False):
+    """Activate a Profiler for the duration of the block."""
+    global _active
+    previous = _active
+    _active = Profiler(name, sync_cuda)
+    try:
+        yield _active
+    finally:
+        _active = previous
+
+
+def active():
+    return _active
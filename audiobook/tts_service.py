@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Persistent local TTS service.
+
+Loading Chatterbox-Turbo takes longer than narrating a short verification
+sample, and every script used to load its own copy. This daemon loads the model
+once, keeps it and the per-voice conditionals warm, and serves segment jobs over
+localhost HTTP:
+
+    GET  /health    -> {"sample_rate", "device", "queued"}
+    POST /segments  -> {"segments": [{"text", "voice"}], "quality", "seed", "priority"}
+
+Segments from all requests share one priority queue (lower number = sooner), so
+a verification run jumps ahead of a chapter that is already rendering. Each
+response streams raw float32 PCM frames back as segments finish:
+`<int32 index><uint32 byte count><samples>`; a byte count of 0 marks a failed
+segment.
+
+Scripts call `get_tts()`, which returns a thin `TTSClient` when the service is
+running and falls back to loading the model in-process otherwise.
+
+Usage:
+    python tts_service.py --device cuda --port 8765
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import queue
+import struct
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+from tts_model import load_tts_model
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = int(os.environ.get("TTS_SERVICE_PORT", 8765))
+SERVICE_URL = os.environ.get("TTS_SERVICE_URL", f"http://{DEFAULT_HOST}:{DEFAULT_PORT}")
+
+# Lower runs first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 10
+
+FRAME_HEADER = struct.Struct('<iI')
+
+
+class TTSService:
+    """Owns the warm model and synthesizes queued segments one at a time, by priority."""
+
+    def __init__(self, model):
+        from voice_conditionals import get_conditionals_cache
+
+        self.model = model
+        self.conds_cache = get_conditionals_cache()
+        self.jobs = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, segments, quality="final", seed=None, priority=PRIORITY_BULK):
+        """Queue a request's segments; returns (results queue, cancel event)."""
+        results = queue.Queue()
+        cancelled = threading.Event()
+        for index, segment in enumerate(segments):
+            job = dict(index=index, text=segment['text'], voice=segment.get('voice'),
+                       quality=quality, seed=seed, results=results, cancelled=cancelled)
+            # The sequence number keeps FIFO order within a priority (and avoids comparing dicts)
+            self.jobs.put((priority, next(self._seq), job))
+        return results, cancelled
+
+    def _run(self):
+        import torch
+        from tts_synth import synthesize
+
+        while True:
+            _, _, job = self.jobs.get()
+            if job['cancelled'].is_set():
+                continue
+            try:
+                self.conds_cache.apply(self.model, job['voice'])
+                if job['seed'] is not None:
+                    torch.manual_seed(job['seed'])
+                wav = synthesize(self.model, job['text'], job['quality'])
+                job['results'].put((job['index'], wav.to(torch.float32).numpy()[0]))
+            except Exception as e:
+                logger.error(f"❌ Segment failed: {e}")
+                job['results'].put((job['index'], None))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    service = None
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/health":
+            return self._send_json({"error": "not found"}, 404)
+        self._send_json({
+            "sample_rate": self.service.model.sr,
+            "device": str(self.service.model.device),
+            "precision": getattr(self.service.model, 'precision', 'fp32'),
+            "backend": getattr(self.service.model, 'backend', 'torch'),
+            "queued": self.service.jobs.qsize(),
+        })
+
+    def do_POST(self):
+        if self.path != "/segments":
+            return self._send_json({"error": "not found"}, 404)
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            segments = request['segments']
+        except (ValueError, KeyError) as e:
+            return self._send_json({"error": f"bad request: {e}"}, 400)
+
+        results, cancelled = self.service.submit(
+            segments,
+            quality=request.get('quality', 'final'),
+            seed=request.get('seed'),
+            priority=request.get('priority', PRIORITY_BULK),
+        )
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("X-Sample-Rate", str(self.service.model.sr))
+        self.send_header("X-Sample-Format", "float32")
+        self.end_headers()
+
+        # No Content-Length: the body is the stream of frames and ends when the connection closes
+        try:
+            for _ in range(len(segments)):
+                index, samples = results.get()
+                data = b'' if samples is None else samples.astype('<f4').tobytes()
+                self.wfile.write(FRAME_HEADER.pack(index, len(data)) + data)
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # Client went away: drop its remaining segments from the queue
+            cancelled.set()
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, device=None, precision="fp32", backend=None):
+    """Load the model once and serve segment jobs until interrupted."""
+    logger.info("🎙️  Loading Chatterbox-Turbo for the TTS service...")
+    model = load_tts_model(device, precision=precision, backend=backend)
+    _Handler.service = TTSService(model)
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    logger.info(f"✅ TTS service listening on http://{host}:{port} ({model.device})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("🛑 TTS service stopped")
+    finally:
+        server.server_close()
+
+
+class TTSClient:
+    """Thin client for the TTS service; stands in for the model in generate_long_audio."""
+
+    def __init__(self, url=SERVICE_URL, priority=PRIORITY_BULK, timeout=None):
+        from urllib.parse import urlsplit
+
+        parts = urlsplit(url)
+        self.url = url
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.priority = priority
+        self.timeout = timeout
+        health = self._get_json("/health", timeout=2)
+        self.sr = health['sample_rate']
+        self.device = f"service:{health['device']}"
+        self.precision = health.get('precision', 'fp32')
+        self.backend = health.get('backend', 'torch')
+
+    def _connection(self, timeout=None):
+        import http.client
+        return http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+
+    def _get_json(self, path, timeout=None):
+        conn = self._connection(timeout)
+        try:
+            conn.request("GET", path)
+            response = conn.getresponse()
+            return json.loads(response.read())
+        finally:
+            conn.close()
+
+    def synthesize_segments(self, items, quality="final", seed=None, priority=None):
+        """Synthesize plan items remotely, yielding (item index, (1, samples) tensor or None) as they finish."""
+        import numpy as np
+        import torch
+
+        if not items:
+            return
+        payload = {
+            'segments': [{'text': item['text'], 'voice': str(item['voice']) if item.get('voice') else None}
+                         for item in items],
+            'quality': quality,
+            'seed': seed,
+            'priority': self.priority if priority is None else priority,
+        }
+        body = json.dumps(payload).encode('utf-8')
+        conn = self._connection(self.timeout)
+        try:
+            conn.request("POST", "/segments", body=body, headers={"Content-Type": "application/json"})
+            response = conn.getresponse()
+            if response.status != 200:
+                raise RuntimeError(f"TTS service error {response.status}: {response.read()[:200]!r}")
+            for _ in range(len(items)):
+                header = response.read(FRAME_HEADER.size)
+                if len(header) < FRAME_HEADER.size:
+                    raise RuntimeError("TTS service closed the stream early")
+                index, nbytes = FRAME_HEADER.unpack(header)
+                if not nbytes:
+                    print(f"   ⚠️  Service failed on segment {index + 1}")
+                    yield index, None
+                    continue
+                samples = np.frombuffer(response.read(nbytes), dtype='<f4').copy()
+                yield index, torch.from_numpy(samples).unsqueeze(0)
+        finally:
+            conn.close()
+
+    def generate(self, text, audio_prompt_path=None, quality="final", seed=None, **_):
+        """Single-line counterpart of ChatterboxTurboTTS.generate."""
+        item = {'text': text, 'voice': audio_prompt_path}
+        for _, wav in self.synthesize_segments([item], quality, seed):
+            if wav is None:
+                raise RuntimeError("TTS service failed to synthesize the segment")
+            return wav
+
+
+def connect(url=SERVICE_URL, priority=PRIORITY_BULK):
+    """Return a TTSClient if the service is reachable, else None."""
+    try:
+        return TTSClient(url, priority=priority)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def get_tts(device=None, priority=PRIORITY_BULK, precision="fp32", backend=None):
+    """Use the running TTS service if there is one; otherwise load the model here.
+
+    A running service keeps its own precision and backend; `precision` and
+    `backend` apply to local loads.
+    """
+    client = connect(priority=priority)
+    if client:
+        print(f"🔌 Using TTS service at {client.url} ({client.device}, {client.precision})")
+        return client
+    return load_tts_model(device, precision=precision, backend=backend)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Persistent Chatterbox-Turbo TTS service")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--device", default=None, choices=["cuda", "cpu"])
+    parser.add_argument("--precision", default="fp32", choices=["fp32", "bf16", "int8"],
+                        help="T3 inference precision (bf16 autocast or int8 dynamic quantization)")
+    parser.add_argument("--backend", default=None, choices=["torch", "onnx"],
+                        help="S3Gen backend (default: $TTS_BACKEND or torch)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    serve(args.host, args.port, args.device, args.precision, args.backend)
+
+
+if __name__ == "__main__":
+    main()
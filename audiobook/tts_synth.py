@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+Low-level Chatterbox-Turbo synthesis primitives.
+
+`ChatterboxTurboTTS.generate` handles exactly one line at batch size 1. The
+functions here split it into its stages (text tokenization, T3 speech-token
+generation, S3Gen vocoding, watermarking) so that several same-voice lines can
+share one batched T3 decode, and so token generation for one line can overlap
+vocoding of the previous one.
+"""
+
+import contextlib
+import copy
+import logging
+import queue
+import threading
+from collections import OrderedDict
+
+import torch
+import torch.nn.functional as F
+
+from tts_profiler import segment, span
+
+logger = logging.getLogger(__name__)
+
+# Chatterbox-Turbo constants (see chatterbox.tts_turbo / s3gen.const)
+SPEECH_VOCAB_SIZE = 6561
+S3GEN_SIL = 4299
+
+# Voices whose T3 conditioning-prefix KV state is kept (each is tens of MB)
+PREFIX_CACHE_VOICES = 8
+
+# Default sampling settings of ChatterboxTurboTTS.generate
+DEFAULT_SAMPLING = dict(
+    temperature=0.8,
+    top_k=1000,
+    top_p=0.95,
+    repetition_penalty=1.2,
+)
+
+# Generation profiles. "draft" is for proof listening only: a single MeanFlow
+# step instead of two (the HiFT vocoder is already single-pass), a narrow top-k
+# with no nucleus or repetition-penalty pass, and no peak normalization.
+QUALITY_PROFILES = {
+    'final': dict(sampling=DEFAULT_SAMPLING, n_cfm_timesteps=2, normalize=True),
+    'draft': dict(
+        sampling=dict(temperature=0.8, top_k=50, top_p=1.0, repetition_penalty=1.0),
+        n_cfm_timesteps=1,
+        normalize=False,
+    ),
+}
+
+
+def _logits_processors(temperature, top_k, top_p, repetition_penalty):
+    from transformers.generation.logits_process import (
+        LogitsProcessorList,
+        RepetitionPenaltyLogitsProcessor,
+        TemperatureLogitsWarper,
+        TopKLogitsWarper,
+        TopPLogitsWarper,
+    )
+    processors = LogitsProcessorList()
+    if temperature > 0 and temperature != 1.0:
+        processors.append(TemperatureLogitsWarper(temperature))
+    if top_k > 0:
+        processors.append(TopKLogitsWarper(top_k))
+    if top_p < 1.0:
+        processors.append(TopPLogitsWarper(top_p))
+    if repetition_penalty != 1.0:
+        processors.append(RepetitionPenaltyLogitsProcessor(repetition_penalty))
+    return processors
+
+
+def t3_precision(model):
+    """Autocast context for the T3 decoder under the model's precision mode (see tts_model.apply_precision)."""
+    if getattr(model, 'precision', 'fp32') == 'bf16':
+        device_type = 'cuda' if str(model.device).startswith('cuda') else 'cpu'
+        return torch.autocast(device_type, dtype=torch.bfloat16)
+    return contextlib.nullcontext()
+
+
+def tokenize_text(model, text):
+    """Normalize punctuation and tokenize one line exactly like generate() does."""
+    from chatterbox.tts_turbo import punc_norm
+    with span('tokenize'):
+        text = punc_norm(text)
+        tokens = model.tokenizer(text, return_tensors="pt", truncation=True).input_ids
+        return tokens[0].to(model.device)
+
+
+def conditioning_prefix(model):
+    """T3 KV cache for the active voice's conditioning prefix, computed once per voice.
+
+    The prefix (speaker embedding plus prompt speech tokens) is identical for
+    every line in a voice, so its attention keys/values are kept per voice (the
+    most recent PREFIX_CACHE_VOICES) and forked for each decode. Returns
+    (prefix length, past_key_values); never extend the returned cache in place.
+    """
+    cond = model.conds.t3
+    cache = model.__dict__.setdefault('_prefix_cache', OrderedDict())
+    key = id(cond)
+    if key in cache and cache[key][0] is cond:
+        cache.move_to_end(key)
+        return cache[key][1], cache[key][2]
+
+    t3 = model.t3
+    with span('t3_prefix'):
+        cond_emb = t3.prepare_conditioning(cond)  # (1, len_cond, dim)
+        outputs = t3.tfmr(inputs_embeds=cond_emb, use_cache=True)
+    # Keep the Conditionals object alive with its entry so its id is not reused
+    cache[key] = (cond, cond_emb.size(1), outputs.past_key_values)
+    while len(cache) > PREFIX_CACHE_VOICES:
+        cache.popitem(last=False)
+    return cache[key][1], cache[key][2]
+
+
+def _fork_prefix(prefix, batch):
+    """A private copy of a cached prefix KV state, repeated for `batch` rows."""
+    past = copy.deepcopy(prefix)
+    if batch == 1:
+        return past
+    if hasattr(past, 'batch_repeat_interleave'):
+        # transformers Cache object
+        past.batch_repeat_interleave(batch)
+        return past
+    return tuple(tuple(t.repeat_interleave(batch, dim=0) for t in layer) for layer in past)
+
+
+@torch.inference_mode()
+def generate_speech_tokens_batch(model, text_token_list, max_gen_len=1000, **sampling):
+    """Run the T3 decoder for several lines of the *same voice* at once.
+
+    Rows are left-padded between the shared conditioning prefix and each line's
+    text so every row ends at the same column; pads are masked out and position
+    ids are set explicitly so each row sees exactly what a batch-size-1 call
+    would. The prefix itself is not re-run: every row starts from a copy of the
+    voice's cached KV state (see conditioning_prefix). Returns one 1-D
+    LongTensor of speech tokens per input row.
+    """
+    t3 = model.t3
+    sampling = {**DEFAULT_SAMPLING, **sampling}
+    processors = _logits_processors(**sampling)
+    device = t3.device
+    batch = len(text_token_list)
+
+    # The voice's conditioning prefix is already in the KV cache; only the lines' own tokens run here
+    len_cond, prefix = conditioning_prefix(model)
+
+    start_token = torch.full((1, 1), t3.hp.start_speech_token, dtype=torch.long, device=device)
+    row_embeds = []
+    for text_tokens in text_token_list:
+        text_tokens = text_tokens.unsqueeze(0)
+        text_emb = t3.text_emb(text_tokens)
+        speech_emb = t3.speech_emb(start_token)
+        if t3.hp.input_pos_emb == "learned":
+            text_emb = text_emb + t3.text_pos_emb(text_tokens)
+            speech_emb = speech_emb + t3.speech_pos_emb(start_token)
+        row_embeds.append(torch.cat([text_emb, speech_emb], dim=1)[0])
+
+    row_lens = [e.size(0) for e in row_embeds]
+    max_len = max(row_lens)
+    dim = row_embeds[0].size(-1)
+
+    embeds = torch.zeros(batch, max_len, dim, dtype=row_embeds[0].dtype, device=device)
+    attention_mask = torch.zeros(batch, len_cond + max_len, dtype=torch.long, device=device)
+    position_ids = torch.zeros(batch, max_len, dtype=torch.long, device=device)
+    for b, (emb, n) in enumerate(zip(row_embeds, row_lens)):
+        pad = max_len - n
+        embeds[b, pad:] = emb
+        attention_mask[b, :len_cond] = 1
+        attention_mask[b, len_cond + pad:] = 1
+        position_ids[b, pad:] = torch.arange(len_cond, len_cond + n, device=device)
+
+    outputs = t3.tfmr(
+        inputs_embeds=embeds,
+        attention_mask=attention_mask,
+        position_ids=position_ids,
+        past_key_values=_fork_prefix(prefix, batch),
+        use_cache=True,
+    )
+    past_key_values = outputs.past_key_values
+    next_positions = position_ids[:, -1:] + 1
+
+    stop_token = t3.hp.stop_speech_token
+    generated = []
+    finished = torch.zeros(batch, 1, dtype=torch.bool, device=device)
+    input_ids = start_token.expand(batch, 1)
+    # Sample in float32 whatever precision the decoder ran in
+    logits = t3.speech_head(outputs[0][:, -1:])[:, -1, :].float()
+
+    for _ in range(max_gen_len + 1):
+        processed = processors(input_ids, logits)
+        probs = F.softmax(processed, dim=-1)
+        next_token = torch.multinomial(probs, num_samples=1)
+        next_token = torch.where(finished, torch.full_like(next_token, stop_token), next_token)
+        generated.append(next_token)
+        finished = finished | (next_token == stop_token)
+        if bool(finished.all()):
+            break
+
+        input_ids = torch.cat(generated, dim=1)
+        attention_mask = torch.cat([attention_mask, torch.ones(batch, 1, dtype=torch.long, device=device)], dim=1)
+        outputs = t3.tfmr(
+            inputs_embeds=t3.speech_emb(next_token),
+            attention_mask=attention_mask,
+            position_ids=next_positions,
+            past_key_values=past_key_values,
+            use_cache=True,
+        )
+        past_key_values = outputs.past_key_values
+        next_positions = next_positions + 1
+        logits = t3.speech_head(outputs[0])[:, -1, :].float()
+
+    all_tokens = torch.cat(generated, dim=1)
+    results = []
+    for row in all_tokens:
+        stops = (row == stop_token).nonzero()
+        results.append(row[:stops[0, 0]] if len(stops) else row)
+    return results
+
+
+@torch.inference_mode()
+def vocode(model, speech_tokens, n_cfm_timesteps=2, ref_dict=None):
+    """Turn T3 speech tokens into a watermarked (1, samples) waveform.
+
+    `ref_dict` is the voice's S3Gen reference (default: the active conditionals).
+    """
+    speech_tokens = speech_tokens[speech_tokens < SPEECH_VOCAB_SIZE].to(model.device)
+    silence = torch.tensor([S3GEN_SIL] * 3, dtype=torch.long, device=model.device)
+    speech_tokens = torch.cat([speech_tokens, silence])
+
+    with span('s3gen'):
+        wav, _ = model.s3gen.inference(
+            speech_tokens=speech_tokens,
+            ref_dict=model.conds.gen if ref_dict is None else ref_dict,
+            n_cfm_timesteps=n_cfm_timesteps,
+        )
+    with span('watermark'):
+        wav = wav.squeeze(0).detach().cpu().numpy()
+        wav = model.watermarker.apply_watermark(wav, sample_rate=model.sr)
+        return torch.from_numpy(wav).unsqueeze(0)
+
+
+@torch.inference_mode()
+def generate_batch(model, texts, n_cfm_timesteps=2, **sampling):
+    """Synthesize several lines that share the currently active voice conditionals.
+
+    Equivalent to calling `model.generate(text)` for each text (same sampling
+    settings and post-processing), but with a single batched T3 decode.
+    """
+    text_tokens = [tokenize_text(model, t) for t in texts]
+    # Includes t3_prefix on a voice's first decode
+    with t3_precision(model), span('t3', rows=len(texts)):
+        speech_tokens = generate_speech_tokens_batch(model, text_tokens, **sampling)
+    return [vocode(model, tokens, n_cfm_timesteps) for tokens in speech_tokens]
+
+
+@torch.inference_mode()
+def synthesize(model, text, quality="final"):
+    """Synthesize one line with the active voice at the given quality profile and the model's precision.
+
+    Uses the staged path rather than model.generate so the voice's cached
+    conditioning prefix is reused.
+    """
+    profile = QUALITY_PROFILES[quality]
+    return generate_batch(model, [text], profile['n_cfm_timesteps'], **profile['sampling'])[0]
+
+
+def iter_pipelined(model, jobs, conds_cache, quality="final", stage_threads=None, depth=2):
+    """Two-stage synthesis: T3 generates the next line's speech tokens while S3Gen vocodes this one.
+
+    `jobs` yields (key, text, voice). A producer thread runs tokenization and T3
+    into a queue bounded at `depth` lines; the calling thread vocodes them with
+    each line's own voice reference. Yields (key, wav or None, error) in job order.
+
+    torch's intra-op thread count is process-wide, so the stages cannot get
+    separate budgets. It is set once, before the producer starts, to
+    `stage_threads` (default: half the current count), so the two stages' ops
+    running at the same time together use about the original count. It is
+    restored afterwards.
+
+    Both stages draw from torch's global RNG concurrently, so output is not
+    reproducible under a fixed seed; use the sequential path for seeded runs.
+    """
+    profile = QUALITY_PROFILES[quality]
+    total_threads = torch.get_num_threads()
+    stage_threads = stage_threads or max(1, total_threads // 2)
+    tokens = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+
+    def put(entry):
+        while not stop.is_set():
+            try:
+                tokens.put(entry, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def produce():
+        try:
+            for key, text, voice in jobs:
+                if stop.is_set():
+                    break
+                try:
+                    with segment(key):
+                        with span('conditioning'):
+                            conds = conds_cache.apply(model, voice)
+                        text_tokens = tokenize_text(model, text)
+                        with t3_precision(model), span('t3', rows=1):
+                            speech_tokens = generate_speech_tokens_batch(model, [text_tokens], **profile['sampling'])[0]
+                    put((key, speech_tokens, conds.gen, None))
+                except Exception as e:
+                    put((key, None, None, e))
+        finally:
+            put(done)
+
+    torch.set_num_threads(stage_threads)
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            entry = tokens.get()
+            if entry is done:
+                break
+            key, speech_tokens, ref_dict, error = entry
+            wav = None
+            if error is None:
+                try:
+                    with segment(key):
+                        wav = vocode(model, speech_tokens, profile['n_cfm_timesteps'], ref_dict)
+                except Exception as e:
+                    error = e
+            yield key, wav, error
+    finally:
+        stop.set()
+        torch.set_num_threads(total_threads)
+
+
+def plan_batches(items, batch_size, key=len):
+    """Group indices of `items` into length-bucketed batches of at most `batch_size`.
+
+    Items are sorted by `key` so each batch holds similar lengths and padding
+    (and wasted decode steps) stays small. Returns lists of original indices.
+    """
+    order = sorted(range(len(items)), key=lambda i: key(items[i]))
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
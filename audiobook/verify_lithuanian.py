@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 import torch
 from pathlib import Path
-from chatterbox.tts_turbo import ChatterboxTurboTTS
+from tts_service import PRIORITY_INTERACTIVE, get_tts
 from tts_helpers import generate_long_audio
 
 def verify():
@@ -9,13 +9,8 @@ def verify():
     # Force float32 globally to avoid CPU dtype mismatch (float != double)
     torch.set_default_dtype(torch.float32)
     print(f"🎙️ Using device: {device}")
-    model = ChatterboxTurboTTS.from_pretrained(device=device)
-    
-    # Deep cast internal modules to float32 if on CPU
-    if device == "cpu":
-        for attr in ['t3', 've', 's3gen', 'vocoder']:
-            if hasattr(model, attr):
-                getattr(model, attr).to(torch.float32)
+    # Thin client if the TTS service is running (no model load), else a local model
+    model = get_tts(device, priority=PRIORITY_INTERACTIVE)
     
     text_path = Path("preprocessed/01_prologue.txt")
     output_path = Path("output/verification_chapter1.wav")
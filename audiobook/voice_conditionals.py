@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Per-voice conditioning cache for Chatterbox generation.
+
+`model.generate(..., audio_prompt_path=...)` reloads, resamples and re-encodes the
+reference WAV on every call. This module computes the conditionals (speaker
+embedding, prompt speech tokens, S3Gen reference mels) once per voice, keeps them
+in an in-memory LRU and persists them under cache/voice_conds/ keyed by the
+reference file hash and model version, so they are reused across lines, chapters
+and runs.
+"""
+
+import hashlib
+import logging
+from collections import OrderedDict
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+CONDS_CACHE_DIR = Path(__file__).parent / "cache" / "voice_conds"
+
+_file_hashes = {}
+
+
+def file_sha256(path):
+    """SHA-256 of a file, memoized on (path, size, mtime)."""
+    path = Path(path)
+    stat = path.stat()
+    memo_key = (str(path.resolve()), stat.st_size, stat.st_mtime_ns)
+    digest = _file_hashes.get(memo_key)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        digest = h.hexdigest()
+        _file_hashes[memo_key] = digest
+    return digest
+
+
+def model_version(model=None):
+    """Identify the TTS model so cached artifacts are invalidated on upgrades."""
+    try:
+        from importlib.metadata import version
+        pkg_version = version("chatterbox-tts")
+    except Exception:
+        pkg_version = "unknown"
+    model_name = type(model).__name__ if model is not None else "ChatterboxTurboTTS"
+    return f"{model_name}-{pkg_version}"
+
+
+class VoiceConditionalsCache:
+    """LRU of Chatterbox `Conditionals`, backed by a persistent on-disk store."""
+
+    def __init__(self, max_entries=16, cache_dir=CONDS_CACHE_DIR, exaggeration=0.0, norm_loudness=False):
+        self.max_entries = max_entries
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        # Must match the arguments generate() would pass to prepare_conditionals()
+        self.exaggeration = exaggeration
+        self.norm_loudness = norm_loudness
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def cache_key(self, model, voice_path):
+        return "{}_{}_ex{:g}_{}".format(
+            file_sha256(voice_path)[:32],
+            model_version(model),
+            self.exaggeration,
+            "norm" if self.norm_loudness else "raw",
+        )
+
+    def get(self, model, voice_path):
+        """Return the conditionals for `voice_path`, computing them at most once."""
+        key = self.cache_key(model, voice_path)
+
+        conds = self._entries.get(key)
+        if conds is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return conds
+
+        self.misses += 1
+        conds = self._load_from_disk(model, key)
+        if conds is None:
+            logger.info(f"🎛️ Computing conditionals for voice: {Path(voice_path).name}")
+            model.prepare_conditionals(
+                str(voice_path),
+                exaggeration=self.exaggeration,
+                norm_loudness=self.norm_loudness,
+            )
+            conds = model.conds
+            self._save_to_disk(conds, key)
+
+        self._entries[key] = conds
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return conds
+
+    def apply(self, model, voice_path):
+        """Activate the conditionals for `voice_path` on the model (None = built-in voice)."""
+        # Remember the model's built-in voice before any reference voice overwrites it
+        if not hasattr(model, '_builtin_conds'):
+            model._builtin_conds = model.conds
+
+        if voice_path:
+            model.conds = self.get(model, voice_path)
+        else:
+            model.conds = model._builtin_conds
+        return model.conds
+
+    def _disk_path(self, key):
+        return self.cache_dir / f"{key}.pt"
+
+    def _load_from_disk(self, model, key):
+        if not self.cache_dir:
+            return None
+        path = self._disk_path(key)
+        if not path.exists():
+            return None
+        try:
+            from chatterbox.tts_turbo import Conditionals
+            conds = Conditionals.load(path, map_location="cpu").to(model.device)
+            logger.info(f"♻️ Loaded cached conditionals: {path.name}")
+            return conds
+        except Exception as e:
+            logger.warning(f"⚠️ Ignoring unreadable conditionals cache {path.name}: {e}")
+            return None
+
+    def _save_to_disk(self, conds, key):
+        if not self.cache_dir:
+            return
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            path = self._disk_path(key)
+            tmp_path = path.with_suffix('.tmp')
+            conds.save(tmp_path)
+            tmp_path.replace(path)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not persist conditionals: {e}")
+
+
+_default_cache = None
+
+
+def get_conditionals_cache():
+    """Process-wide cache shared by every generate_long_audio call."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = VoiceConditionalsCache()
+    return _default_cache
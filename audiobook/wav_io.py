@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Streaming WAV reading/writing helpers.
+
+Chapter audio is written segment by segment instead of being accumulated in
+memory: the header is rewritten after every block so a crash still leaves a
+playable file, and peak normalization is applied in a cheap second pass over
+a memory-mapped copy of the data.
+"""
+
+import struct
+from pathlib import Path
+
+import numpy as np
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# sample_format -> (format tag, bits per sample, numpy dtype)
+SAMPLE_FORMATS = {
+    'int16': (WAVE_FORMAT_PCM, 16, np.dtype('<i2')),
+    # 24-bit samples are held as int32 and packed to 3 bytes on write
+    'int24': (WAVE_FORMAT_PCM, 24, np.dtype('<i4')),
+    'float32': (WAVE_FORMAT_IEEE_FLOAT, 32, np.dtype('<f4')),
+}
+
+
+def _to_numpy(samples):
+    """Accept torch tensors or arrays shaped (channels, frames) or (frames,); return interleaved samples."""
+    if hasattr(samples, 'detach'):
+        samples = samples.detach().cpu().numpy()
+    samples = np.asarray(samples)
+    if samples.ndim == 2:
+        # (channels, frames) -> interleaved (frames, channels)
+        samples = samples.T
+    return samples
+
+
+def float_to_int16(samples):
+    """Scale [-1, 1] floats to int16 with clipping."""
+    return np.clip(np.round(samples * 32767.0), -32768, 32767).astype('<i2')
+
+
+def float_to_int24(samples):
+    """Scale [-1, 1] floats to 24-bit integers (held in int32) with clipping."""
+    return np.clip(np.round(samples * 8388607.0), -8388608, 8388607).astype('<i4')
+
+
+def _pack_int24(samples):
+    """int32 samples -> packed little-endian 24-bit bytes."""
+    return np.ascontiguousarray(samples, dtype='<i4').view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+
+
+def _unpack_int24(raw):
+    """(..., 3) uint8 little-endian 24-bit samples -> float32 in [-1, 1)."""
+    raw = raw.astype(np.int32)
+    samples = raw[..., 0] | (raw[..., 1] << 8) | (raw[..., 2] << 16)
+    # Sign-extend bit 23
+    samples = (samples ^ 0x800000) - 0x800000
+    return samples.astype(np.float32) * (1.0 / 8388608.0)
+
+
+class StreamingWavWriter:
+    """Append-only WAV writer that keeps a valid header on disk at all times."""
+
+    def __init__(self, path, sample_rate, channels=1, sample_format='int16'):
+        self.path = Path(path)
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.sample_format = sample_format
+        self.format_tag, self.bits, self.dtype = SAMPLE_FORMATS[sample_format]
+        self.frames = 0
+        self.peak = 0.0
+        self._file = open(self.path, 'wb')
+        self._file.write(self._header(0))
+        self._data_offset = self._file.tell()
+
+    @property
+    def block_align(self):
+        return self.channels * self.bits // 8
+
+    @property
+    def duration(self):
+        return self.frames / self.sample_rate
+
+    def _header(self, data_bytes):
+        byte_rate = self.sample_rate * self.block_align
+        if self.format_tag == WAVE_FORMAT_PCM:
+            fmt = struct.pack('<HHIIHH', self.format_tag, self.channels, self.sample_rate,
+                              byte_rate, self.block_align, self.bits)
+            extra = b''
+        else:
+            # Non-PCM formats need cbSize and a fact chunk
+            fmt = struct.pack('<HHIIHHH', self.format_tag, self.channels, self.sample_rate,
+                              byte_rate, self.block_align, self.bits, 0)
+            extra = b'fact' + struct.pack('<II', 4, data_bytes // self.block_align)
+        riff_size = 4 + (8 + len(fmt)) + len(extra) + (8 + data_bytes)
+        return (b'RIFF' + struct.pack('<I', riff_size) + b'WAVE'
+                + b'fmt ' + struct.pack('<I', len(fmt)) + fmt
+                + extra
+                + b'data' + struct.pack('<I', data_bytes))
+
+    def write(self, samples):
+        """Append samples (float in [-1, 1] or already-typed integers)."""
+        samples = _to_numpy(samples)
+        if samples.size == 0:
+            return
+        if samples.dtype.kind == 'f':
+            self.peak = max(self.peak, float(np.abs(samples).max()))
+            if self.sample_format == 'int16':
+                samples = float_to_int16(samples)
+            elif self.sample_format == 'int24':
+                samples = float_to_int24(samples)
+        data = np.ascontiguousarray(samples, dtype=self.dtype)
+        self._file.write(_pack_int24(data) if self.bits == 24 else data.tobytes())
+        self.frames += data.size // self.channels
+        self._update_header()
+
+    def write_silence(self, seconds=None, frames=None):
+        frames = frames if frames is not None else int(self.sample_rate * seconds)
+        if frames > 0:
+            self.write(np.zeros((self.channels, frames) if self.channels > 1 else frames, dtype=self.dtype))
+
+    def truncate(self, frames):
+        """Drop everything written after the first `frames` frames (the peak is not recomputed)."""
+        if frames >= self.frames:
+            return
+        self._file.seek(self._data_offset + frames * self.block_align)
+        self._file.truncate()
+        self.frames = frames
+        self._update_header()
+
+    def _update_header(self):
+        pos = self._file.tell()
+        self._file.seek(0)
+        self._file.write(self._header(self.frames * self.block_align))
+        self._file.seek(pos)
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self._update_header()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_wav_info(path):
+    """Parse a WAV header without decoding samples.
+
+    Returns a dict with format_tag, channels, sample_rate, bits, data_offset,
+    data_bytes and frames.
+    """
+    with open(path, 'rb') as f:
+        riff, _, wave = struct.unpack('<4sI4s', f.read(12))
+        if riff != b'RIFF' or wave != b'WAVE':
+            raise ValueError(f"{path} is not a RIFF/WAVE file")
+        info = None
+        while True:
+            chunk_header = f.read(8)
+            if len(chunk_header) < 8:
+                raise ValueError(f"{path} has no data chunk")
+            chunk_id, chunk_size = struct.unpack('<4sI', chunk_header)
+            if chunk_id == b'fmt ':
+                fmt = f.read(chunk_size)
+                format_tag, channels, sample_rate, _, block_align, bits = struct.unpack('<HHIIHH', fmt[:16])
+                if format_tag == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+                    format_tag = struct.unpack('<H', fmt[24:26])[0]
+                info = dict(format_tag=format_tag, channels=channels, sample_rate=sample_rate,
+                            bits=bits, block_align=block_align)
+                if chunk_size % 2:
+                    f.seek(1, 1)
+            elif chunk_id == b'data':
+                if info is None:
+                    raise ValueError(f"{path}: data chunk before fmt chunk")
+                data_offset = f.tell()
+                file_size = Path(path).stat().st_size
+                # Streaming writers may leave 0 or 0xFFFFFFFF as the size; trust the file length then
+                data_bytes = chunk_size
+                if chunk_size in (0, 0xFFFFFFFF) or data_offset + chunk_size > file_size:
+                    data_bytes = file_size - data_offset
+                data_bytes -= data_bytes % info['block_align']
+                info.update(data_offset=data_offset, data_bytes=data_bytes,
+                            frames=data_bytes // info['block_align'])
+                return info
+            else:
+                f.seek(chunk_size + (chunk_size % 2), 1)
+
+
+def _numpy_dtype(info):
+    if info['format_tag'] == WAVE_FORMAT_IEEE_FLOAT:
+        return np.dtype('<f4') if info['bits'] == 32 else np.dtype('<f8')
+    if info['format_tag'] == WAVE_FORMAT_PCM and info['bits'] in (16, 32):
+        return np.dtype('<i2') if info['bits'] == 16 else np.dtype('<i4')
+    raise ValueError(f"Unsupported WAV sample format (tag {info['format_tag']}, {info['bits']} bits)")
+
+
+def memmap_wav(path, info=None):
+    """Memory-map a WAV's samples as a (frames, channels) array."""
+    info = info or read_wav_info(path)
+    dtype = _numpy_dtype(info)
+    return np.memmap(path, dtype=dtype, mode='r', offset=info['data_offset'],
+                     shape=(info['frames'], info['channels']))
+
+
+def memmap_wav_frames(path, info=None):
+    """Memory-map a WAV's raw sample bytes as a (frames, block_align) uint8 array (any sample format)."""
+    info = info or read_wav_info(path)
+    return np.memmap(path, dtype=np.uint8, mode='r', offset=info['data_offset'],
+                     shape=(info['frames'], info['block_align']))
+
+
+def iter_wav_blocks(path, block_frames=1 << 16, info=None):
+    """Yield float32 (frames, channels) blocks scaled to [-1, 1].
+
+    Handles 16/24/32-bit PCM and float WAVs; other formats raise ValueError on the call itself.
+    """
+    info = info or read_wav_info(path)
+    if info['format_tag'] == WAVE_FORMAT_PCM and info['bits'] == 24:
+        data = memmap_wav_frames(path, info).reshape(info['frames'], info['channels'], 3)
+        decode = _unpack_int24
+    else:
+        data = memmap_wav(path, info)
+        scale = 1.0 / float(2 ** (info['bits'] - 1)) if data.dtype.kind == 'i' else None
+
+        def decode(raw):
+            block = np.array(raw, dtype=np.float32)
+            if scale is not None:
+                block *= scale
+            return block
+
+    def blocks():
+        for start in range(0, info['frames'], block_frames):
+            yield decode(data[start:start + block_frames])
+    return blocks()
+
+
+def write_scaled_wav(src_path, dst_path, gain=1.0, sample_format='int16', block_frames=1 << 16):
+    """Second pass: stream `src_path` into `dst_path`, multiplying by `gain`."""
+    info = read_wav_info(src_path)
+    with StreamingWavWriter(dst_path, info['sample_rate'], info['channels'], sample_format) as writer:
+        for block in iter_wav_blocks(src_path, block_frames, info):
+            if gain != 1.0:
+                block *= gain
+            writer.write(block.T)
+    return writer